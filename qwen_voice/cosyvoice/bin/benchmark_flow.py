@@ -0,0 +1,108 @@
+# Copyright (c) 2024 Alibaba Inc (authors: Xiang Lyu)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Quality/latency of the flow matching solvers at different step counts.
+
+Speech tokens of the text are decoded by the llm once, then every solver/steps
+combination runs the flow on the same tokens and the same noise. Quality is
+reported against a reference mel solved with many euler steps, latency is the
+mean flow time over --repeat runs.
+"""
+from __future__ import print_function
+
+import argparse
+import os
+import sys
+import time
+import torch
+ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append('{}/../..'.format(ROOT_DIR))
+from cosyvoice.cli.cosyvoice import CosyVoice
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description='benchmark flow matching solvers')
+    parser.add_argument('--model_dir', required=True, help='CosyVoice model dir')
+    parser.add_argument('--spk_id', default='中文女')
+    parser.add_argument('--text', default='收到好友从远方寄来的生日礼物，那份意外的惊喜与深深的祝福让我心中充满了甜蜜的快乐。')
+    parser.add_argument('--solvers', default='euler,heun,midpoint,dpm')
+    parser.add_argument('--steps', default='2,4,6,10', help='step counts to compare')
+    parser.add_argument('--reference_steps', type=int, default=50, help='euler steps of the reference mel')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--unfused_cfg', action='store_true', help='run the two cfg passes separately')
+    args = parser.parse_args()
+    print(args)
+    return args
+
+
+def sync(device):
+    if device.type == 'cuda':
+        torch.cuda.synchronize()
+
+
+def run_flow(model, model_input, token, n_timesteps, solver, seed=0):
+    torch.manual_seed(seed)
+    embedding = model_input['flow_embedding']
+    prompt_token = model_input.get('flow_prompt_speech_token', torch.zeros(1, 0, dtype=torch.int32))
+    prompt_feat = model_input.get('prompt_speech_feat', torch.zeros(1, 0, 80))
+    mel, _ = model.flow.inference(token=token,
+                                  token_len=torch.tensor([token.shape[1]], dtype=torch.int32).to(model.device),
+                                  prompt_token=prompt_token.to(model.device),
+                                  prompt_token_len=torch.tensor([prompt_token.shape[1]], dtype=torch.int32).to(model.device),
+                                  prompt_feat=prompt_feat.to(model.device),
+                                  prompt_feat_len=torch.tensor([prompt_feat.shape[1]], dtype=torch.int32).to(model.device),
+                                  embedding=embedding.to(model.device),
+                                  flow_cache=torch.zeros(1, 80, 0, 2),
+                                  n_timesteps=n_timesteps,
+                                  solver=solver)
+    return mel
+
+
+@torch.inference_mode()
+def main():
+    args = get_args()
+    cosyvoice = CosyVoice(args.model_dir, load_jit=False, fp16=False)
+    model = cosyvoice.model
+    model.flow.decoder.fused_cfg = not args.unfused_cfg
+    text = cosyvoice.frontend.text_normalize(args.text, split=False)
+    model_input = cosyvoice.frontend.frontend_sft(text, args.spk_id)
+    token = list(model.llm.inference(text=model_input['text'].to(model.device),
+                                     text_len=model_input['text_len'].to(model.device),
+                                     prompt_text=torch.zeros(1, 0, dtype=torch.int32).to(model.device),
+                                     prompt_text_len=torch.tensor([0], dtype=torch.int32).to(model.device),
+                                     prompt_speech_token=torch.zeros(1, 0, dtype=torch.int32).to(model.device),
+                                     prompt_speech_token_len=torch.tensor([0], dtype=torch.int32).to(model.device),
+                                     embedding=model_input['llm_embedding'].to(model.device)))
+    token = torch.tensor([token], dtype=torch.int32).to(model.device)
+    print('{} speech tokens'.format(token.shape[1]))
+
+    reference = run_flow(model, model_input, token, args.reference_steps, 'euler')
+    # warmup
+    run_flow(model, model_input, token, 2, 'euler')
+
+    print('{:>10} {:>6} {:>10} {:>10} {:>10}'.format('solver', 'steps', 'ms', 'mel l1', 'mel cos'))
+    for solver in args.solvers.split(','):
+        for n_timesteps in [int(i) for i in args.steps.split(',')]:
+            sync(model.device)
+            start = time.perf_counter()
+            for _ in range(args.repeat):
+                mel = run_flow(model, model_input, token, n_timesteps, solver)
+            sync(model.device)
+            ms = (time.perf_counter() - start) / args.repeat * 1000
+            l1 = (mel - reference).abs().mean().item()
+            cos = torch.nn.functional.cosine_similarity(mel.flatten(), reference.flatten(), dim=0).item()
+            print('{:>10} {:>6} {:>10.2f} {:>10.4f} {:>10.4f}'.format(solver, n_timesteps, ms, l1, cos))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,123 @@
+# Copyright (c) 2024 Alibaba Inc (authors: Xiang Lyu)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Per-token decode latency of the llm with torch.cat kv cache vs StaticKVCache.
+
+Uses a randomly initialized TransformerEncoder with the CosyVoice-300M llm shape,
+no pretrained model is needed.
+"""
+from __future__ import print_function
+
+import argparse
+import os
+import sys
+import time
+import torch
+ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append('{}/../..'.format(ROOT_DIR))
+from cosyvoice.transformer.encoder import TransformerEncoder
+from cosyvoice.transformer.kv_cache import StaticKVCache
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description='benchmark llm kv cache modes')
+    parser.add_argument('--prompt_len', type=int, default=100, help='prefill length')
+    parser.add_argument('--lengths', type=str, default='250,500,1000,2000', help='report points, in decoded tokens')
+    parser.add_argument('--window', type=int, default=20, help='tokens averaged at each report point')
+    parser.add_argument('--num_blocks', type=int, default=14)
+    parser.add_argument('--size', type=int, default=1024)
+    parser.add_argument('--heads', type=int, default=16)
+    parser.add_argument('--fp16', action='store_true')
+    args = parser.parse_args()
+    print(args)
+    return args
+
+
+def sync(device):
+    if device.type == 'cuda':
+        torch.cuda.synchronize()
+
+
+def decode_dynamic(llm, lm_input, steps, points, window, device):
+    timings = {}
+    offset = 0
+    att_cache, cnn_cache = torch.zeros((0, 0, 0, 0), device=device), torch.zeros((0, 0, 0, 0), device=device)
+    xs, outputs = lm_input, []
+    for i in range(steps):
+        sync(device)
+        start = time.perf_counter()
+        y, att_cache, cnn_cache = llm.forward_chunk(xs, offset=offset, required_cache_size=-1,
+                                                    att_cache=att_cache, cnn_cache=cnn_cache,
+                                                    att_mask=torch.tril(torch.ones((1, xs.shape[1], xs.shape[1]),
+                                                                                   device=device)).to(torch.bool))
+        sync(device)
+        for p in points:
+            if p - window < i <= p:
+                timings.setdefault(p, []).append(time.perf_counter() - start)
+        outputs.append(y[:, -1])
+        offset += xs.size(1)
+        xs = y[:, -1:]
+    return timings, torch.concat(outputs, dim=0)
+
+
+def decode_static(llm, lm_input, steps, points, window, device):
+    timings = {}
+    offset = 0
+    kv_cache = StaticKVCache.from_encoder(llm, lm_input.shape[1] + steps, device, lm_input.dtype)
+    xs, outputs = lm_input, []
+    for i in range(steps):
+        sync(device)
+        start = time.perf_counter()
+        y = llm.forward_chunk_static_cache(xs, offset=offset, kv_cache=kv_cache)
+        sync(device)
+        for p in points:
+            if p - window < i <= p:
+                timings.setdefault(p, []).append(time.perf_counter() - start)
+        outputs.append(y[:, -1])
+        offset += xs.size(1)
+        xs = y[:, -1:]
+    return timings, torch.concat(outputs, dim=0)
+
+
+@torch.inference_mode()
+def main():
+    args = get_args()
+    device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+    torch.manual_seed(0)
+    llm = TransformerEncoder(input_size=args.size, output_size=args.size, attention_heads=args.heads,
+                             linear_units=args.size * 4, num_blocks=args.num_blocks, dropout_rate=0.1,
+                             positional_dropout_rate=0.1, attention_dropout_rate=0.0, input_layer='linear_legacy',
+                             pos_enc_layer_type='rel_pos_espnet', selfattention_layer_type='rel_selfattn',
+                             static_chunk_size=1).to(device).eval()
+    dtype = torch.float16 if args.fp16 else torch.float32
+    llm.to(dtype)
+    points = [int(i) for i in args.lengths.split(',')]
+    steps = max(points) + 1
+    lm_input = torch.randn(1, args.prompt_len, args.size, device=device, dtype=dtype)
+
+    # warmup
+    decode_dynamic(llm, lm_input, 10, [], args.window, device)
+    decode_static(llm, lm_input, 10, [], args.window, device)
+
+    dynamic_timings, dynamic_out = decode_dynamic(llm, lm_input, steps, points, args.window, device)
+    static_timings, static_out = decode_static(llm, lm_input, steps, points, args.window, device)
+    print('max abs diff between modes: {:.3e}'.format((dynamic_out - static_out).abs().max().item()))
+    print('{:>8} {:>14} {:>14} {:>8}'.format('tokens', 'dynamic ms/tok', 'static ms/tok', 'speedup'))
+    for p in points:
+        d = sum(dynamic_timings[p]) / len(dynamic_timings[p]) * 1000
+        s = sum(static_timings[p]) / len(static_timings[p]) * 1000
+        print('{:>8} {:>14.3f} {:>14.3f} {:>8.2f}'.format(p, d, s, d / s))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+# Copyright (c) 2024 Alibaba Inc (authors: Xiang Lyu)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Per-token cost of the tensorized ras/nucleus sampling vs the previous python loop version."""
+from __future__ import print_function
+
+import argparse
+import os
+import sys
+import time
+import torch
+ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append('{}/../..'.format(ROOT_DIR))
+from cosyvoice.utils.common import ras_sampling
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description='benchmark speech token sampling')
+    parser.add_argument('--vocab', type=int, default=4097, help='speech_token_size + 1')
+    parser.add_argument('--steps', type=int, default=500)
+    parser.add_argument('--batch_size', type=int, default=32, help='batch size of the batched form')
+    args = parser.parse_args()
+    print(args)
+    return args
+
+
+# previous implementation, kept here as the reference
+def legacy_nucleus_sampling(weighted_scores, top_p=0.8, top_k=25):
+    prob, indices = [], []
+    cum_prob = 0.0
+    sorted_value, sorted_idx = weighted_scores.softmax(dim=0).sort(descending=True, stable=True)
+    for i in range(len(sorted_idx)):
+        if cum_prob < top_p and len(prob) < top_k:
+            cum_prob += sorted_value[i]
+            prob.append(sorted_value[i])
+            indices.append(sorted_idx[i])
+        else:
+            break
+    prob = torch.tensor(prob).to(weighted_scores)
+    indices = torch.tensor(indices, dtype=torch.long).to(weighted_scores.device)
+    return indices[prob.multinomial(1, replacement=True)]
+
+
+def legacy_ras_sampling(weighted_scores, decoded_tokens, sampling, top_p=0.8, top_k=25, win_size=10, tau_r=0.1):
+    top_ids = legacy_nucleus_sampling(weighted_scores, top_p=top_p, top_k=top_k)
+    rep_num = (torch.tensor(decoded_tokens[-win_size:]).to(weighted_scores.device) == top_ids).sum().item()
+    if rep_num >= win_size * tau_r:
+        top_ids = weighted_scores.softmax(dim=0).multinomial(1, replacement=True)
+    return top_ids
+
+
+def sync(device):
+    if device.type == 'cuda':
+        torch.cuda.synchronize()
+
+
+def run(fn, logps, decoded, device):
+    sync(device)
+    start = time.perf_counter()
+    for i in range(logps.size(0)):
+        top_ids = fn(logps[i], decoded[i])
+    sync(device)
+    return (time.perf_counter() - start) / logps.size(0) * 1000, top_ids
+
+
+def main():
+    args = get_args()
+    device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+    torch.manual_seed(0)
+    # peaky distributions similar to the llm output
+    logps = (torch.randn(args.steps, args.vocab, device=device) * 4).log_softmax(dim=-1)
+    history = torch.randint(0, args.vocab - 1, (args.steps + 10,)).tolist()
+    decoded = [history[:i + 10] for i in range(args.steps)]
+    decoded_tensor = [torch.tensor(d, device=device) for d in decoded]
+
+    legacy_ms, _ = run(lambda s, d: legacy_ras_sampling(s, d, 25), logps, decoded, device)
+    list_ms, _ = run(lambda s, d: ras_sampling(s, d, 25), logps, decoded, device)
+    tensor_ms, _ = run(lambda s, d: ras_sampling(s, d, 25), logps, decoded_tensor, device)
+    print('{:<40} {:>10.4f} ms/token'.format('legacy ras_sampling', legacy_ms))
+    print('{:<40} {:>10.4f} ms/token'.format('ras_sampling, list history', list_ms))
+    print('{:<40} {:>10.4f} ms/token'.format('ras_sampling, device history', tensor_ms))
+
+    batch_logps = logps[:args.batch_size]
+    batch_decoded = torch.tensor([d[-10:] for d in decoded[:args.batch_size]], device=device)
+    sync(device)
+    start = time.perf_counter()
+    for _ in range(args.steps):
+        ras_sampling(batch_logps, batch_decoded, 25)
+    sync(device)
+    batch_ms = (time.perf_counter() - start) / args.steps / args.batch_size * 1000
+    print('{:<40} {:>10.4f} ms/token'.format('ras_sampling, batch of {}'.format(args.batch_size), batch_ms))
+
+    # distribution check, the tensorized version keeps the same nucleus
+    counts_legacy = torch.zeros(args.vocab)
+    counts_new = torch.zeros(args.vocab)
+    for _ in range(2000):
+        counts_legacy[legacy_nucleus_sampling(logps[0]).cpu()] += 1
+        counts_new[ras_sampling(logps[0], [], 25).cpu()] += 1
+    print('total variation distance on 2000 draws: {:.4f}'.format(
+        0.5 * (counts_legacy / 2000 - counts_new / 2000).abs().sum().item()))
+
+
+if __name__ == '__main__':
+    main()
@@ -23,7 +23,9 @@ from cosyvoice.utils.file_utils import logging
 
 class CosyVoice:
 
-    def __init__(self, model_dir, load_jit=True, load_onnx=False, fp16=True):
+    def __init__(self, model_dir, load_jit=True, load_onnx=False, fp16=True, llm_batch_size=0, static_kv_cache=False,
+                 prompt_cache_size=32, persist_prompt_cache=False, hift_batch_size=0,
+                 compile=False):
         instruct = True if '-Instruct' in model_dir else False
         self.model_dir = model_dir
         if not os.path.exists(model_dir):
@@ -36,7 +38,9 @@ class CosyVoice:
                                           '{}/speech_tokenizer_v1.onnx'.format(model_dir),
                                           '{}/spk2info.pt'.format(model_dir),
                                           instruct,
-                                          configs['allowed_special'])
+                                          configs['allowed_special'],
+                                          prompt_cache_size,
+                                          '{}/prompt_cache.pt'.format(model_dir) if persist_prompt_cache else '')
         self.model = CosyVoiceModel(configs['llm'], configs['flow'], configs['hift'], fp16)
         self.model.load('{}/llm.pt'.format(model_dir),
                         '{}/flow.pt'.format(model_dir),
@@ -47,49 +51,73 @@ class CosyVoice:
                                 '{}/flow.encoder.fp32.zip'.format(model_dir))
         if load_onnx:
             self.model.load_onnx('{}/flow.decoder.estimator.fp32.onnx'.format(model_dir))
+        self.model.llm_static_kv_cache = static_kv_cache
+        if llm_batch_size > 0:
+            self.model.load_llm_batching(llm_batch_size)
+        if hift_batch_size > 1:
+            self.model.load_hift_batching(hift_batch_size)
+        if compile and self.model.load_compile():
+            start_time = time.time()
+            self.model.warmup()
+            logging.info('compiled inference warmup done in {:.1f}s'.format(time.time() - start_time))
         del configs
 
+    def prompt_cache_stats(self):
+        if self.frontend.prompt_cache is None:
+            return {}
+        return self.frontend.prompt_cache.stats()
+
+    def add_speaker(self, spk_id, prompt_speech_16k, prompt_text=''):
+        """register a cloned voice, later usable by inference_sft(tts_text, spk_id)"""
+        if prompt_text != '':
+            prompt_text = self.frontend.text_normalize(prompt_text, split=False)
+        self.frontend.add_speaker(spk_id, prompt_speech_16k, prompt_text)
+        logging.info('registered speaker {}'.format(spk_id))
+
     def list_avaliable_spks(self):
         spks = list(self.frontend.spk2info.keys())
         return spks
 
-    def inference_sft(self, tts_text, spk_id, stream=False, speed=1.0):
+    def inference_sft(self, tts_text, spk_id, stream=False, speed=1.0, flow_n_timesteps=10, flow_solver=None):
         for i in tqdm(self.frontend.text_normalize(tts_text, split=True)):
             model_input = self.frontend.frontend_sft(i, spk_id)
             start_time = time.time()
             logging.info('synthesis text {}'.format(i))
-            for model_output in self.model.tts(**model_input, stream=stream, speed=speed):
+            for model_output in self.model.tts(**model_input, stream=stream, speed=speed,
+                                               flow_n_timesteps=flow_n_timesteps, flow_solver=flow_solver):
                 speech_len = model_output['tts_speech'].shape[1] / 22050
                 logging.info('yield speech len {}, rtf {}'.format(speech_len, (time.time() - start_time) / speech_len))
                 yield model_output
                 start_time = time.time()
 
-    def inference_zero_shot(self, tts_text, prompt_text, prompt_speech_16k, stream=False, speed=1.0):
+    def inference_zero_shot(self, tts_text, prompt_text, prompt_speech_16k, stream=False, speed=1.0, flow_n_timesteps=10, flow_solver=None):
         prompt_text = self.frontend.text_normalize(prompt_text, split=False)
         for i in tqdm(self.frontend.text_normalize(tts_text, split=True)):
             model_input = self.frontend.frontend_zero_shot(i, prompt_text, prompt_speech_16k)
             start_time = time.time()
             logging.info('synthesis text {}'.format(i))
-            for model_output in self.model.tts(**model_input, stream=stream, speed=speed):
+            for model_output in self.model.tts(**model_input, stream=stream, speed=speed,
+                                               flow_n_timesteps=flow_n_timesteps, flow_solver=flow_solver):
                 speech_len = model_output['tts_speech'].shape[1] / 22050
                 logging.info('yield speech len {}, rtf {}'.format(speech_len, (time.time() - start_time) / speech_len))
                 yield model_output
                 start_time = time.time()
 
-    def inference_cross_lingual(self, tts_text, prompt_speech_16k, stream=False, speed=1.0):
+    def inference_cross_lingual(self, tts_text, prompt_speech_16k, stream=False, speed=1.0, flow_n_timesteps=10, flow_solver=None):
         if self.frontend.instruct is True:
             raise ValueError('{} do not support cross_lingual inference'.format(self.model_dir))
         for i in tqdm(self.frontend.text_normalize(tts_text, split=True)):
             model_input = self.frontend.frontend_cross_lingual(i, prompt_speech_16k)
             start_time = time.time()
             logging.info('synthesis text {}'.format(i))
-            for model_output in self.model.tts(**model_input, stream=stream, speed=speed):
+            for model_output in self.model.tts(**model_input, stream=stream, speed=speed,
+                                               flow_n_timesteps=flow_n_timesteps, flow_solver=flow_solver):
                 speech_len = model_output['tts_speech'].shape[1] / 22050
                 logging.info('yield speech len {}, rtf {}'.format(speech_len, (time.time() - start_time) / speech_len))
                 yield model_output
                 start_time = time.time()
 
-    def inference_instruct(self, tts_text, spk_id, instruct_text, stream=False, speed=1.0):
+    def inference_instruct(self, tts_text, spk_id, instruct_text, stream=False, speed=1.0, flow_n_timesteps=10, flow_solver=None):
         if self.frontend.instruct is False:
             raise ValueError('{} do not support instruct inference'.format(self.model_dir))
         instruct_text = self.frontend.text_normalize(instruct_text, split=False)
@@ -97,16 +125,18 @@ class CosyVoice:
             model_input = self.frontend.frontend_instruct(i, spk_id, instruct_text)
             start_time = time.time()
             logging.info('synthesis text {}'.format(i))
-            for model_output in self.model.tts(**model_input, stream=stream, speed=speed):
+            for model_output in self.model.tts(**model_input, stream=stream, speed=speed,
+                                               flow_n_timesteps=flow_n_timesteps, flow_solver=flow_solver):
                 speech_len = model_output['tts_speech'].shape[1] / 22050
                 logging.info('yield speech len {}, rtf {}'.format(speech_len, (time.time() - start_time) / speech_len))
                 yield model_output
                 start_time = time.time()
 
-    def inference_vc(self, source_speech_16k, prompt_speech_16k, stream=False, speed=1.0):
+    def inference_vc(self, source_speech_16k, prompt_speech_16k, stream=False, speed=1.0, flow_n_timesteps=10, flow_solver=None):
         model_input = self.frontend.frontend_vc(source_speech_16k, prompt_speech_16k)
         start_time = time.time()
-        for model_output in self.model.vc(**model_input, stream=stream, speed=speed):
+        for model_output in self.model.vc(**model_input, stream=stream, speed=speed,
+                                          flow_n_timesteps=flow_n_timesteps, flow_solver=flow_solver):
             speech_len = model_output['tts_speech'].shape[1] / 22050
             logging.info('yield speech len {}, rtf {}'.format(speech_len, (time.time() - start_time) / speech_len))
             yield model_output
@@ -21,6 +21,7 @@ import torchaudio.compliance.kaldi as kaldi
 import torchaudio
 import os
 import re
+import threading
 import inflect
 try:
     import ttsfrd
@@ -30,6 +31,8 @@ except ImportError:
     from tn.chinese.normalizer import Normalizer as ZhNormalizer
     from tn.english.normalizer import Normalizer as EnNormalizer
     use_ttsfrd = False
+from cosyvoice.cli.prompt_cache import PromptFeatureCache
+from cosyvoice.utils.file_utils import torch_save_atomic
 from cosyvoice.utils.frontend_utils import contains_chinese, replace_blank, replace_corner_mark, remove_bracket, spell_out_number, split_paragraph
 
 
@@ -42,7 +45,9 @@ class CosyVoiceFrontEnd:
                  speech_tokenizer_model: str,
                  spk2info: str = '',
                  instruct: bool = False,
-                 allowed_special: str = 'all'):
+                 allowed_special: str = 'all',
+                 prompt_cache_size: int = 32,
+                 prompt_cache_file: str = ''):
         self.tokenizer = get_tokenizer()
         self.feat_extractor = feat_extractor
         self.device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
@@ -53,10 +58,14 @@ class CosyVoiceFrontEnd:
         self.speech_tokenizer_session = onnxruntime.InferenceSession(speech_tokenizer_model, sess_options=option,
                                                                      providers=["CUDAExecutionProvider" if torch.cuda.is_available() else
                                                                                 "CPUExecutionProvider"])
+        self.spk2info_file = spk2info
+        self.spk2info_lock = threading.Lock()
         if os.path.exists(spk2info):
             self.spk2info = torch.load(spk2info, map_location=self.device)
         else:
             self.spk2info = {}
+        # prompt features keyed by audio hash, 0 disables the cache
+        self.prompt_cache = PromptFeatureCache(prompt_cache_size, prompt_cache_file, self.device) if prompt_cache_size > 0 else None
         self.instruct = instruct
         self.allowed_special = allowed_special
         self.inflect_parser = inflect.engine()
@@ -108,6 +117,24 @@ class CosyVoiceFrontEnd:
         speech_feat_len = torch.tensor([speech_feat.shape[1]], dtype=torch.int32).to(self.device)
         return speech_feat, speech_feat_len
 
+    def _extract_prompt(self, prompt_speech_16k):
+        """speech feat, speech token and speaker embedding of a 16k prompt audio, cached by content"""
+        if self.prompt_cache is not None:
+            key = self.prompt_cache.hash(prompt_speech_16k)
+            prompt = self.prompt_cache.get(key)
+            if prompt is not None:
+                return prompt
+        prompt_speech_22050 = torchaudio.transforms.Resample(orig_freq=16000, new_freq=22050)(prompt_speech_16k)
+        speech_feat, speech_feat_len = self._extract_speech_feat(prompt_speech_22050)
+        speech_token, speech_token_len = self._extract_speech_token(prompt_speech_16k)
+        embedding = self._extract_spk_embedding(prompt_speech_16k)
+        prompt = {'speech_feat': speech_feat, 'speech_feat_len': speech_feat_len,
+                  'speech_token': speech_token, 'speech_token_len': speech_token_len,
+                  'embedding': embedding}
+        if self.prompt_cache is not None:
+            self.prompt_cache.put(key, prompt)
+        return prompt
+
     def text_normalize(self, text, split=True):
         text = text.strip()
         if contains_chinese(text):
@@ -136,19 +163,49 @@ class CosyVoiceFrontEnd:
             return text
         return texts
 
+    def add_speaker(self, spk_id, prompt_speech_16k, prompt_text=''):
+        """extract the prompt features of a reference clip once and store them as speaker spk_id"""
+        prompt = self._extract_prompt(prompt_speech_16k)
+        spk_info = {'embedding': prompt['embedding'],
+                    'speech_token': prompt['speech_token'], 'speech_token_len': prompt['speech_token_len'],
+                    'speech_feat': prompt['speech_feat'], 'speech_feat_len': prompt['speech_feat_len']}
+        if prompt_text != '':
+            spk_info['prompt_text'], spk_info['prompt_text_len'] = self._extract_text_token(prompt_text)
+        with self.spk2info_lock:
+            self.spk2info[spk_id] = spk_info
+            if self.spk2info_file:
+                self._save_spk2info()
+        return spk_info
+
+    def _save_spk2info(self):
+        torch_save_atomic({k: {n: t.cpu() if isinstance(t, torch.Tensor) else t for n, t in v.items()} for k, v in self.spk2info.items()},
+                          self.spk2info_file)
+
     def frontend_sft(self, tts_text, spk_id):
         tts_text_token, tts_text_token_len = self._extract_text_token(tts_text)
-        embedding = self.spk2info[spk_id]['embedding']
+        spk_info = self.spk2info[spk_id]
+        embedding = spk_info['embedding']
         model_input = {'text': tts_text_token, 'text_len': tts_text_token_len, 'llm_embedding': embedding, 'flow_embedding': embedding}
+        # speakers registered by add_speaker also carry their prompt, same as zero shot
+        if 'speech_token' in spk_info:
+            model_input['flow_prompt_speech_token'] = spk_info['speech_token']
+            model_input['flow_prompt_speech_token_len'] = spk_info['speech_token_len']
+            model_input['prompt_speech_feat'] = spk_info['speech_feat']
+            model_input['prompt_speech_feat_len'] = spk_info['speech_feat_len']
+            if 'prompt_text' in spk_info:
+                model_input['prompt_text'] = spk_info['prompt_text']
+                model_input['prompt_text_len'] = spk_info['prompt_text_len']
+                model_input['llm_prompt_speech_token'] = spk_info['speech_token']
+                model_input['llm_prompt_speech_token_len'] = spk_info['speech_token_len']
         return model_input
 
     def frontend_zero_shot(self, tts_text, prompt_text, prompt_speech_16k):
         tts_text_token, tts_text_token_len = self._extract_text_token(tts_text)
         prompt_text_token, prompt_text_token_len = self._extract_text_token(prompt_text)
-        prompt_speech_22050 = torchaudio.transforms.Resample(orig_freq=16000, new_freq=22050)(prompt_speech_16k)
-        speech_feat, speech_feat_len = self._extract_speech_feat(prompt_speech_22050)
-        speech_token, speech_token_len = self._extract_speech_token(prompt_speech_16k)
-        embedding = self._extract_spk_embedding(prompt_speech_16k)
+        prompt = self._extract_prompt(prompt_speech_16k)
+        speech_feat, speech_feat_len = prompt['speech_feat'], prompt['speech_feat_len']
+        speech_token, speech_token_len = prompt['speech_token'], prompt['speech_token_len']
+        embedding = prompt['embedding']
         model_input = {'text': tts_text_token, 'text_len': tts_text_token_len,
                        'prompt_text': prompt_text_token, 'prompt_text_len': prompt_text_token_len,
                        'llm_prompt_speech_token': speech_token, 'llm_prompt_speech_token_len': speech_token_len,
@@ -170,16 +227,18 @@ class CosyVoiceFrontEnd:
         model_input = self.frontend_sft(tts_text, spk_id)
         # in instruct mode, we remove spk_embedding in llm due to information leakage
         del model_input['llm_embedding']
+        model_input.pop('llm_prompt_speech_token', None)
+        model_input.pop('llm_prompt_speech_token_len', None)
         instruct_text_token, instruct_text_token_len = self._extract_text_token(instruct_text + '<endofprompt>')
         model_input['prompt_text'] = instruct_text_token
         model_input['prompt_text_len'] = instruct_text_token_len
         return model_input
 
     def frontend_vc(self, source_speech_16k, prompt_speech_16k):
-        prompt_speech_token, prompt_speech_token_len = self._extract_speech_token(prompt_speech_16k)
-        prompt_speech_22050 = torchaudio.transforms.Resample(orig_freq=16000, new_freq=22050)(prompt_speech_16k)
-        prompt_speech_feat, prompt_speech_feat_len = self._extract_speech_feat(prompt_speech_22050)
-        embedding = self._extract_spk_embedding(prompt_speech_16k)
+        prompt = self._extract_prompt(prompt_speech_16k)
+        prompt_speech_token, prompt_speech_token_len = prompt['speech_token'], prompt['speech_token_len']
+        prompt_speech_feat, prompt_speech_feat_len = prompt['speech_feat'], prompt['speech_feat_len']
+        embedding = prompt['embedding']
         source_speech_token, source_speech_token_len = self._extract_speech_token(source_speech_16k)
         model_input = {'source_speech_token': source_speech_token, 'source_speech_token_len': source_speech_token_len,
                        'flow_prompt_speech_token': prompt_speech_token, 'flow_prompt_speech_token_len': prompt_speech_token_len,
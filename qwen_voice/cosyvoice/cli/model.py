@@ -15,10 +15,15 @@ import torch
 import numpy as np
 import threading
 import time
+from collections import deque
 from torch.nn import functional as F
 from contextlib import nullcontext
 import uuid
 from cosyvoice.utils.common import fade_in_out
+from cosyvoice.llm.batching import ContinuousBatchingLM
+from cosyvoice.hifigan.batching import BatchedHiFT
+from cosyvoice.utils.compile_utils import DEFAULT_MEL_BUCKETS, BucketedEstimator, CompiledDecodeStep
+from cosyvoice.utils.file_utils import logging
 
 
 class CosyVoiceModel:
@@ -38,23 +43,43 @@ class CosyVoiceModel:
         self.token_overlap_len = 20
         # mel fade in out
         self.mel_overlap_len = int(self.token_overlap_len / self.flow.input_frame_rate * 22050 / 256)
-        self.mel_window = np.hamming(2 * self.mel_overlap_len)
+        self.mel_window = torch.from_numpy(np.hamming(2 * self.mel_overlap_len)).to(self.device, torch.float32)
         # hift cache
         self.mel_cache_len = 20
         self.source_cache_len = int(self.mel_cache_len * 256)
         # speech fade in out
-        self.speech_window = np.hamming(2 * self.source_cache_len)
+        self.speech_window = torch.from_numpy(np.hamming(2 * self.source_cache_len)).to(self.device, torch.float32)
         # rtf and decoding related
         self.stream_scale_factor = 1
         assert self.stream_scale_factor >= 1, 'stream_scale_factor should be greater than 1, change it according to your actual rtf'
         self.llm_context = torch.cuda.stream(torch.cuda.Stream(self.device)) if torch.cuda.is_available() else nullcontext()
         self.lock = threading.Lock()
+        # optional continuous batching of llm decode across requests
+        self.llm_batcher = None
+        # optional batching of hift vocoder chunks across requests
+        self.hift_batcher = None
+        # decode with a preallocated kv cache instead of growing it by torch.cat, needs an eager llm
+        self.llm_static_kv_cache = False
         # dict used to store session related variable
         self.tts_speech_token_dict = {}
         self.llm_end_dict = {}
+        # llm_job notifies the consumer once token_need_dict[uuid] tokens are available or llm ends
+        self.token_cond_dict = {}
+        self.token_need_dict = {}
         self.mel_overlap_dict = {}
         self.flow_cache_dict = {}
         self.hift_cache_dict = {}
+        # seconds from tts() call to the first streamed chunk, recent requests only
+        self.first_chunk_latency = deque(maxlen=1000)
+
+    def latency_stats(self):
+        latency = sorted(self.first_chunk_latency)
+        if len(latency) == 0:
+            return {'first_chunk_count': 0}
+        return {'first_chunk_count': len(latency),
+                'first_chunk_mean': sum(latency) / len(latency),
+                'first_chunk_p50': latency[len(latency) // 2],
+                'first_chunk_p95': latency[min(len(latency) - 1, int(len(latency) * 0.95))]}
 
     def load(self, llm_model, flow_model, hift_model):
         self.llm.load_state_dict(torch.load(llm_model, map_location=self.device), strict=False)
@@ -86,21 +111,82 @@ class CosyVoiceModel:
         del self.flow.decoder.estimator
         self.flow.decoder.estimator = onnxruntime.InferenceSession(flow_decoder_estimator_model, sess_options=option, providers=providers)
 
+    def load_llm_batching(self, max_batch_size):
+        llm_batching_context = torch.cuda.stream(torch.cuda.Stream(self.device)) if torch.cuda.is_available() else nullcontext()
+        self.llm_batcher = ContinuousBatchingLM(self.llm, max_batch_size=max_batch_size, context=llm_batching_context)
+
+    def load_compile(self, mel_buckets=DEFAULT_MEL_BUCKETS):
+        """compile the flow estimator per mel length bucket and the llm decode step, cuda only"""
+        if not torch.cuda.is_available():
+            logging.warning('compiled inference needs cuda, keep eager on cpu')
+            return False
+        if isinstance(self.flow.decoder.estimator, torch.nn.Module):
+            # one graph per bucket and estimator batch size (1, or 2 with fused cfg)
+            torch._dynamo.config.cache_size_limit = max(torch._dynamo.config.cache_size_limit, 2 * len(mel_buckets) + 2)
+            self.flow.decoder.estimator = BucketedEstimator(self.flow.decoder.estimator, mel_buckets)
+        else:
+            logging.warning('flow estimator is not a torch module, skip compiling it')
+        if isinstance(self.llm.llm, torch.jit.ScriptModule):
+            logging.warning('llm is a jit model, skip compiling the decode step')
+        else:
+            self.llm.compiled_forward_chunk = CompiledDecodeStep(self.llm.llm.forward_chunk)
+        return True
+
+    @torch.inference_mode()
+    def warmup(self, text_len=20):
+        """run the compiled paths once for all shapes so that the first request does not pay compile cost"""
+        decoder = self.flow.decoder
+        if isinstance(decoder.estimator, BucketedEstimator):
+            batch_sizes = [2] if decoder.inference_cfg_rate > 0 and decoder.fused_cfg is True else [1]
+            decoder.estimator.warmup(batch_sizes, self.flow.output_size, self.flow.output_size, self.device,
+                                     next(self.flow.parameters()).dtype)
+        # a short streaming synthesis covers the llm decode step, flow cache and hift
+        text = torch.randint(1, 100, (1, text_len), dtype=torch.int32)
+        embedding = torch.zeros(1, 192)
+        for _ in self.tts(text=text, flow_embedding=embedding, llm_embedding=embedding, stream=True):
+            pass
+
+    def load_hift_batching(self, max_batch_size, max_wait=0.0):
+        self.hift_batcher = BatchedHiFT(self.hift, max_batch_size=max_batch_size, max_wait=max_wait)
+
     def llm_job(self, text, prompt_text, llm_prompt_speech_token, llm_embedding, uuid):
         if self.fp16 is True:
             llm_embedding = llm_embedding.half()
-        with self.llm_context:
-            for i in self.llm.inference(text=text.to(self.device),
-                                        text_len=torch.tensor([text.shape[1]], dtype=torch.int32).to(self.device),
-                                        prompt_text=prompt_text.to(self.device),
-                                        prompt_text_len=torch.tensor([prompt_text.shape[1]], dtype=torch.int32).to(self.device),
-                                        prompt_speech_token=llm_prompt_speech_token.to(self.device),
-                                        prompt_speech_token_len=torch.tensor([llm_prompt_speech_token.shape[1]], dtype=torch.int32).to(self.device),
-                                        embedding=llm_embedding.to(self.device)):
-                self.tts_speech_token_dict[uuid].append(i)
-        self.llm_end_dict[uuid] = True
+        llm = self.llm_batcher if self.llm_batcher is not None else self.llm
+        cond = self.token_cond_dict[uuid]
+        try:
+            with self.llm_context:
+                for i in llm.inference(text=text.to(self.device),
+                                       text_len=torch.tensor([text.shape[1]], dtype=torch.int32).to(self.device),
+                                       prompt_text=prompt_text.to(self.device),
+                                       prompt_text_len=torch.tensor([prompt_text.shape[1]], dtype=torch.int32).to(self.device),
+                                       prompt_speech_token=llm_prompt_speech_token.to(self.device),
+                                       prompt_speech_token_len=torch.tensor([llm_prompt_speech_token.shape[1]], dtype=torch.int32).to(self.device),
+                                       embedding=llm_embedding.to(self.device),
+                                       static_kv_cache=self.llm_static_kv_cache):
+                    with cond:
+                        self.tts_speech_token_dict[uuid].append(i)
+                        if len(self.tts_speech_token_dict[uuid]) >= self.token_need_dict[uuid]:
+                            cond.notify()
+        finally:
+            # also on error, so the consumer never waits forever
+            with cond:
+                self.llm_end_dict[uuid] = True
+                cond.notify()
 
-    def token2wav(self, token, prompt_token, prompt_feat, embedding, uuid, finalize=False, speed=1.0):
+    def to_host(self, speech):
+        """copy a yielded chunk to host through pinned memory, only waiting for this copy"""
+        if speech.device.type != 'cuda':
+            return speech
+        host_speech = torch.empty(speech.shape, dtype=speech.dtype, pin_memory=True)
+        host_speech.copy_(speech, non_blocking=True)
+        copy_done = torch.cuda.Event()
+        copy_done.record()
+        copy_done.synchronize()
+        return host_speech
+
+    @torch.inference_mode()
+    def token2wav(self, token, prompt_token, prompt_feat, embedding, uuid, finalize=False, speed=1.0, n_timesteps=10, solver=None):
         tts_mel, flow_cache = self.flow.inference(token=token.to(self.device),
                                                   token_len=torch.tensor([token.shape[1]], dtype=torch.int32).to(self.device),
                                                   prompt_token=prompt_token.to(self.device),
@@ -108,8 +194,11 @@ class CosyVoiceModel:
                                                   prompt_feat=prompt_feat.to(self.device),
                                                   prompt_feat_len=torch.tensor([prompt_feat.shape[1]], dtype=torch.int32).to(self.device),
                                                   embedding=embedding.to(self.device),
-                                                  flow_cache=self.flow_cache_dict[uuid])
+                                                  flow_cache=self.flow_cache_dict[uuid],
+                                                  n_timesteps=n_timesteps,
+                                                  solver=solver)
         self.flow_cache_dict[uuid] = flow_cache
+        hift = self.hift_batcher if self.hift_batcher is not None else self.hift
 
         # mel overlap fade in out
         if self.mel_overlap_dict[uuid].shape[2] != 0:
@@ -124,7 +213,7 @@ class CosyVoiceModel:
         if finalize is False:
             self.mel_overlap_dict[uuid] = tts_mel[:, :, -self.mel_overlap_len:]
             tts_mel = tts_mel[:, :, :-self.mel_overlap_len]
-            tts_speech, tts_source = self.hift.inference(speech_feat=tts_mel, cache_source=hift_cache_source)
+            tts_speech, tts_source = hift.inference(speech_feat=tts_mel, cache_source=hift_cache_source)
             if self.hift_cache_dict[uuid] is not None:
                 tts_speech = fade_in_out(tts_speech, self.hift_cache_dict[uuid]['speech'], self.speech_window)
             self.hift_cache_dict[uuid] = {'mel': tts_mel[:, :, -self.mel_cache_len:],
@@ -135,7 +224,7 @@ class CosyVoiceModel:
             if speed != 1.0:
                 assert self.hift_cache_dict[uuid] is None, 'speed change only support non-stream inference mode'
                 tts_mel = F.interpolate(tts_mel, size=int(tts_mel.shape[2] / speed), mode='linear')
-            tts_speech, tts_source = self.hift.inference(speech_feat=tts_mel, cache_source=hift_cache_source)
+            tts_speech, tts_source = hift.inference(speech_feat=tts_mel, cache_source=hift_cache_source)
             if self.hift_cache_dict[uuid] is not None:
                 tts_speech = fade_in_out(tts_speech, self.hift_cache_dict[uuid]['speech'], self.speech_window)
         return tts_speech
@@ -144,36 +233,45 @@ class CosyVoiceModel:
             prompt_text=torch.zeros(1, 0, dtype=torch.int32),
             llm_prompt_speech_token=torch.zeros(1, 0, dtype=torch.int32),
             flow_prompt_speech_token=torch.zeros(1, 0, dtype=torch.int32),
-            prompt_speech_feat=torch.zeros(1, 0, 80), stream=False, speed=1.0, **kwargs):
+            prompt_speech_feat=torch.zeros(1, 0, 80), stream=False, speed=1.0, flow_n_timesteps=10, flow_solver=None, **kwargs):
         # this_uuid is used to track variables related to this inference thread
         this_uuid = str(uuid.uuid1())
+        start_time = time.perf_counter()
+        cond = threading.Condition()
         with self.lock:
             self.tts_speech_token_dict[this_uuid], self.llm_end_dict[this_uuid] = [], False
+            self.token_cond_dict[this_uuid], self.token_need_dict[this_uuid] = cond, float('inf')
             self.hift_cache_dict[this_uuid] = None
             self.mel_overlap_dict[this_uuid] = torch.zeros(1, 80, 0)
             self.flow_cache_dict[this_uuid] = torch.zeros(1, 80, 0, 2)
         p = threading.Thread(target=self.llm_job, args=(text, prompt_text, llm_prompt_speech_token, llm_embedding, this_uuid))
         p.start()
         if stream is True:
-            token_hop_len = self.token_min_hop_len
+            token_hop_len, first_chunk = self.token_min_hop_len, True
             while True:
-                time.sleep(0.1)
-                if len(self.tts_speech_token_dict[this_uuid]) >= token_hop_len + self.token_overlap_len:
-                    this_tts_speech_token = torch.tensor(self.tts_speech_token_dict[this_uuid][:token_hop_len + self.token_overlap_len]) \
-                        .unsqueeze(dim=0)
-                    this_tts_speech = self.token2wav(token=this_tts_speech_token,
-                                                     prompt_token=flow_prompt_speech_token,
-                                                     prompt_feat=prompt_speech_feat,
-                                                     embedding=flow_embedding,
-                                                     uuid=this_uuid,
-                                                     finalize=False)
-                    yield {'tts_speech': this_tts_speech.cpu()}
-                    with self.lock:
-                        self.tts_speech_token_dict[this_uuid] = self.tts_speech_token_dict[this_uuid][token_hop_len:]
-                    # increase token_hop_len for better speech quality
-                    token_hop_len = min(self.token_max_hop_len, int(token_hop_len * self.stream_scale_factor))
-                if self.llm_end_dict[this_uuid] is True and len(self.tts_speech_token_dict[this_uuid]) < token_hop_len + self.token_overlap_len:
-                    break
+                need = token_hop_len + self.token_overlap_len
+                with cond:
+                    self.token_need_dict[this_uuid] = need
+                    cond.wait_for(lambda: len(self.tts_speech_token_dict[this_uuid]) >= need or self.llm_end_dict[this_uuid])
+                    if len(self.tts_speech_token_dict[this_uuid]) < need:
+                        break
+                    this_tts_speech_token = torch.tensor(self.tts_speech_token_dict[this_uuid][:need]).unsqueeze(dim=0)
+                this_tts_speech = self.token2wav(token=this_tts_speech_token,
+                                                 prompt_token=flow_prompt_speech_token,
+                                                 prompt_feat=prompt_speech_feat,
+                                                 embedding=flow_embedding,
+                                                 uuid=this_uuid,
+                                                 finalize=False,
+                                                 n_timesteps=flow_n_timesteps,
+                                                 solver=flow_solver)
+                if first_chunk:
+                    self.first_chunk_latency.append(time.perf_counter() - start_time)
+                    first_chunk = False
+                yield {'tts_speech': self.to_host(this_tts_speech)}
+                with cond:
+                    self.tts_speech_token_dict[this_uuid] = self.tts_speech_token_dict[this_uuid][token_hop_len:]
+                # increase token_hop_len for better speech quality
+                token_hop_len = min(self.token_max_hop_len, int(token_hop_len * self.stream_scale_factor))
             p.join()
             # deal with remain tokens, make sure inference remain token len equals token_hop_len when cache_speech is not None
             this_tts_speech_token = torch.tensor(self.tts_speech_token_dict[this_uuid]).unsqueeze(dim=0)
@@ -182,8 +280,12 @@ class CosyVoiceModel:
                                              prompt_feat=prompt_speech_feat,
                                              embedding=flow_embedding,
                                              uuid=this_uuid,
-                                             finalize=True)
-            yield {'tts_speech': this_tts_speech.cpu()}
+                                             finalize=True,
+                                             n_timesteps=flow_n_timesteps,
+                                             solver=flow_solver)
+            if first_chunk:
+                self.first_chunk_latency.append(time.perf_counter() - start_time)
+            yield {'tts_speech': self.to_host(this_tts_speech)}
         else:
             # deal with all tokens
             p.join()
@@ -194,15 +296,20 @@ class CosyVoiceModel:
                                              embedding=flow_embedding,
                                              uuid=this_uuid,
                                              finalize=True,
-                                             speed=speed)
-            yield {'tts_speech': this_tts_speech.cpu()}
+                                             speed=speed,
+                                             n_timesteps=flow_n_timesteps,
+                                             solver=flow_solver)
+            yield {'tts_speech': self.to_host(this_tts_speech)}
         with self.lock:
             self.tts_speech_token_dict.pop(this_uuid)
             self.llm_end_dict.pop(this_uuid)
+            self.token_cond_dict.pop(this_uuid)
+            self.token_need_dict.pop(this_uuid)
             self.mel_overlap_dict.pop(this_uuid)
             self.hift_cache_dict.pop(this_uuid)
 
-    def vc(self, source_speech_token, flow_prompt_speech_token, prompt_speech_feat, flow_embedding, stream=False, speed=1.0, **kwargs):
+    def vc(self, source_speech_token, flow_prompt_speech_token, prompt_speech_feat, flow_embedding, stream=False, speed=1.0,
+           flow_n_timesteps=10, flow_solver=None, **kwargs):
         # this_uuid is used to track variables related to this inference thread
         this_uuid = str(uuid.uuid1())
         with self.lock:
@@ -221,8 +328,10 @@ class CosyVoiceModel:
                                                      prompt_feat=prompt_speech_feat,
                                                      embedding=flow_embedding,
                                                      uuid=this_uuid,
-                                                     finalize=False)
-                    yield {'tts_speech': this_tts_speech.cpu()}
+                                                     finalize=False,
+                                                     n_timesteps=flow_n_timesteps,
+                                                     solver=flow_solver)
+                    yield {'tts_speech': self.to_host(this_tts_speech)}
                     with self.lock:
                         self.tts_speech_token_dict[this_uuid] = self.tts_speech_token_dict[this_uuid][token_hop_len:]
                     # increase token_hop_len for better speech quality
@@ -236,8 +345,10 @@ class CosyVoiceModel:
                                              prompt_feat=prompt_speech_feat,
                                              embedding=flow_embedding,
                                              uuid=this_uuid,
-                                             finalize=True)
-            yield {'tts_speech': this_tts_speech.cpu()}
+                                             finalize=True,
+                                             n_timesteps=flow_n_timesteps,
+                                             solver=flow_solver)
+            yield {'tts_speech': self.to_host(this_tts_speech)}
         else:
             # deal with all tokens
             this_tts_speech_token = torch.tensor(self.tts_speech_token_dict[this_uuid]).unsqueeze(dim=0)
@@ -247,8 +358,10 @@ class CosyVoiceModel:
                                              embedding=flow_embedding,
                                              uuid=this_uuid,
                                              finalize=True,
-                                             speed=speed)
-            yield {'tts_speech': this_tts_speech.cpu()}
+                                             speed=speed,
+                                             n_timesteps=flow_n_timesteps,
+                                             solver=flow_solver)
+            yield {'tts_speech': self.to_host(this_tts_speech)}
         with self.lock:
             self.tts_speech_token_dict.pop(this_uuid)
             self.llm_end_dict.pop(this_uuid)
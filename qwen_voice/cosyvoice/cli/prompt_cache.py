@@ -0,0 +1,84 @@
+# Copyright (c) 2024 Alibaba Inc (authors: Xiang Lyu)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Content hashed cache of prompt speech features."""
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional
+
+import torch
+
+from cosyvoice.utils.file_utils import logging, torch_save_atomic
+
+
+class PromptFeatureCache:
+    """LRU cache of speech token, speech feat and speaker embedding of a prompt audio.
+
+    Entries are keyed by the sha1 of the 16k prompt samples, so the same prompt is
+    extracted once and reused across the sentences of a request and across requests.
+    If cache_file is set, entries are loaded from it at start and written back
+    whenever a new prompt is added.
+
+    Args:
+        max_size (int): max number of prompts kept in memory.
+        cache_file (str): optional torch.save file, usually next to spk2info.pt.
+    """
+
+    def __init__(self, max_size: int = 32, cache_file: str = '', device: torch.device = torch.device('cpu')):
+        self.max_size = max_size
+        self.cache_file = cache_file
+        self.device = device
+        self.lock = threading.Lock()
+        self.entries: 'OrderedDict[str, Dict[str, torch.Tensor]]' = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        if cache_file and os.path.exists(cache_file):
+            for key, entry in torch.load(cache_file, map_location=device).items():
+                self.entries[key] = entry
+            while len(self.entries) > max_size:
+                self.entries.popitem(last=False)
+            logging.info('loaded {} prompt features from {}'.format(len(self.entries), cache_file))
+
+    @staticmethod
+    def hash(prompt_speech_16k: torch.Tensor) -> str:
+        speech = prompt_speech_16k.detach().cpu().contiguous()
+        return hashlib.sha1(str(tuple(speech.shape)).encode() + speech.numpy().tobytes()).hexdigest()
+
+    def get(self, key: str) -> Optional[Dict[str, torch.Tensor]]:
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key: str, entry: Dict[str, torch.Tensor]):
+        with self.lock:
+            self.entries[key] = entry
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+            if self.cache_file:
+                self._save()
+
+    def _save(self):
+        torch_save_atomic({k: {n: t.cpu() for n, t in v.items()} for k, v in self.entries.items()}, self.cache_file)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {'size': len(self.entries), 'hits': self.hits, 'misses': self.misses,
+                'hit_rate': self.hits / total if total else 0.0}
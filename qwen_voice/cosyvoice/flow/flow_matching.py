@@ -11,12 +11,19 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
+import threading
+import numpy as np
 import torch
 import torch.nn.functional as F
 from matcha.models.components.flow_matching import BASECFM
 
+TORCH_TO_NUMPY_DTYPE = {torch.float32: np.float32, torch.float16: np.float16, torch.int32: np.int32, torch.int64: np.int64}
+
 
 class ConditionalCFM(BASECFM):
+    # solver name -> method, selectable by cfm_params.solver or per call
+    SOLVERS = {'euler': 'solve_euler', 'heun': 'solve_heun', 'midpoint': 'solve_midpoint', 'dpm': 'solve_dpm'}
+
     def __init__(self, in_channels, cfm_params, n_spks=1, spk_emb_dim=64, estimator: torch.nn.Module = None):
         super().__init__(
             n_feats=in_channels,
@@ -27,12 +34,17 @@ class ConditionalCFM(BASECFM):
         self.t_scheduler = cfm_params.t_scheduler
         self.training_cfg_rate = cfm_params.training_cfg_rate
         self.inference_cfg_rate = cfm_params.inference_cfg_rate
+        # run conditioned and unconditioned cfg passes as one batch, onnx estimators always use two calls
+        self.fused_cfg = True
+        # reused output buffers of the onnx estimator, by slot, one set per inference thread
+        self.onnx_output_buffers = threading.local()
         in_channels = in_channels + (spk_emb_dim if n_spks > 0 else 0)
         # Just change the architecture of the estimator here
         self.estimator = estimator
 
     @torch.inference_mode()
-    def forward(self, mu, mask, n_timesteps, temperature=1.0, spks=None, cond=None, prompt_len=0, flow_cache=torch.zeros(1, 80, 0, 2)):
+    def forward(self, mu, mask, n_timesteps, temperature=1.0, spks=None, cond=None, prompt_len=0, flow_cache=torch.zeros(1, 80, 0, 2),
+                solver=None):
         """Forward diffusion
 
         Args:
@@ -45,6 +57,7 @@ class ConditionalCFM(BASECFM):
             spks (torch.Tensor, optional): speaker ids. Defaults to None.
                 shape: (batch_size, spk_emb_dim)
             cond: Not used but kept for future purposes
+            solver (str, optional): one of SOLVERS, defaults to cfm_params.solver.
 
         Returns:
             sample: generated mel-spectrogram
@@ -64,7 +77,11 @@ class ConditionalCFM(BASECFM):
         t_span = torch.linspace(0, 1, n_timesteps + 1, device=mu.device, dtype=mu.dtype)
         if self.t_scheduler == 'cosine':
             t_span = 1 - torch.cos(t_span * 0.5 * torch.pi)
-        return self.solve_euler(z, t_span=t_span, mu=mu, mask=mask, spks=spks, cond=cond), flow_cache
+        solver = solver if solver is not None else self.solver
+        if solver not in self.SOLVERS:
+            raise ValueError('unknown flow solver {}, choose from {}'.format(solver, list(self.SOLVERS)))
+        solve = getattr(self, self.SOLVERS[solver])
+        return solve(z, t_span=t_span, mu=mu, mask=mask, spks=spks, cond=cond), flow_cache
 
     def solve_euler(self, x, t_span, mu, mask, spks, cond):
         """
@@ -89,17 +106,7 @@ class ConditionalCFM(BASECFM):
         sol = []
 
         for step in range(1, len(t_span)):
-            dphi_dt = self.forward_estimator(x, mask, mu, t, spks, cond)
-            # Classifier-Free Guidance inference introduced in VoiceBox
-            if self.inference_cfg_rate > 0:
-                cfg_dphi_dt = self.forward_estimator(
-                    x, mask,
-                    torch.zeros_like(mu), t,
-                    torch.zeros_like(spks) if spks is not None else None,
-                    torch.zeros_like(cond)
-                )
-                dphi_dt = ((1.0 + self.inference_cfg_rate) * dphi_dt -
-                           self.inference_cfg_rate * cfg_dphi_dt)
+            dphi_dt = self.forward_cfg(x, mask, mu, t, spks, cond)
             x = x + dt * dphi_dt
             t = t + dt
             sol.append(x)
@@ -108,20 +115,112 @@ class ConditionalCFM(BASECFM):
 
         return sol[-1]
 
-    def forward_estimator(self, x, mask, mu, t, spks, cond):
+    def solve_heun(self, x, t_span, mu, mask, spks, cond):
+        """
+        Heun (explicit trapezoid) solver, second order, two estimator calls per step.
+        Same arguments as solve_euler.
+        """
+        for step in range(1, len(t_span)):
+            t, dt = t_span[step - 1].unsqueeze(dim=0), t_span[step] - t_span[step - 1]
+            k1 = self.forward_cfg(x, mask, mu, t, spks, cond)
+            x_pred = x + dt * k1
+            k2 = self.forward_cfg(x_pred, mask, mu, t + dt, spks, cond)
+            x = x + dt * 0.5 * (k1 + k2)
+        return x
+
+    def solve_midpoint(self, x, t_span, mu, mask, spks, cond):
+        """
+        Explicit midpoint solver, second order, two estimator calls per step.
+        Same arguments as solve_euler.
+        """
+        for step in range(1, len(t_span)):
+            t, dt = t_span[step - 1].unsqueeze(dim=0), t_span[step] - t_span[step - 1]
+            k1 = self.forward_cfg(x, mask, mu, t, spks, cond)
+            x_mid = x + 0.5 * dt * k1
+            x = x + dt * self.forward_cfg(x_mid, mask, mu, t + 0.5 * dt, spks, cond)
+        return x
+
+    def solve_dpm(self, x, t_span, mu, mask, spks, cond):
+        """
+        Second order multistep solver in the spirit of DPM-Solver++(2M): the velocity of
+        the previous step is reused for a linear correction, so it keeps one estimator
+        call per step like euler. The first step is a plain euler step.
+        Same arguments as solve_euler.
+        """
+        prev_dphi_dt, prev_dt = None, None
+        for step in range(1, len(t_span)):
+            t, dt = t_span[step - 1].unsqueeze(dim=0), t_span[step] - t_span[step - 1]
+            dphi_dt = self.forward_cfg(x, mask, mu, t, spks, cond)
+            if prev_dphi_dt is None:
+                x = x + dt * dphi_dt
+            else:
+                # adams-bashforth 2 on a non uniform grid
+                r = dt / prev_dt
+                x = x + dt * ((1 + 0.5 * r) * dphi_dt - 0.5 * r * prev_dphi_dt)
+            prev_dphi_dt, prev_dt = dphi_dt, dt
+        return x
+
+    def forward_cfg(self, x, mask, mu, t, spks, cond):
+        """Velocity with Classifier-Free Guidance inference introduced in VoiceBox"""
+        if self.inference_cfg_rate <= 0:
+            # solvers may hold the velocity across calls, do not hand out the reused onnx buffer
+            dphi_dt = self.forward_estimator(x, mask, mu, t, spks, cond)
+            return dphi_dt if isinstance(self.estimator, torch.nn.Module) else dphi_dt.clone()
+        if self.fused_cfg is True and isinstance(self.estimator, torch.nn.Module):
+            # conditioned and unconditioned pass as one batch of 2 * batch_size
+            dphi_dt, cfg_dphi_dt = self.forward_estimator(
+                torch.concat([x, x], dim=0),
+                torch.concat([mask, mask], dim=0),
+                torch.concat([mu, torch.zeros_like(mu)], dim=0),
+                torch.concat([t, t], dim=0) if t.shape[0] == x.shape[0] else t.repeat(2 * x.shape[0]),
+                torch.concat([spks, torch.zeros_like(spks)], dim=0) if spks is not None else None,
+                torch.concat([cond, torch.zeros_like(cond)], dim=0)
+            ).chunk(2, dim=0)
+        else:
+            dphi_dt = self.forward_estimator(x, mask, mu, t, spks, cond)
+            cfg_dphi_dt = self.forward_estimator(
+                x, mask,
+                torch.zeros_like(mu), t,
+                torch.zeros_like(spks) if spks is not None else None,
+                torch.zeros_like(cond),
+                slot=1
+            )
+        return (1.0 + self.inference_cfg_rate) * dphi_dt - self.inference_cfg_rate * cfg_dphi_dt
+
+    def forward_estimator(self, x, mask, mu, t, spks, cond, slot=0):
         if isinstance(self.estimator, torch.nn.Module):
             return self.estimator.forward(x, mask, mu, t, spks, cond)
         else:
-            ort_inputs = {
-                'x': x.cpu().numpy(),
-                'mask': mask.cpu().numpy(),
-                'mu': mu.cpu().numpy(),
-                't': t.cpu().numpy(),
-                'spks': spks.cpu().numpy(),
-                'cond': cond.cpu().numpy()
-            }
-            output = self.estimator.run(None, ort_inputs)[0]
-            return torch.tensor(output, dtype=x.dtype, device=x.device)
+            return self.forward_onnx_estimator(x, mask, mu, t, spks, cond, slot)
+
+    def forward_onnx_estimator(self, x, mask, mu, t, spks, cond, slot=0):
+        """Run the onnxruntime estimator on the torch buffers through IOBinding, no host copy.
+
+        The output is written into a buffer that is reused by every call of this thread
+        with the same slot, callers that keep two outputs alive at once must use different slots.
+        """
+        binding = self.estimator.io_binding()
+        device_type, device_id = x.device.type, x.device.index or 0
+        inputs = {'x': x, 'mask': mask, 'mu': mu, 't': t, 'spks': spks, 'cond': cond}
+        # keep the contiguous copies alive until run returns
+        inputs = {name: tensor.contiguous() for name, tensor in inputs.items()}
+        for name, tensor in inputs.items():
+            binding.bind_input(name=name, device_type=device_type, device_id=device_id,
+                               element_type=TORCH_TO_NUMPY_DTYPE[tensor.dtype], shape=tuple(tensor.shape),
+                               buffer_ptr=tensor.data_ptr())
+        buffers = self.onnx_output_buffers.__dict__
+        output = buffers.get(slot)
+        if output is None or output.shape != x.shape or output.dtype != x.dtype or output.device != x.device:
+            output = torch.empty_like(x, memory_format=torch.contiguous_format)
+            buffers[slot] = output
+        binding.bind_output(name=self.estimator.get_outputs()[0].name, device_type=device_type, device_id=device_id,
+                            element_type=TORCH_TO_NUMPY_DTYPE[output.dtype], shape=tuple(output.shape),
+                            buffer_ptr=output.data_ptr())
+        if x.is_cuda:
+            # onnxruntime runs on its own cuda stream, wait for the inputs written by torch
+            torch.cuda.current_stream(x.device).synchronize()
+        self.estimator.run_with_iobinding(binding)
+        return output
 
     def compute_loss(self, x1, mask, mu, spks=None, cond=None):
         """Computes diffusion loss
@@ -0,0 +1,96 @@
+# Copyright (c) 2024 Alibaba Inc (authors: Xiang Lyu)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Batched HiFT vocoder inference across concurrent requests."""
+import queue
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import Future
+from typing import List, Tuple
+
+import torch
+
+
+class _VocoderRequest:
+
+    def __init__(self, speech_feat, cache_source):
+        self.speech_feat = speech_feat
+        self.cache_source = cache_source
+        self.future = Future()
+
+
+class BatchedHiFT:
+    """Collect the mel chunks of all in-flight requests and vocode them in one forward.
+
+    inference() has the same interface as HiFTGenerator.inference and blocks until
+    the batch containing the chunk is done, so token2wav keeps handling the per
+    request hift cache itself. A worker thread takes whatever chunks are waiting,
+    up to max_batch_size, optionally waiting max_wait seconds for more. Only chunks
+    with the same number of mel frames share a forward: a padded tail would change
+    the end of the shorter chunk, which token2wav keeps as cache source and fades
+    into the next chunk.
+
+    The worker runs on the default cuda stream, same as token2wav, so the returned
+    tensors can be used by the caller without extra synchronization.
+    """
+
+    def __init__(self, hift: torch.nn.Module, max_batch_size: int = 8, max_wait: float = 0.0):
+        self.hift = hift
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.pending = queue.Queue()
+        self.thread = threading.Thread(target=self._loop, daemon=True)
+        self.thread.start()
+
+    def inference(self, speech_feat: torch.Tensor,
+                  cache_source: torch.Tensor = torch.zeros(1, 1, 0)) -> Tuple[torch.Tensor, torch.Tensor]:
+        request = _VocoderRequest(speech_feat, cache_source)
+        self.pending.put(request)
+        return request.future.result()
+
+    def _collect(self) -> List[_VocoderRequest]:
+        requests = [self.pending.get()]
+        deadline = time.perf_counter() + self.max_wait
+        while len(requests) < self.max_batch_size:
+            try:
+                remaining = deadline - time.perf_counter()
+                if remaining > 0:
+                    requests.append(self.pending.get(timeout=remaining))
+                else:
+                    requests.append(self.pending.get_nowait())
+            except queue.Empty:
+                break
+        return requests
+
+    def _loop(self):
+        while True:
+            groups = defaultdict(list)
+            for request in self._collect():
+                groups[request.speech_feat.shape[2]].append(request)
+            for requests in groups.values():
+                self._run(requests)
+
+    def _run(self, requests: List[_VocoderRequest]):
+        try:
+            if len(requests) == 1:
+                outputs = [self.hift.inference(speech_feat=requests[0].speech_feat, cache_source=requests[0].cache_source)]
+            else:
+                outputs = self.hift.batch_inference([request.speech_feat for request in requests],
+                                                    [request.cache_source.to(request.speech_feat.device) for request in requests])
+        except Exception as e:
+            for request in requests:
+                request.future.set_exception(e)
+            return
+        for request, output in zip(requests, outputs):
+            request.future.set_result(output)
@@ -15,6 +15,7 @@
 """HIFI-GAN"""
 
 from typing import Dict, Optional, List
+import math
 import numpy as np
 from scipy.signal import get_window
 import torch
@@ -30,6 +31,9 @@ from cosyvoice.transformer.activation import Snake
 from cosyvoice.utils.common import get_padding
 from cosyvoice.utils.common import init_weights
 
+# log-mel of silence: the frontend's mel_spectrogram clamps magnitudes at 1e-5 before the log
+SILENCE_LOG_MEL = math.log(1e-5)
+
 
 """hifigan based generator implementation.
 
@@ -409,3 +413,30 @@ class HiFTGenerator(nn.Module):
             s[:, :, :cache_source.shape[2]] = cache_source
         generated_speech = self.decode(x=speech_feat, s=s)
         return generated_speech, s
+
+    @torch.inference_mode()
+    def batch_inference(self, speech_feats: List[torch.Tensor], cache_sources: List[torch.Tensor]) -> List[tuple]:
+        """inference of several (1, 80, T_i) mels in one forward
+
+        Mels are right padded with silence to the longest one and the outputs and sources
+        are trimmed back to T_i frames. Only the last samples within the receptive field
+        of the padding can differ from a single inference, chunks of equal length are exact.
+        """
+        feat_lens = [feat.shape[2] for feat in speech_feats]
+        max_len = max(feat_lens)
+        speech_feat = torch.concat([F.pad(feat, (0, max_len - feat.shape[2]), value=SILENCE_LOG_MEL)
+                                    for feat in speech_feats], dim=0)
+        # mel->f0
+        f0 = self.f0_predictor(speech_feat)
+        # f0->source
+        s = self.f0_upsamp(f0[:, None]).transpose(1, 2)  # bs,n,t
+        s, _, _ = self.m_source(s)
+        s = s.transpose(1, 2)
+        # use cache_source to avoid glitch
+        for i, cache_source in enumerate(cache_sources):
+            if cache_source.shape[2] != 0:
+                s[i, :, :cache_source.shape[2]] = cache_source[0]
+        generated_speech = self.decode(x=speech_feat, s=s)
+        upsample_scale = s.shape[2] // max_len
+        return [(generated_speech[i:i + 1, :feat_len * upsample_scale], s[i:i + 1, :, :feat_len * upsample_scale])
+                for i, feat_len in enumerate(feat_lens)]
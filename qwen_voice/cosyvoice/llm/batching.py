@@ -0,0 +1,196 @@
+# Copyright (c) 2024 Alibaba Inc (authors: Xiang Lyu)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Continuous batching for TransformerLM speech token decoding."""
+import queue
+import threading
+from contextlib import nullcontext
+from typing import Generator, List
+
+import torch
+import torch.nn.functional as F
+
+from cosyvoice.transformer.encoder_layer import TransformerEncoderLayer
+
+
+class _LMRequest:
+
+    def __init__(self, lm_input, min_len, max_len, sampling):
+        self.lm_input = lm_input
+        self.min_len = min_len
+        self.max_len = max_len
+        self.sampling = sampling
+        self.out_tokens: List[int] = []
+        # decoded tokens are handed to the caller through this queue, None marks the end
+        self.token_queue = queue.Queue()
+
+
+class ContinuousBatchingLM:
+    """Merge the per-step decode of all in-flight requests into one batched forward.
+
+    New requests are prefilled one by one, then join the running batch. Every decode
+    step feeds the last token of each active sequence through the llm at once. KV caches
+    of sequences with different lengths are left padded and a key padding mask hides the
+    padding, so relative position encodings stay aligned to the current token.
+
+    The batched step reimplements BaseEncoder.forward_chunk for batch > 1, it needs an
+    eager (non jit) TransformerEncoder as TransformerLM.llm.
+    """
+
+    def __init__(self, lm: torch.nn.Module, max_batch_size: int = 32, context=None):
+        assert not isinstance(lm.llm, torch.jit.ScriptModule), \
+            'continuous batching needs an eager llm, load CosyVoice with load_jit=False'
+        assert all(isinstance(layer, TransformerEncoderLayer) for layer in lm.llm.encoders), \
+            'continuous batching only supports transformer encoder layers'
+        self.lm = lm
+        self.max_batch_size = max_batch_size
+        self.context = context if context is not None else nullcontext()
+        self.pending = queue.Queue()
+        self.thread = threading.Thread(target=self._loop, daemon=True)
+        self.thread.start()
+
+    def inference(self, text, text_len, prompt_text, prompt_text_len, prompt_speech_token, prompt_speech_token_len,
+                  embedding, sampling: int = 25, max_token_text_ratio: float = 20,
+                  min_token_text_ratio: float = 2, **kwargs) -> Generator[int, None, None]:
+        """Same interface as TransformerLM.inference, tokens come from the shared batch."""
+        with torch.inference_mode():
+            lm_input, min_len, max_len = self.lm.prepare_inference_input(text, text_len, prompt_text, prompt_text_len,
+                                                                         prompt_speech_token, prompt_speech_token_len,
+                                                                         embedding, max_token_text_ratio,
+                                                                         min_token_text_ratio)
+        request = _LMRequest(lm_input, min_len, max_len, sampling)
+        self.pending.put(request)
+        while True:
+            token = request.token_queue.get()
+            if token is None:
+                break
+            if isinstance(token, Exception):
+                raise token
+            yield token
+
+    def _loop(self):
+        with torch.inference_mode(), self.context:
+            active: List[_LMRequest] = []
+            att_cache, key_mask = None, None
+            while True:
+                # block when idle, otherwise only admit what is already waiting
+                if len(active) == 0:
+                    new_requests = [self.pending.get()]
+                else:
+                    new_requests = []
+                while len(active) + len(new_requests) < self.max_batch_size:
+                    try:
+                        new_requests.append(self.pending.get_nowait())
+                    except queue.Empty:
+                        break
+                try:
+                    for request in new_requests:
+                        cache = self._prefill(request)
+                        if cache is None:
+                            continue
+                        active.append(request)
+                        att_cache, key_mask = self._merge(att_cache, key_mask, cache)
+                    if len(active) == 0:
+                        continue
+                    att_cache, key_mask, finished = self._step(active, att_cache, key_mask)
+                    if len(finished) != 0:
+                        keep = [i for i in range(len(active)) if i not in finished]
+                        active = [active[i] for i in keep]
+                        att_cache, key_mask = self._select(att_cache, key_mask, keep)
+                except Exception as e:
+                    for request in active + new_requests:
+                        request.token_queue.put(e)
+                    active, att_cache, key_mask = [], None, None
+
+    def _emit(self, request: _LMRequest, top_ids: int) -> bool:
+        """Hand one sampled token to its request, return True when the sequence is finished."""
+        if top_ids == self.lm.speech_token_size:
+            request.token_queue.put(None)
+            return True
+        request.token_queue.put(top_ids)
+        request.out_tokens.append(top_ids)
+        if len(request.out_tokens) >= request.max_len:
+            request.token_queue.put(None)
+            return True
+        return False
+
+    def _prefill(self, request: _LMRequest):
+        lm_input = request.lm_input
+        if request.max_len <= 0:
+            request.token_queue.put(None)
+            return None
+        att_cache, cnn_cache = torch.zeros((0, 0, 0, 0), device=lm_input.device), torch.zeros((0, 0, 0, 0), device=lm_input.device)
+        y_pred, att_cache, _ = self.lm.llm.forward_chunk(lm_input, offset=0, required_cache_size=-1,
+                                                         att_cache=att_cache, cnn_cache=cnn_cache,
+                                                         att_mask=torch.tril(torch.ones((1, lm_input.shape[1], lm_input.shape[1]),
+                                                                                        device=lm_input.device)).to(torch.bool))
+        logp = self.lm.llm_decoder(y_pred[:, -1]).log_softmax(dim=-1)
+        top_ids = self.lm.sampling_ids(logp.squeeze(dim=0), request.out_tokens, request.sampling,
+                                       ignore_eos=request.min_len > 0).item()
+        if self._emit(request, top_ids):
+            return None
+        # (elayers, head, t, d_k * 2) -> (elayers, b=1, head, t, d_k * 2)
+        return att_cache.unsqueeze(dim=1)
+
+    @staticmethod
+    def _merge(att_cache, key_mask, cache):
+        """Append one sequence cache to the batch, left padding the shorter side."""
+        mask = torch.ones((1, 1, cache.size(3)), dtype=torch.bool, device=cache.device)
+        if att_cache is None:
+            return cache, mask
+        pad = att_cache.size(3) - cache.size(3)
+        if pad > 0:
+            cache = F.pad(cache, (0, 0, pad, 0))
+            mask = F.pad(mask, (pad, 0), value=False)
+        elif pad < 0:
+            att_cache = F.pad(att_cache, (0, 0, -pad, 0))
+            key_mask = F.pad(key_mask, (-pad, 0), value=False)
+        return torch.concat([att_cache, cache], dim=1), torch.concat([key_mask, mask], dim=0)
+
+    @staticmethod
+    def _select(att_cache, key_mask, keep):
+        """Drop finished sequences and the left padding no sequence needs anymore."""
+        if len(keep) == 0:
+            return None, None
+        index = torch.tensor(keep, device=att_cache.device)
+        att_cache, key_mask = att_cache.index_select(1, index), key_mask.index_select(0, index)
+        start = int(key_mask[:, 0].any(dim=0).nonzero()[0])
+        return att_cache[:, :, :, start:], key_mask[:, :, start:]
+
+    def _step(self, active: List[_LMRequest], att_cache: torch.Tensor, key_mask: torch.Tensor):
+        llm = self.lm.llm
+        batch_size, cache_t = len(active), att_cache.size(3)
+        last_tokens = torch.tensor([request.out_tokens[-1] for request in active], device=att_cache.device)
+        xs = self.lm.speech_embedding.weight[last_tokens].unsqueeze(dim=1)
+        # real (unpadded) position of the new token of each sequence
+        offset = key_mask.sum(dim=(1, 2))
+        tmp_masks = torch.ones((batch_size, 1, 1), dtype=torch.bool, device=xs.device)
+        if llm.global_cmvn is not None:
+            xs = llm.global_cmvn(xs)
+        xs, _, _ = llm.embed(xs, tmp_masks, offset)
+        pos_emb = llm.embed.position_encoding(offset=offset - cache_t, size=cache_t + 1)
+        key_mask = torch.concat([key_mask, tmp_masks], dim=2)
+        r_att_cache = []
+        for i, layer in enumerate(llm.encoders):
+            xs, _, new_att_cache, _ = layer(xs, key_mask, pos_emb, att_cache=att_cache[i])
+            r_att_cache.append(new_att_cache)
+        if llm.normalize_before:
+            xs = llm.after_norm(xs)
+        att_cache = torch.stack(r_att_cache, dim=0)
+        logp = self.lm.llm_decoder(xs[:, -1]).log_softmax(dim=-1)
+        # sample the whole batch at once, one host sync per step
+        ignore_eos = torch.tensor([len(request.out_tokens) < request.min_len for request in active], device=logp.device)
+        top_ids = self.lm.sampling_ids(logp, [request.out_tokens for request in active], active[0].sampling,
+                                       ignore_eos=ignore_eos).squeeze(dim=1).tolist()
+        finished = [i for i, request in enumerate(active) if self._emit(request, top_ids[i])]
+        return att_cache, key_mask, finished
@@ -11,7 +11,7 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
-from typing import Dict, Optional, Callable, List, Generator
+from typing import Dict, Optional, Callable, List, Generator, Union
 import torch
 from torch import nn
 import torch.nn.functional as F
@@ -19,6 +19,7 @@ from torch.nn.utils.rnn import pad_sequence, unpad_sequence
 from cosyvoice.utils.common import IGNORE_ID
 from cosyvoice.transformer.label_smoothing_loss import LabelSmoothingLoss
 from cosyvoice.utils.common import th_accuracy
+from cosyvoice.transformer.kv_cache import StaticKVCache
 
 
 class TransformerLM(torch.nn.Module):
@@ -66,6 +67,8 @@ class TransformerLM(torch.nn.Module):
 
         # 4. sampling method
         self.sampling = sampling
+        # optional compiled single token decode step, see CosyVoiceModel.load_compile
+        self.compiled_forward_chunk = None
 
     def encode(
             self,
@@ -141,16 +144,20 @@ class TransformerLM(torch.nn.Module):
             weighted_scores: torch.Tensor,
             decoded_tokens: List,
             sampling: int,
-            ignore_eos: bool = True,
+            ignore_eos: Union[bool, torch.Tensor] = True,
     ):
-        while True:
-            top_ids = self.sampling(weighted_scores, decoded_tokens, sampling)
-            if (not ignore_eos) or (self.speech_token_size not in top_ids):
-                break
+        # mask eos instead of resampling until a non-eos token is drawn,
+        # ignore_eos can be a bool tensor (batch,) for batched scores
+        if isinstance(ignore_eos, torch.Tensor):
+            weighted_scores = weighted_scores.clone()
+            weighted_scores[..., self.speech_token_size] = weighted_scores[..., self.speech_token_size].masked_fill(ignore_eos, -float('inf'))
+        elif ignore_eos:
+            weighted_scores = weighted_scores.clone()
+            weighted_scores[..., self.speech_token_size] = -float('inf')
+        top_ids = self.sampling(weighted_scores, decoded_tokens, sampling)
         return top_ids
 
-    @torch.inference_mode()
-    def inference(
+    def prepare_inference_input(
             self,
             text: torch.Tensor,
             text_len: torch.Tensor,
@@ -159,10 +166,9 @@ class TransformerLM(torch.nn.Module):
             prompt_speech_token: torch.Tensor,
             prompt_speech_token_len: torch.Tensor,
             embedding: torch.Tensor,
-            sampling: int = 25,
             max_token_text_ratio: float = 20,
             min_token_text_ratio: float = 2,
-    ) -> Generator[torch.Tensor, None, None]:
+    ):
         device = text.device
         text = torch.concat([prompt_text, text], dim=1)
         text_len += prompt_text_len
@@ -191,22 +197,51 @@ class TransformerLM(torch.nn.Module):
         # 4. cal min/max_length
         min_len = int((text_len - prompt_text_len) * min_token_text_ratio)
         max_len = int((text_len - prompt_text_len) * max_token_text_ratio)
+        return lm_input, min_len, max_len
+
+    @torch.inference_mode()
+    def inference(
+            self,
+            text: torch.Tensor,
+            text_len: torch.Tensor,
+            prompt_text: torch.Tensor,
+            prompt_text_len: torch.Tensor,
+            prompt_speech_token: torch.Tensor,
+            prompt_speech_token_len: torch.Tensor,
+            embedding: torch.Tensor,
+            sampling: int = 25,
+            max_token_text_ratio: float = 20,
+            min_token_text_ratio: float = 2,
+            static_kv_cache: bool = False,
+    ) -> Generator[torch.Tensor, None, None]:
+        lm_input, min_len, max_len = self.prepare_inference_input(text, text_len, prompt_text, prompt_text_len,
+                                                                  prompt_speech_token, prompt_speech_token_len, embedding,
+                                                                  max_token_text_ratio, min_token_text_ratio)
 
-        # 5. step by step decode
-        out_tokens = []
+        # 5. step by step decode, decoded tokens stay on device for sampling
+        out_tokens = torch.zeros((max_len,), dtype=torch.long, device=lm_input.device)
         offset = 0
         att_cache, cnn_cache = torch.zeros((0, 0, 0, 0), device=lm_input.device), torch.zeros((0, 0, 0, 0), device=lm_input.device)
+        kv_cache = None
+        forward_chunk = self.compiled_forward_chunk if self.compiled_forward_chunk is not None else self.llm.forward_chunk
+        if static_kv_cache is True:
+            assert hasattr(self.llm, 'forward_chunk_static_cache'), 'static kv cache needs an eager llm, load CosyVoice with load_jit=False'
+            kv_cache = StaticKVCache.from_encoder(self.llm, lm_input.shape[1] + max_len, lm_input.device, lm_input.dtype)
         for i in range(max_len):
-            y_pred, att_cache, cnn_cache = self.llm.forward_chunk(lm_input, offset=offset, required_cache_size=-1,
-                                                                  att_cache=att_cache, cnn_cache=cnn_cache,
-                                                                  att_mask=torch.tril(torch.ones((1, lm_input.shape[1], lm_input.shape[1]),
-                                                                                                 device=lm_input.device)).to(torch.bool))
+            if kv_cache is not None:
+                y_pred = self.llm.forward_chunk_static_cache(lm_input, offset=offset, kv_cache=kv_cache)
+            else:
+                y_pred, att_cache, cnn_cache = forward_chunk(lm_input, offset=offset, required_cache_size=-1,
+                                                             att_cache=att_cache, cnn_cache=cnn_cache,
+                                                             att_mask=torch.tril(torch.ones((1, lm_input.shape[1], lm_input.shape[1]),
+                                                                                            device=lm_input.device)).to(torch.bool))
             logp = self.llm_decoder(y_pred[:, -1]).log_softmax(dim=-1)
-            top_ids = self.sampling_ids(logp.squeeze(dim=0), out_tokens, sampling, ignore_eos=True if i < min_len else False).item()
+            top_ids = self.sampling_ids(logp.squeeze(dim=0), out_tokens[:i], sampling, ignore_eos=True if i < min_len else False)
+            out_tokens[i:i + 1] = top_ids
+            top_ids = top_ids.item()
             if top_ids == self.speech_token_size:
                 break
             # in stream mode, yield token one by one
             yield top_ids
-            out_tokens.append(top_ids)
             offset += lm_input.size(1)
             lm_input = self.speech_embedding.weight[top_ids].reshape(1, 1, -1)
@@ -193,9 +193,48 @@ class MultiHeadedAttention(nn.Module):
         #   non-trivial to calculate `next_cache_start` here.
         new_cache = torch.cat((k, v), dim=-1)
 
-        scores = torch.matmul(q, k.transpose(-2, -1)) / math.sqrt(self.d_k)
+        scores = self.compute_scores(q, k, pos_emb)
         return self.forward_attention(v, scores, mask), new_cache
 
+    def compute_scores(self, q: torch.Tensor, k: torch.Tensor,
+                       pos_emb: torch.Tensor) -> torch.Tensor:
+        """Compute attention scores.
+
+        Args:
+            q (torch.Tensor): Transformed query (#batch, n_head, time1, d_k).
+            k (torch.Tensor): Transformed key (#batch, n_head, time2, d_k).
+            pos_emb (torch.Tensor): Positional embedding, not used here.
+
+        Returns:
+            torch.Tensor: Attention score (#batch, n_head, time1, time2).
+
+        """
+        return torch.matmul(q, k.transpose(-2, -1)) / math.sqrt(self.d_k)
+
+    def forward_static_cache(self, x: torch.Tensor, mask: torch.Tensor,
+                             pos_emb: torch.Tensor, kv_cache,
+                             layer_idx: int) -> torch.Tensor:
+        """Self attention with a preallocated StaticKVCache.
+
+        Key/value of `x` are written in place into `kv_cache` instead of
+        being concatenated to the previous cache.
+
+        Args:
+            x (torch.Tensor): Input tensor (#batch=1, time1, size).
+            mask (torch.Tensor): Mask tensor (#batch, time1, time2).
+            pos_emb (torch.Tensor): Positional embedding tensor.
+            kv_cache (StaticKVCache): Preallocated key/value cache.
+            layer_idx (int): Layer index in `kv_cache`.
+
+        Returns:
+            torch.Tensor: Output tensor (#batch, time1, d_model).
+
+        """
+        q, k, v = self.forward_qkv(x, x, x)
+        k, v = kv_cache.update(layer_idx, k, v)
+        scores = self.compute_scores(q, k, pos_emb)
+        return self.forward_attention(v, scores, mask)
+
 
 class RelPositionMultiHeadedAttention(MultiHeadedAttention):
     """Multi-Head Attention layer with relative position encoding.
@@ -274,7 +313,6 @@ class RelPositionMultiHeadedAttention(MultiHeadedAttention):
                 and `head * d_k == size`
         """
         q, k, v = self.forward_qkv(query, key, value)
-        q = q.transpose(1, 2)  # (batch, time1, head, d_k)
 
         # NOTE(xcsong):
         #   when export onnx model, for 1st chunk, we feed
@@ -302,6 +340,24 @@ class RelPositionMultiHeadedAttention(MultiHeadedAttention):
         #   non-trivial to calculate `next_cache_start` here.
         new_cache = torch.cat((k, v), dim=-1)
 
+        scores = self.compute_scores(q, k, pos_emb)
+        return self.forward_attention(v, scores, mask), new_cache
+
+    def compute_scores(self, q: torch.Tensor, k: torch.Tensor,
+                       pos_emb: torch.Tensor) -> torch.Tensor:
+        """Compute attention scores with relative positional encoding.
+
+        Args:
+            q (torch.Tensor): Transformed query (#batch, n_head, time1, d_k).
+            k (torch.Tensor): Transformed key (#batch, n_head, time2, d_k).
+            pos_emb (torch.Tensor): Positional embedding tensor
+                (#batch, time2, size).
+
+        Returns:
+            torch.Tensor: Attention score (#batch, n_head, time1, time2).
+
+        """
+        q = q.transpose(1, 2)  # (batch, time1, head, d_k)
         n_batch_pos = pos_emb.size(0)
         p = self.linear_pos(pos_emb).view(n_batch_pos, -1, self.h, self.d_k)
         p = p.transpose(1, 2)  # (batch, head, time1, d_k)
@@ -324,7 +380,5 @@ class RelPositionMultiHeadedAttention(MultiHeadedAttention):
         if matrix_ac.shape != matrix_bd.shape:
             matrix_bd = self.rel_shift(matrix_bd)
 
-        scores = (matrix_ac + matrix_bd) / math.sqrt(
+        return (matrix_ac + matrix_bd) / math.sqrt(
             self.d_k)  # (batch, head, time1, time2)
-
-        return self.forward_attention(v, scores, mask), new_cache
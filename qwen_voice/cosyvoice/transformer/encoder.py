@@ -271,6 +271,42 @@ class BaseEncoder(torch.nn.Module):
 
         return (xs, r_att_cache, r_cnn_cache)
 
+    def forward_chunk_static_cache(self, xs: torch.Tensor, offset: int,
+                                   kv_cache) -> torch.Tensor:
+        """ Forward just one chunk with a preallocated StaticKVCache
+
+        Same as forward_chunk with required_cache_size=-1, but key/value
+        of every layer are written in place into `kv_cache` and the causal
+        mask is taken from `kv_cache`, so no cache or mask is reallocated.
+        Only TransformerEncoderLayer is supported.
+
+        Args:
+            xs (torch.Tensor): chunk input, with shape (b=1, time, mel-dim)
+            offset (int): current offset in encoder output time stamp
+            kv_cache (StaticKVCache): cache holding `offset` steps of history
+
+        Returns:
+            torch.Tensor: output of current input xs,
+                with shape (b=1, chunk_size, hidden-dim).
+
+        """
+        assert xs.size(0) == 1
+        tmp_masks = torch.ones(1, 1, xs.size(1), device=xs.device, dtype=torch.bool)
+        if self.global_cmvn is not None:
+            xs = self.global_cmvn(xs)
+        xs, pos_emb, _ = self.embed(xs, tmp_masks, offset)
+        cache_t1, chunk_size = kv_cache.length, xs.size(1)
+        attention_key_size = cache_t1 + chunk_size
+        pos_emb = self.embed.position_encoding(offset=offset - cache_t1,
+                                               size=attention_key_size)
+        att_mask = kv_cache.causal_mask(chunk_size)
+        for i, layer in enumerate(self.encoders):
+            xs = layer.forward_static_cache(xs, att_mask, pos_emb, kv_cache, i)
+        kv_cache.advance(chunk_size)
+        if self.normalize_before:
+            xs = self.after_norm(xs)
+        return xs
+
     @torch.jit.unused
     def forward_chunk_by_chunk(
         self,
@@ -0,0 +1,66 @@
+# Copyright (c) 2024 Alibaba Inc (authors: Xiang Lyu)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Preallocated key/value cache for step by step decoding."""
+from typing import Tuple
+
+import torch
+
+
+class StaticKVCache:
+    """Key/value slab of all layers, allocated once for the whole utterance.
+
+    forward_chunk returns a cache that grows by torch.cat every step, which copies
+    the full history per step. Here every layer writes the key/value of the new
+    step in place at `length` and attends to a view of the first `length + time`
+    slots. The causal mask is built once and sliced per step as well.
+
+    Args:
+        num_layers (int): number of attention layers.
+        n_head (int): number of attention heads.
+        d_k (int): dimension of each head.
+        max_len (int): max number of steps (prompt + generated tokens).
+    """
+
+    def __init__(self, num_layers: int, n_head: int, d_k: int, max_len: int,
+                 device: torch.device, dtype: torch.dtype = torch.float32):
+        self.max_len = max_len
+        self.key = torch.zeros((num_layers, 1, n_head, max_len, d_k), device=device, dtype=dtype)
+        self.value = torch.zeros((num_layers, 1, n_head, max_len, d_k), device=device, dtype=dtype)
+        self.mask = torch.tril(torch.ones((max_len, max_len), device=device, dtype=torch.bool))
+        self.length = 0
+
+    @classmethod
+    def from_encoder(cls, encoder: torch.nn.Module, max_len: int,
+                     device: torch.device, dtype: torch.dtype = torch.float32):
+        self_attn = encoder.encoders[0].self_attn
+        return cls(len(encoder.encoders), self_attn.h, self_attn.d_k, max_len, device, dtype)
+
+    def update(self, layer_idx: int, k: torch.Tensor, v: torch.Tensor) -> Tuple[torch.Tensor, torch.Tensor]:
+        """Write k/v (1, head, time, d_k) at the current position, return the history views."""
+        end = self.length + k.size(2)
+        assert end <= self.max_len, 'static kv cache overflow, {} > {}'.format(end, self.max_len)
+        self.key[layer_idx, :, :, self.length:end].copy_(k)
+        self.value[layer_idx, :, :, self.length:end].copy_(v)
+        return self.key[layer_idx, :, :, :end], self.value[layer_idx, :, :, :end]
+
+    def causal_mask(self, size: int) -> torch.Tensor:
+        """Causal mask (1, size, length + size) for the next `size` steps."""
+        end = self.length + size
+        return self.mask[self.length:end, :end].unsqueeze(0)
+
+    def advance(self, size: int):
+        self.length += size
+
+    def reset(self):
+        self.length = 0
@@ -105,45 +105,57 @@ def init_weights(m, mean=0.0, std=0.01):
         m.weight.data.normal_(mean, std)
 
 
+def _recent_tokens(decoded_tokens, win_size, weighted_scores):
+    """Last `win_size` decoded tokens as a long tensor on the scores device.
+
+    decoded_tokens is a list (or 1-D tensor) for a single sequence, or a list of
+    lists (or 2-D tensor) for a batch, short histories are padded with -1.
+    """
+    if isinstance(decoded_tokens, torch.Tensor):
+        return decoded_tokens[..., -win_size:].to(device=weighted_scores.device, dtype=torch.long)
+    if weighted_scores.dim() == 1:
+        return torch.tensor(decoded_tokens[-win_size:], dtype=torch.long, device=weighted_scores.device)
+    window = [[-1] * (win_size - len(tokens[-win_size:])) + list(tokens[-win_size:]) for tokens in decoded_tokens]
+    return torch.tensor(window, dtype=torch.long, device=weighted_scores.device)
+
+
 # Repetition Aware Sampling in VALL-E 2
 def ras_sampling(weighted_scores, decoded_tokens, sampling, top_p=0.8, top_k=25, win_size=10, tau_r=0.1):
+    # both candidates are drawn on device and selected with torch.where, no host sync
     top_ids = nucleus_sampling(weighted_scores, top_p=top_p, top_k=top_k)
-    rep_num = (torch.tensor(decoded_tokens[-win_size:]).to(weighted_scores.device) == top_ids).sum().item()
-    if rep_num >= win_size * tau_r:
-        top_ids = random_sampling(weighted_scores, decoded_tokens, sampling)
-    return top_ids
+    rep_num = (_recent_tokens(decoded_tokens, win_size, weighted_scores) == top_ids).sum(dim=-1, keepdim=True)
+    random_ids = random_sampling(weighted_scores, decoded_tokens, sampling)
+    return torch.where(rep_num >= win_size * tau_r, random_ids, top_ids)
 
 
 def nucleus_sampling(weighted_scores, top_p=0.8, top_k=25):
-    prob, indices = [], []
-    cum_prob = 0.0
-    sorted_value, sorted_idx = weighted_scores.softmax(dim=0).sort(descending=True, stable=True)
-    for i in range(len(sorted_idx)):
-        # sampling both top-p and numbers.
-        if cum_prob < top_p and len(prob) < top_k:
-            cum_prob += sorted_value[i]
-            prob.append(sorted_value[i])
-            indices.append(sorted_idx[i])
-        else:
-            break
-    prob = torch.tensor(prob).to(weighted_scores)
-    indices = torch.tensor(indices, dtype=torch.long).to(weighted_scores.device)
-    top_ids = indices[prob.multinomial(1, replacement=True)]
+    # weighted_scores is (vocab,) or (batch, vocab), sampling both top-p and numbers.
+    top_k = min(top_k, weighted_scores.size(-1))
+    sorted_value, sorted_idx = weighted_scores.softmax(dim=-1).topk(top_k, dim=-1)
+    # keep token i while the probability of the tokens before it is below top_p
+    cum_prob = sorted_value.cumsum(dim=-1) - sorted_value
+    prob = sorted_value.masked_fill(cum_prob >= top_p, 0)
+    top_ids = sorted_idx.gather(-1, prob.multinomial(1, replacement=True))
     return top_ids
 
 
 def random_sampling(weighted_scores, decoded_tokens, sampling):
-    top_ids = weighted_scores.softmax(dim=0).multinomial(1, replacement=True)
+    top_ids = weighted_scores.softmax(dim=-1).multinomial(1, replacement=True)
     return top_ids
 
 
 def fade_in_out(fade_in_mel, fade_out_mel, window):
-    device = fade_in_mel.device
-    fade_in_mel, fade_out_mel = fade_in_mel.cpu(), fade_out_mel.cpu()
+    """crossfade the head of fade_in_mel with the tail of fade_out_mel, in place on their device
+
+    window should be a tensor on the same device, see CosyVoiceModel.__init__,
+    a numpy window is still accepted and converted on every call.
+    """
+    if not isinstance(window, torch.Tensor):
+        window = torch.from_numpy(window).to(fade_in_mel)
     mel_overlap_len = int(window.shape[0] / 2)
-    fade_in_mel[..., :mel_overlap_len] = fade_in_mel[..., :mel_overlap_len] * window[:mel_overlap_len] + \
-        fade_out_mel[..., -mel_overlap_len:] * window[mel_overlap_len:]
-    return fade_in_mel.to(device)
+    fade_in_mel[..., :mel_overlap_len].mul_(window[:mel_overlap_len]).add_(
+        fade_out_mel[..., -mel_overlap_len:] * window[mel_overlap_len:])
+    return fade_in_mel
 
 
 def set_all_random_seed(seed):
@@ -0,0 +1,110 @@
+# Copyright (c) 2024 Alibaba Inc (authors: Xiang Lyu)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""torch.compile / CUDA graph wrappers for the flow estimator and the llm decode step."""
+import threading
+from typing import Callable, List, Sequence
+
+import torch
+import torch.nn.functional as F
+
+from cosyvoice.utils.file_utils import logging
+
+DEFAULT_MEL_BUCKETS = (128, 256, 384, 512, 768, 1024, 1536, 2048)
+
+
+class BucketedEstimator(torch.nn.Module):
+    """Flow estimator compiled for a fixed set of mel lengths.
+
+    Inputs are right padded along time to the smallest bucket that fits, with the
+    padded frames masked out, so every call hits one of a few static shapes and
+    mode='reduce-overhead' can replay a CUDA graph per bucket. Longer inputs and
+    any failure of the compiled path fall back to the eager estimator.
+
+    Args:
+        estimator (torch.nn.Module): eager ConditionalDecoder.
+        buckets (Sequence[int]): mel lengths to compile for.
+        mode (str): torch.compile mode.
+    """
+
+    def __init__(self, estimator: torch.nn.Module, buckets: Sequence[int] = DEFAULT_MEL_BUCKETS,
+                 mode: str = 'reduce-overhead'):
+        super().__init__()
+        self.estimator = estimator
+        self.buckets: List[int] = sorted(buckets)
+        self.compiled = torch.compile(estimator, mode=mode, dynamic=False)
+        # cuda graph replays are not thread safe and the graph output buffers are shared
+        self.lock = threading.Lock()
+        self.failed = False
+
+    def bucket(self, size: int) -> int:
+        for bucket in self.buckets:
+            if size <= bucket:
+                return bucket
+        return -1
+
+    def forward(self, x, mask, mu, t, spks=None, cond=None):
+        size = x.shape[2]
+        bucket = self.bucket(size)
+        if bucket == -1 or self.failed:
+            return self.estimator(x, mask, mu, t, spks, cond)
+        pad = bucket - size
+        x, mask, mu = F.pad(x, (0, pad)), F.pad(mask, (0, pad)), F.pad(mu, (0, pad))
+        cond = F.pad(cond, (0, pad)) if cond is not None else None
+        try:
+            with self.lock:
+                return self.compiled(x, mask, mu, t, spks, cond)[:, :, :size].clone()
+        except Exception as e:
+            logging.warning('compiled flow estimator failed, fall back to eager: {}'.format(e))
+            self.failed = True
+            return self.estimator(x[:, :, :size], mask[:, :, :size], mu[:, :, :size], t, spks,
+                                  cond[:, :, :size] if cond is not None else None)
+
+    @torch.inference_mode()
+    def warmup(self, batch_sizes: Sequence[int], n_feats: int, spk_emb_dim: int, device: torch.device, dtype: torch.dtype):
+        """Compile and capture every bucket for the given estimator batch sizes."""
+        for batch_size in batch_sizes:
+            for bucket in self.buckets:
+                x = torch.randn(batch_size, n_feats, bucket, device=device, dtype=dtype)
+                mask = torch.ones(batch_size, 1, bucket, device=device, dtype=dtype)
+                t = torch.rand(batch_size, device=device, dtype=dtype)
+                spks = torch.zeros(batch_size, spk_emb_dim, device=device, dtype=dtype)
+                # twice, reduce-overhead records the graph on the second call
+                for _ in range(2):
+                    self(x, mask, torch.zeros_like(x), t, spks, torch.zeros_like(x))
+
+
+class CompiledDecodeStep:
+    """torch.compile of the llm forward_chunk used for single token decode steps.
+
+    Cache length grows every step, so it is compiled with dynamic shapes instead of
+    CUDA graphs. Prefill and any failure of the compiled path run eager.
+    """
+
+    def __init__(self, forward_chunk: Callable):
+        self.forward_chunk = forward_chunk
+        self.compiled = torch.compile(forward_chunk, dynamic=True)
+        self.failed = False
+
+    def __call__(self, xs, offset, required_cache_size, att_cache, cnn_cache, att_mask):
+        if xs.size(1) != 1 or self.failed:
+            return self.forward_chunk(xs, offset=offset, required_cache_size=required_cache_size,
+                                      att_cache=att_cache, cnn_cache=cnn_cache, att_mask=att_mask)
+        try:
+            return self.compiled(xs, offset=offset, required_cache_size=required_cache_size,
+                                 att_cache=att_cache, cnn_cache=cnn_cache, att_mask=att_mask)
+        except Exception as e:
+            logging.warning('compiled llm decode step failed, fall back to eager: {}'.format(e))
+            self.failed = True
+            return self.forward_chunk(xs, offset=offset, required_cache_size=required_cache_size,
+                                      att_cache=att_cache, cnn_cache=cnn_cache, att_mask=att_mask)
@@ -14,6 +14,8 @@
 # limitations under the License.
 
 import json
+import os
+import torch
 import torchaudio
 import logging
 logging.getLogger('matplotlib').setLevel(logging.WARNING)
@@ -38,6 +40,17 @@ def read_json_lists(list_file):
     return results
 
 
+def torch_save_atomic(obj, path):
+    """torch.save to a temp file, fsync it and rename it over path, so a crash
+    leaves either the old or the new file, never a truncated one."""
+    tmp_file = '{}.tmp'.format(path)
+    with open(tmp_file, 'wb') as fout:
+        torch.save(obj, fout)
+        fout.flush()
+        os.fsync(fout.fileno())
+    os.replace(tmp_file, path)
+
+
 def load_wav(wav, target_sr):
     speech, sample_rate = torchaudio.load(wav)
     speech = speech.mean(dim=0, keepdim=True)
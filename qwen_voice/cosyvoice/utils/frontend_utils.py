@@ -15,6 +15,12 @@
 import re
 chinese_char_pattern = re.compile(r'[\u4e00-\u9fff]+')
 
+# sentence boundary punctuation used by split_paragraph
+ZH_SENTENCE_PUNCTUATION = ['。', '？', '！', '；', '：', '、', '.', '?', '!', ';']
+EN_SENTENCE_PUNCTUATION = ['.', '?', '!', ';', ':']
+COMMA_PUNCTUATION = ['，', ',']
+CLOSING_QUOTES = ['"', '”']
+
 
 # whether contain chinese character
 def contains_chinese(text):
@@ -75,11 +81,11 @@ def split_paragraph(text: str, tokenize, lang="zh", token_max_n=80, token_min_n=
             return len(tokenize(_text)) < merge_len
 
     if lang == "zh":
-        pounc = ['。', '？', '！', '；', '：', '、', '.', '?', '!', ';']
+        pounc = list(ZH_SENTENCE_PUNCTUATION)
     else:
-        pounc = ['.', '?', '!', ';', ':']
+        pounc = list(EN_SENTENCE_PUNCTUATION)
     if comma_split:
-        pounc.extend(['，', ','])
+        pounc.extend(COMMA_PUNCTUATION)
 
     if text[-1] not in pounc:
         if lang == "zh":
@@ -93,7 +99,7 @@ def split_paragraph(text: str, tokenize, lang="zh", token_max_n=80, token_min_n=
         if c in pounc:
             if len(text[st: i]) > 0:
                 utts.append(text[st: i] + c)
-            if i + 1 < len(text) and text[i + 1] in ['"', '”']:
+            if i + 1 < len(text) and text[i + 1] in CLOSING_QUOTES:
                 tmp = utts.pop(-1)
                 utts.append(tmp + text[i + 1])
                 st = i + 2
@@ -0,0 +1,109 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, AsyncIterator, Callable, Iterator, Optional
+
+_ITEM, _ERROR, _DONE = 0, 1, 2
+
+class SchedulerFullError(Exception):
+    """等待队列已满"""
+
+class SchedulerBusyError(Exception):
+    """排队超时仍未获得执行槽位"""
+
+class InferenceScheduler:
+    """在有界线程池中执行阻塞的推理生成器，带准入控制和超时"""
+    def __init__(self,
+                 max_concurrency: int = 2,
+                 max_queue: int = 16,
+                 queue_timeout: float = 10.0,
+                 timeout: float = 120.0):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.timeout = timeout
+        self.executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix='tts_infer')
+        self.slots = asyncio.Semaphore(max_concurrency)
+        self.waiting = 0
+        self.active = 0
+
+    def stats(self) -> dict:
+        return {
+            'active': self.active,
+            'waiting': self.waiting,
+            'max_concurrency': self.max_concurrency,
+            'max_queue': self.max_queue
+        }
+
+    async def acquire(self):
+        """申请执行槽位，队列已满或排队超时时抛出异常"""
+        if self.waiting >= self.max_queue:
+            raise SchedulerFullError(f"等待队列已满 ({self.max_queue})")
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(self.slots.acquire(), self.queue_timeout)
+        except asyncio.TimeoutError:
+            raise SchedulerBusyError(f"排队超过 {self.queue_timeout}s")
+        finally:
+            self.waiting -= 1
+        self.active += 1
+
+    def release(self):
+        self.active -= 1
+        self.slots.release()
+
+    async def run(self, fn: Callable[[], Any], timeout: Optional[float] = None) -> Any:
+        """在线程池中执行阻塞函数并返回结果，调用前必须先 acquire"""
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(self.executor, fn)
+        future.add_done_callback(lambda _: self.release())
+        # 超时只放弃等待，槽位仍在函数真正结束后释放
+        return await asyncio.wait_for(asyncio.shield(future), min(timeout or self.timeout, self.timeout))
+
+    async def iterate(self,
+                      gen_factory: Callable[[], Iterator[Any]],
+                      timeout: Optional[float] = None) -> AsyncIterator[Any]:
+        """在线程池中迭代同步生成器并逐项产出，调用前必须先 acquire
+
+        槽位在后台线程真正结束后释放；调用方提前退出或超时时，
+        后台线程会在下一块输出之后停止。
+        """
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue()
+        stop_event = threading.Event()
+
+        def produce():
+            gen = None
+            try:
+                gen = gen_factory()
+                for item in gen:
+                    if stop_event.is_set():
+                        break
+                    loop.call_soon_threadsafe(queue.put_nowait, (_ITEM, item))
+            except BaseException as e:
+                loop.call_soon_threadsafe(queue.put_nowait, (_ERROR, e))
+            finally:
+                if gen is not None:
+                    gen.close()
+                loop.call_soon_threadsafe(queue.put_nowait, (_DONE, None))
+
+        future = loop.run_in_executor(self.executor, produce)
+        future.add_done_callback(lambda _: self.release())
+
+        deadline = loop.time() + min(timeout or self.timeout, self.timeout)
+        try:
+            while True:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    raise asyncio.TimeoutError()
+                kind, item = await asyncio.wait_for(queue.get(), remaining)
+                if kind == _DONE:
+                    break
+                if kind == _ERROR:
+                    raise item
+                yield item
+        finally:
+            stop_event.set()
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
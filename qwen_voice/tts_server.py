@@ -1,19 +1,52 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, File, Form, HTTPException, UploadFile
 from pydantic import BaseModel
+from typing import Optional
 from cosyvoice.cli.cosyvoice import CosyVoice
+from cosyvoice.flow.flow_matching import ConditionalCFM
+from cosyvoice.utils.file_utils import logging, load_wav
+from inference_scheduler import InferenceScheduler, SchedulerFullError, SchedulerBusyError
 import torchaudio
 import torch
 from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
+import asyncio
 import io
+import os
+import struct
+import weakref
 
 app = FastAPI()
 
+SAMPLE_RATE = 22050
+
+# 推理调度配置，可通过环境变量覆盖
+MAX_CONCURRENCY = int(os.environ.get('TTS_MAX_CONCURRENCY', 2))    # 同时执行的合成请求数
+MAX_QUEUE = int(os.environ.get('TTS_MAX_QUEUE', 16))               # 允许排队的请求数，超出返回 429
+QUEUE_TIMEOUT = float(os.environ.get('TTS_QUEUE_TIMEOUT', 10))     # 排队超时(秒)，超出返回 503
+REQUEST_TIMEOUT = float(os.environ.get('TTS_REQUEST_TIMEOUT', 120))  # 单个请求的最长合成时间(秒)
+LLM_BATCH_SIZE = int(os.environ.get('TTS_LLM_BATCH_SIZE', 0))      # >0 时跨请求合并 LLM 解码，需要非 jit 模型
+LLM_STATIC_KV_CACHE = os.environ.get('TTS_LLM_STATIC_KV_CACHE', '0') == '1'  # LLM 解码使用预分配 KV 缓存，需要非 jit 模型
+HIFT_BATCH_SIZE = int(os.environ.get('TTS_HIFT_BATCH_SIZE', 0))    # >1 时跨请求合并声码器推理
+COMPILE = os.environ.get('TTS_COMPILE', '0') == '1'                 # torch.compile/CUDA graph 加速，启动时预热，仅 GPU 生效
+
 # 初始化 CosyVoice 模型，只需在启动时加载一次
 cosyvoice = CosyVoice(
     '/mnt/82_store/LLM-weights/voice/CosyVoice-300M-SFT',
-    load_jit=True,
+    load_jit=LLM_BATCH_SIZE == 0 and not LLM_STATIC_KV_CACHE and not COMPILE,
     load_onnx=False,
-    fp16=True
+    fp16=True,
+    llm_batch_size=LLM_BATCH_SIZE,
+    static_kv_cache=LLM_STATIC_KV_CACHE,
+    hift_batch_size=HIFT_BATCH_SIZE,
+    compile=COMPILE
+)
+
+# 阻塞的合成推理在有界线程池中执行，避免占用事件循环
+scheduler = InferenceScheduler(
+    max_concurrency=MAX_CONCURRENCY,
+    max_queue=MAX_QUEUE,
+    queue_timeout=QUEUE_TIMEOUT,
+    timeout=REQUEST_TIMEOUT
 )
 
 # 定义请求体的数据模型
@@ -21,6 +54,66 @@ class TTSRequest(BaseModel):
     text: str
     speaker: str = '中文女'  
     stream: bool = True     # 是否流式合成
+    audio_format: str = 'wav'  # 流式返回格式: wav(带流式头) 或 pcm(16bit 单声道裸数据)
+    timeout: Optional[float] = None  # 本次请求的合成超时(秒)，不超过服务端上限
+    flow_steps: int = 10             # flow matching 求解步数，越少越快
+    flow_solver: Optional[str] = None  # euler / heun / midpoint / dpm，默认使用模型配置
+
+def wav_header(sample_rate: int, num_channels: int = 1, bits_per_sample: int = 16) -> bytes:
+    """生成长度未知的流式 WAV 头"""
+    byte_rate = sample_rate * num_channels * bits_per_sample // 8
+    block_align = num_channels * bits_per_sample // 8
+    return struct.pack('<4sI4s4sIHHIIHH4sI',
+                       b'RIFF', 0xFFFFFFFF, b'WAVE',
+                       b'fmt ', 16, 1, num_channels, sample_rate, byte_rate, block_align, bits_per_sample,
+                       b'data', 0xFFFFFFFF)
+
+def to_pcm16(speech: torch.Tensor) -> bytes:
+    """将 [-1, 1] 浮点语音转换为 16bit PCM 字节"""
+    return (speech.clamp(-1.0, 1.0) * 32767).to(torch.int16).cpu().numpy().tobytes()
+
+class SlotGuard:
+    """已申请的调度槽位，保证只释放一次
+
+    槽位交给 scheduler.iterate 之后由它在后台线程结束时释放，此前的任何退出路径都调用 release()。
+    """
+    def __init__(self):
+        self.done = False
+
+    def hand_over(self):
+        self.done = True
+
+    def release(self):
+        if not self.done:
+            self.done = True
+            scheduler.release()
+
+async def stream_speech(request: TTSRequest, guard: SlotGuard):
+    """逐块产出合成的语音，调用前需已获得调度槽位"""
+    text = request.text
+    try:
+        if request.audio_format == 'wav':
+            yield wav_header(SAMPLE_RATE)
+        # 从这里到 iterate 注册释放回调之间没有挂起点
+        guard.hand_over()
+        async for output in scheduler.iterate(lambda: cosyvoice.inference_sft(text, request.speaker, stream=True,
+                                                                              flow_n_timesteps=request.flow_steps,
+                                                                              flow_solver=request.flow_solver),
+                                              request.timeout):
+            yield to_pcm16(output['tts_speech'])
+    except asyncio.TimeoutError:
+        logging.warning('streaming synthesis timed out, text {}'.format(text))
+    finally:
+        guard.release()
+
+async def acquire_slot():
+    """申请合成槽位，饱和时返回 429/503"""
+    try:
+        await scheduler.acquire()
+    except SchedulerFullError as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={'Retry-After': '1'})
+    except SchedulerBusyError as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={'Retry-After': '1'})
 
 @app.post("/tts")
 async def tts(request: TTSRequest):
@@ -28,11 +121,41 @@ async def tts(request: TTSRequest):
     speaker = request.speaker
     stream = request.stream
 
+    if request.audio_format not in ('wav', 'pcm'):
+        raise HTTPException(status_code=400, detail=f"不支持的音频格式: {request.audio_format}")
+    if not 1 <= request.flow_steps <= 50:
+        raise HTTPException(status_code=400, detail="flow_steps 需在 1 到 50 之间")
+    if request.flow_solver is not None and request.flow_solver not in ConditionalCFM.SOLVERS:
+        raise HTTPException(status_code=400, detail=f"不支持的求解器: {request.flow_solver}")
+
+    await acquire_slot()
+
+    # 流式模式：每生成一块语音立即返回
+    if stream:
+        media_type = 'audio/wav' if request.audio_format == 'wav' else f'audio/L16; rate={SAMPLE_RATE}; channels=1'
+        # 客户端在响应体开始迭代前断开时生成器不会执行，它的 finally 也不会运行：
+        # 由响应结束后的后台任务释放槽位；Starlette 因断开跳过后台任务时，由生成器被回收时释放
+        guard = SlotGuard()
+        body = stream_speech(request, guard)
+        weakref.finalize(body, guard.release)
+        return StreamingResponse(
+            body,
+            media_type=media_type,
+            headers={'X-Sample-Rate': str(SAMPLE_RATE)},
+            background=BackgroundTask(guard.release)
+        )
+
     # 生成语音
     speech_list = []
-    for i, output in enumerate(cosyvoice.inference_sft(text, speaker, stream=stream)):
-        tts_speech = output['tts_speech']
-        speech_list.append(tts_speech)
+    try:
+        async for output in scheduler.iterate(lambda: cosyvoice.inference_sft(text, speaker, stream=stream,
+                                                                              flow_n_timesteps=request.flow_steps,
+                                                                              flow_solver=request.flow_solver),
+                                              request.timeout):
+            tts_speech = output['tts_speech']
+            speech_list.append(tts_speech)
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=504, detail="语音合成超时")
 
     # 合并多个语音片段
     if len(speech_list) > 1:
@@ -42,7 +165,7 @@ async def tts(request: TTSRequest):
 
     # 将语音保存到内存缓冲区
     buffer = io.BytesIO()
-    torchaudio.save(buffer, speech.cpu(), 22050, format='wav')
+    torchaudio.save(buffer, speech.cpu(), SAMPLE_RATE, format='wav')
     buffer.seek(0)
 
     # 返回语音数据作为响应
@@ -54,6 +177,36 @@ async def list_speakers():
     speakers = cosyvoice.list_avaliable_spks()
     return {"speakers": speakers}
 
+# 上传参考音频注册新的说话人，之后可直接用于 /tts 的 speaker 字段
+@app.post("/speakers")
+async def add_speaker(speaker: str = Form(...),
+                      prompt_text: str = Form(''),
+                      overwrite: bool = Form(False),
+                      audio: UploadFile = File(...)):
+    if speaker in cosyvoice.list_avaliable_spks() and not overwrite:
+        raise HTTPException(status_code=409, detail=f"说话人已存在: {speaker}")
+    try:
+        prompt_speech_16k = load_wav(io.BytesIO(await audio.read()), 16000)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"无法读取参考音频: {e}")
+    if prompt_speech_16k.shape[1] / 16000 > 30:
+        raise HTTPException(status_code=400, detail="参考音频不能超过 30 秒")
+
+    await acquire_slot()
+    try:
+        await scheduler.run(lambda: cosyvoice.add_speaker(speaker, prompt_speech_16k, prompt_text))
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=504, detail="说话人注册超时")
+    return {"speaker": speaker}
+
+@app.get("/stats")
+async def stats():
+    return {**scheduler.stats(), **cosyvoice.model.latency_stats()}
+
+@app.on_event("shutdown")
+def shutdown():
+    scheduler.shutdown()
+
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=49999)
\ No newline at end of file
+    uvicorn.run(app, host="0.0.0.0", port=49999)
@@ -7,6 +7,22 @@ BASE_DIR = Path(__file__).resolve().parent.parent.parent
 ASR_API_URL = "http://localhost:50000/api/v1/asr"
 TTS_API_URL = "http://localhost:49999/tts"
 
+# ASR/TTS 服务的 HTTP 连接池配置
+HTTP_CLIENT_CONFIG = {
+    "limit": 100,              # 连接池总连接数
+    "limit_per_host": 32,      # 单个服务的最大连接数
+    "keepalive_timeout": 60,   # 空闲连接保持时间(秒)
+    "dns_cache_ttl": 300,      # DNS 缓存时间(秒)
+    "connect_timeout": 3,      # 建立连接超时(秒)
+    "total_timeout": 30,       # 一次请求总超时(秒)，包括所有重试
+    "asr_timeout": 10,         # ASR 请求总超时(秒)
+    "tts_timeout": 60,         # TTS 请求总超时(秒)，超时不重试
+    "tts_max_retries": 6,      # TTS 服务排队已满(429/503)时的重试次数，总时长受 tts_timeout 限制
+    "max_retries": 2,          # 连接错误、超时和 429/5xx 的重试次数
+    "backoff_base": 0.2,       # 重试退避基数(秒)，每次翻倍
+    "backoff_max": 2.0         # 单次退避上限(秒)
+}
+
 # 模型配置
 MODEL_CONFIG = {
     "default_model": "qwen",  # 默认使用的模型
@@ -27,6 +43,14 @@ MODEL_CONFIG = {
         "top_p": 0.8,
         "use_flash_attention": True,  
         "torch_dtype": "bfloat16",    
+        "vision_token_budget": 1024,  # 每轮所有图像的视觉 token 上限
+        "min_image_tokens": 64,       # 每帧最少 token 数，预算不够时减少帧数
+        "max_image_tokens": 384,      # 每帧最多 token 数 (640x480 约 391)
+        "report_prefill": False,      # 打印每次请求视觉/文本的 prefill token 数，统计始终可通过 prefill_report() 获取
+        "vision_cache_mb": 256,       # 视觉编码缓存占用显存上限(MB)，0 表示关闭
+        "prefix_cache_mb": 4096,      # 所有会话前缀 KV cache 的显存上限(MB)，0 表示关闭
+        "max_prefill_history": 10,    # 会话没有可复用的前缀缓存时最多带上的历史消息条数
+        "share_system_prefix": True   # 加载时预先计算系统提示词的 KV cache，所有会话共享
     },
     
     "local_vllm": {
@@ -38,20 +62,58 @@ MODEL_CONFIG = {
 AUDIO_CONFIG = {
     "sample_rate": 16000,
     "chunk_size": 1024 * 16,
-    "channels": 1
+    "channels": 1,
+    "max_buffer_seconds": 10,  # 单句音频的长度上限(秒)，超过后强制切句
+    "ring_buffer_seconds": 12,  # 每个会话预分配的音频缓冲区长度(秒)，需大于单句上限加前导音频
+    # 语音端点检测，只有检测到的完整句子才会发送到ASR服务
+    "vad": {
+        "frame_ms": 30,
+        "threshold_db": -45,       # 语音帧能量的绝对下限(dBFS)
+        "noise_margin_db": 10,     # 语音帧需高出噪声底的幅度
+        "noise_window_seconds": 5, # 噪声底取该时长内的最小帧能量，持续噪声在一个窗口后被吸收
+        "start_ms": 90,            # 连续语音超过该时长才算开始说话
+        "end_silence_ms": 500,     # 静音超过该时长判定一句结束
+        "pre_roll_ms": 300,        # 句首保留的前导音频，避免切掉第一个字
+        "min_speech_ms": 250       # 语音少于该时长的片段视为噪声丢弃
+    }
 }
 
 # 视频配置
 VIDEO_CONFIG = {
     "frame_width": 640,
     "frame_height": 480,
-    "fps": 30
+    "fps": 30,
+    "buffer_frames": 16,           # 每个会话缓存的帧数（只保存通过差异门限的帧）
+    "signature_shape": (24, 32),   # 比较画面差异用的灰度缩略图大小
+    "diff_threshold": 3.0,         # 与上一保留帧的平均像素差低于该值时丢弃 (0-255)
+    "keyframe_threshold": 12.0,    # 关键帧之间的最小平均像素差
+    "keyframe_window": 5.0,        # 只从最近这么多秒的帧中选关键帧
+    "max_keyframes": 5             # 每次发给模型的最多帧数
+}
+
+# 流式语音合成配置
+STREAM_TTS_CONFIG = {
+    "enabled": True,
+    "min_sentence_len": 5,   # 短于该长度的句子与下一句合并
+    "max_sentence_len": 80,  # 超过该长度时在逗号处强制切分
+    "max_inflight": 2        # 每个回复同时合成的句子数，其余按顺序排队，避免挤满 TTS 服务的队列
+}
+
+# 语音回复配置，回复以内存中的 (采样率, PCM) 传递，磁盘存档仅用于调试
+TTS_AUDIO_CONFIG = {
+    "sample_rate": 22050,       # TTS 服务未返回 X-Sample-Rate 时使用
+    "spool_enabled": False,     # 是否把回复音频另存到磁盘
+    "spool_dir": "temp/audio",
+    "spool_max_files": 200,     # 超出后删除最旧的文件
+    "spool_max_mb": 200,
+    "spool_retention": 3600     # 文件保留时间(秒)
 }
 
 # 会话配置
 SESSION_CONFIG = {
     "max_history": 100,
-    "timeout": 3600  # 1小时
+    "timeout": 3600,  # 1小时
+    "cleanup_interval": 60  # 处理输入时最多每隔该秒数清理一次超时会话
 }
 
 # 系统提示词
@@ -1,5 +1,6 @@
-from typing import Dict, Optional
+from typing import Dict, List, Optional
 import uuid
+import time
 from .state import SessionState, DialogueState
 from src.config.settings import SESSION_CONFIG
 
@@ -23,11 +24,13 @@ class SessionManager:
             return True
         return False
         
-    def cleanup_inactive_sessions(self):
+    def cleanup_inactive_sessions(self) -> List[str]:
+        """删除超时的会话，返回被删除的会话ID"""
         current_time = time.time()
         inactive_sessions = [
             session_id for session_id, session in self.sessions.items()
             if current_time - session.last_activity > SESSION_CONFIG['timeout']
         ]
         for session_id in inactive_sessions:
-            del self.sessions[session_id]
\ No newline at end of file
+            del self.sessions[session_id]
+        return inactive_sessions
\ No newline at end of file
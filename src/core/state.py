@@ -2,6 +2,9 @@ from dataclasses import dataclass, field
 from enum import Enum
 from typing import List, Optional, Dict, Any
 import time
+from src.config.settings import AUDIO_CONFIG, VIDEO_CONFIG
+from src.utils.frame_buffer import FrameRingBuffer
+from src.utils.ring_buffer import PCMRingBuffer
 
 class DialogueState(Enum):
     IDLE = "idle"
@@ -22,8 +25,18 @@ class SessionState:
     messages: List[MessageHistory] = field(default_factory=list)
     current_speaker: Optional[str] = None
     interrupt_flag: bool = False
-    audio_buffer: List[bytes] = field(default_factory=list)
-    video_buffer: List[Dict[str, Any]] = field(default_factory=list)
+    audio_buffer: PCMRingBuffer = field(default_factory=lambda: PCMRingBuffer(
+        int(AUDIO_CONFIG['sample_rate'] * AUDIO_CONFIG['ring_buffer_seconds']),
+        sample_rate=AUDIO_CONFIG['sample_rate']
+    ))
+    asr_stream: Optional[Any] = None  # 会话独立的流式识别上下文 (ASRStream)
+    speech_queue: Optional[Any] = None  # 当前回复正在逐句合成的语音 (SpeechSegmentQueue)
+    video_buffer: FrameRingBuffer = field(default_factory=lambda: FrameRingBuffer(
+        VIDEO_CONFIG['buffer_frames'],
+        VIDEO_CONFIG['frame_height'],
+        VIDEO_CONFIG['frame_width'],
+        signature_shape=VIDEO_CONFIG['signature_shape']
+    ))
     created_at: float = field(default_factory=time.time)
     last_activity: float = field(default_factory=time.time)
     
@@ -1,11 +1,14 @@
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, AsyncIterator, Tuple
 import asyncio
+import time
 from .session import SessionManager
-from .state import DialogueState
+from .state import DialogueState, MessageHistory
 from src.managers.asr_manager import ASRManager
-from src.managers.tts_manager import TTSManager
+from src.managers.tts_manager import TTSManager, SpeechSegmentQueue, AudioClip, concat_clips
 from src.managers.camera_manager import CameraManager
 from src.managers.model_manager import ModelManager
+from src.utils.sentence_splitter import StreamingSentenceSplitter
+from src.config.settings import STREAM_TTS_CONFIG, SESSION_CONFIG
 import numpy as np
 
 class Worker:
@@ -15,63 +18,25 @@ class Worker:
         self.tts_manager = TTSManager()
         self.camera_manager = CameraManager()
         self.model_manager = ModelManager()
+        self.last_cleanup = time.time()
         
-    async def process_input(self, 
-                          session_id: str, 
-                          audio_chunk: Optional[bytes] = None,
-                          video_frame: Optional[np.ndarray] = None,
-                          text_input: Optional[str] = None):
-        """处理用户输入"""
-        session = self.session_manager.get_session(session_id)
-        if not session:
-            return None
-            
-        try:
-            # 处理视频帧
-            if video_frame is not None:
-                processed_frame = await self.camera_manager.process_frame(video_frame)
-                if processed_frame:
-                    session.video_buffer.append(processed_frame)
-                    
-            # 处理音频
-            transcribed_text = None
-            if audio_chunk is not None:
-                transcribed_text = await self.asr_manager.process_audio_chunk(audio_chunk)
-                
-            # 如果有文本输入或语音识别结果
-            input_text = text_input or transcribed_text
-            if input_text:
-                response = await self.model_manager.generate_response(
-                    text=input_text,
-                    video_frames=self.camera_manager.get_recent_frames(),
-                    audio_text=transcribed_text
-                )
-                
-                # 处理模型响应
-                if '[S.SPEAK]' in response:
-                    # 生成语音
-                    audio_path = await self.tts_manager.synthesize_speech(
-                        response.replace('[S.SPEAK]', '').strip(),
-                        session_id
-                    )
-                    if audio_path:
-                        await self.tts_manager.queue_audio(audio_path)
-                        
-                elif '[S.LISTEN]' in response or '[C.LISTEN]' in response:
-                    self.session_manager.update_session_state(
-                        session_id,
-                        DialogueState.LISTENING
-                    )
-                    
-                return {
-                    'text': input_text,
-                    'response': response,
-                    'video_frame': processed_frame if video_frame is not None else None
-                }
-                
-        except Exception as e:
-            print(f"Input processing error: {e}")
-            return None
+    async def start(self):
+        """建立 ASR/TTS 服务的连接池，未调用时在第一次请求时建立"""
+        await self.asr_manager.start()
+        await self.tts_manager.start()
+        
+    async def stop(self):
+        """关闭连接池，释放所有会话的模型缓存"""
+        await self.asr_manager.close()
+        await self.tts_manager.close()
+        for session_id in list(self.session_manager.sessions):
+            self.model_manager.release_session(session_id)
+        
+    def cleanup_inactive_sessions(self):
+        """清理超时会话并释放其模型缓存"""
+        self.last_cleanup = time.time()
+        for session_id in self.session_manager.cleanup_inactive_sessions():
+            self.model_manager.release_session(session_id)
             
     async def handle_interrupt(self, session_id: str):
         """处理打断"""
@@ -80,6 +45,8 @@ class Worker:
             return
             
         session.interrupt_flag = True
+        if session.speech_queue is not None:
+            session.speech_queue.cancel()
         await self.tts_manager.stop_current_audio()
         self.session_manager.update_session_state(
             session_id,
@@ -97,54 +64,171 @@ class Worker:
             session.model_name = model_name
         return success
         
-    async def process_input(self, 
-                          session_id: str, 
-                          audio_chunk: Optional[bytes] = None,
-                          video_frame: Optional[np.ndarray] = None,
-                          text_input: Optional[str] = None,
-                          model_name: Optional[str] = None):
-        """处理输入（更新支持模型选择）"""
+    async def _process_media(self,
+                           session,
+                           audio_chunk: Optional[bytes] = None,
+                           video_frame: Optional[np.ndarray] = None) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+        """处理视频帧和音频块，返回处理后的帧和识别文本"""
+        # 处理视频帧
+        processed_frame = None
+        if video_frame is not None:
+            processed_frame = await self.camera_manager.process_frame(video_frame, session.video_buffer)
+                
+        # 处理音频
+        transcribed_text = None
+        if audio_chunk is not None:
+            if session.asr_stream is None:
+                session.asr_stream = self.asr_manager.create_stream(session.audio_buffer)
+            transcribed_text = await self.asr_manager.process_audio_chunk(audio_chunk, session.asr_stream)
+            
+        return processed_frame, transcribed_text
+        
+    async def _handle_response(self, session_id: str, response: str, spoken: bool = False) -> Optional[AudioClip]:
+        """根据完整响应中的标记执行语音合成或状态切换，返回需要播放的语音"""
+        if '[S.SPEAK]' in response:
+            if spoken:
+                # 已经逐句合成过
+                return None
+            # 生成语音
+            return await self.tts_manager.synthesize_speech(
+                response.replace('[S.SPEAK]', '').strip(),
+                session_id
+            )
+                
+        elif '[S.LISTEN]' in response or '[C.LISTEN]' in response:
+            self.session_manager.update_session_state(
+                session_id,
+                DialogueState.LISTENING
+            )
+        return None
+        
+    async def process_input_stream(self, 
+                                 session_id: str, 
+                                 audio_chunk: Optional[bytes] = None,
+                                 video_frame: Optional[np.ndarray] = None,
+                                 text_input: Optional[str] = None,
+                                 model_name: Optional[str] = None) -> AsyncIterator[Dict[str, Any]]:
+        """流式处理输入，模型每产出一段文本就返回一次累积结果
+
+        结果中的 'audio' 为自上次返回以来新合成的语音 (采样率, PCM)，没有时为 None。
+        """
+        if time.time() - self.last_cleanup > SESSION_CONFIG["cleanup_interval"]:
+            self.cleanup_inactive_sessions()
         session = self.session_manager.get_session(session_id)
         if not session:
-            return None
+            return
+        session.update_activity()
             
         try:
-            # 处理视频帧
-            if video_frame is not None:
-                processed_frame = await self.camera_manager.process_frame(video_frame)
-                if processed_frame:
-                    session.video_buffer.append(processed_frame)
-                    
-            # 处理音频
-            transcribed_text = None
-            if audio_chunk is not None:
-                transcribed_text = await self.asr_manager.process_audio_chunk(audio_chunk)
-                
+            processed_frame, transcribed_text = await self._process_media(
+                session, audio_chunk, video_frame
+            )
+            
             # 如果有文本输入或语音识别结果
             input_text = text_input or transcribed_text
-            if input_text:
-                # 使用指定的模型或会话当前的模型
-                response = await self.model_manager.generate_response(
+            if not input_text:
+                return
+                
+            # 历史对话，模型据此复用上一轮的前缀缓存
+            history = [{"role": message.role, "content": message.content} for message in session.messages]
+            
+            # 使用指定的模型或会话当前的模型
+            response = ""
+            speech_queue = None
+            try:
+                async for delta in self.model_manager.stream_response(
                     text=input_text,
-                    images=self.camera_manager.get_recent_frames(),
-                    model_name=model_name or session.model_name
-                )
+                    images=self.camera_manager.get_recent_frames(session.video_buffer),
+                    model_name=model_name or getattr(session, 'model_name', None),
+                    history=history,
+                    session_id=session_id
+                ):
+                    response += delta
+                    # 检测到 [S.SPEAK] 后边生成边按句合成语音
+                    if STREAM_TTS_CONFIG["enabled"]:
+                        if speech_queue is None and '[S.SPEAK]' in response:
+                            speech_queue = SpeechSegmentQueue(
+                                self.tts_manager,
+                                session_id,
+                                max_inflight=STREAM_TTS_CONFIG["max_inflight"]
+                            )
+                            session.speech_queue = speech_queue
+                            splitter = StreamingSentenceSplitter(
+                                min_len=STREAM_TTS_CONFIG["min_sentence_len"],
+                                max_len=STREAM_TTS_CONFIG["max_sentence_len"]
+                            )
+                            spoken_len = response.index('[S.SPEAK]') + len('[S.SPEAK]')
+                        if speech_queue is not None:
+                            for sentence in splitter.feed(response[spoken_len:]):
+                                speech_queue.submit(sentence.replace('[S.SPEAK]', '').strip())
+                            spoken_len = len(response)
+                    yield {
+                        'text': input_text,
+                        'response': response,
+                        'delta': delta,
+                        'video_frame': processed_frame,
+                        'audio': concat_clips(speech_queue.take_ready()) if speech_queue is not None else None
+                    }
+                    
+                # 合成剩余文本，按顺序返回剩余的语音
+                if speech_queue is not None:
+                    remaining = splitter.flush()
+                    if remaining:
+                        speech_queue.submit(remaining.replace('[S.SPEAK]', '').strip())
+                    async for audio in speech_queue.close():
+                        yield {
+                            'text': input_text,
+                            'response': response,
+                            'delta': '',
+                            'video_frame': processed_frame,
+                            'audio': audio
+                        }
+            except BaseException:
+                if speech_queue is not None:
+                    speech_queue.cancel()
+                raise
+            finally:
+                if session.speech_queue is speech_queue:
+                    session.speech_queue = None
                 
-                # 处理模型响应
-                if '[S.SPEAK]' in response:
-                    audio_path = await self.tts_manager.synthesize_speech(
-                        response.replace('[S.SPEAK]', '').strip(),
-                        session_id
-                    )
-                    if audio_path:
-                        await self.tts_manager.queue_audio(audio_path)
-                        
-                return {
+            # 记录本轮对话
+            session.messages.append(MessageHistory(role="user", content=input_text))
+            session.messages.append(MessageHistory(role="assistant", content=response))
+            del session.messages[:-SESSION_CONFIG["max_history"]]
+            
+            # 处理模型响应
+            audio = await self._handle_response(session_id, response, spoken=speech_queue is not None)
+            if audio is not None:
+                yield {
                     'text': input_text,
                     'response': response,
-                    'video_frame': processed_frame if video_frame is not None else None
+                    'delta': '',
+                    'video_frame': processed_frame,
+                    'audio': audio
                 }
-                
+            
         except Exception as e:
             print(f"Input processing error: {e}")
-            return None
\ No newline at end of file
+            
+    async def process_input(self, 
+                          session_id: str, 
+                          audio_chunk: Optional[bytes] = None,
+                          video_frame: Optional[np.ndarray] = None,
+                          text_input: Optional[str] = None,
+                          model_name: Optional[str] = None):
+        """处理输入（支持模型选择），返回完整响应，'audio' 为本轮合成的全部语音"""
+        result = None
+        clips = []
+        async for result in self.process_input_stream(
+            session_id,
+            audio_chunk=audio_chunk,
+            video_frame=video_frame,
+            text_input=text_input,
+            model_name=model_name
+        ):
+            if result['audio'] is not None:
+                clips.append(result['audio'])
+        if result is not None:
+            result.pop('delta', None)
+            result['audio'] = concat_clips(clips)
+        return result
@@ -1,12 +1,23 @@
 import gradio as gr
 import asyncio
+from contextlib import asynccontextmanager
 from src.core.worker import Worker
+from src.core.state import DialogueState
 from src.config.settings import SESSION_CONFIG
 
 class Interface:
     def __init__(self):
         self.worker = Worker()
         
+    @asynccontextmanager
+    async def lifespan(self, app):
+        """服务启动时建立 ASR/TTS 连接池，关闭时释放"""
+        await self.worker.start()
+        try:
+            yield
+        finally:
+            await self.worker.stop()
+            
     def create_interface(self):
         with gr.Blocks(css=self.load_css()) as demo:
             session_id = gr.State(lambda: self.worker.session_manager.create_session())
@@ -49,6 +60,8 @@ class Interface:
                 )
                 audio_output = gr.Audio(
                     label="Assistant's Response",
+                    streaming=True,
+                    autoplay=True,
                     elem_id="audio-output"
                 )
                 
@@ -67,16 +80,15 @@ class Interface:
             
             # 处理音频流
             audio_input.stream(
-                fn=self.worker.process_input,
-                inputs=[session_id, audio_input],
+                fn=self.handle_audio,
+                inputs=[session_id, audio_input, chatbot],
                 outputs=[chatbot, audio_output]
             )
             
             # 处理视频流
             camera_feed.stream(
-                fn=self.worker.process_input,
-                inputs=[session_id, None, camera_feed],
-                outputs=[chatbot]
+                fn=self.handle_video,
+                inputs=[session_id, camera_feed]
             )
             
         return demo
@@ -85,6 +97,22 @@ class Interface:
         with open('src/interface/static/css/style.css', 'r') as f:
             return f.read()
             
+    async def handle_audio(self, session_id, audio_chunk, history):
+        """处理麦克风音频，逐步更新对话内容并播放新合成的语音"""
+        history = history or []
+        turn = None
+        async for result in self.worker.process_input_stream(session_id, audio_chunk=audio_chunk):
+            if turn is None:
+                turn = [result['text'], ""]
+                history.append(turn)
+            turn[1] = result['response']
+            audio = result['audio']
+            yield history, audio if audio is not None else gr.update()
+            
+    async def handle_video(self, session_id, frame):
+        """将摄像头画面写入会话的帧缓冲区"""
+        await self.worker.process_input(session_id, video_frame=frame)
+        
     async def start_session(self, session_id):
         """开始会话"""
         if not session_id:
@@ -22,7 +22,8 @@ def main():
     demo.launch(
         server_name=args.host,
         server_port=args.port,
-        share=args.share
+        share=args.share,
+        app_kwargs={"lifespan": interface.lifespan}
     )
 
 if __name__ == "__main__":
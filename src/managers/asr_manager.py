@@ -1,48 +1,88 @@
 import asyncio
 import aiohttp
-from typing import Optional
+import json
+from typing import Optional, Tuple, Union
 import numpy as np
-from src.config.settings import ASR_API_URL, AUDIO_CONFIG
+from src.config.settings import ASR_API_URL, AUDIO_CONFIG, HTTP_CLIENT_CONFIG
+from src.utils.http_client import PooledHTTPClient
+from src.utils.ring_buffer import PCMRingBuffer
+from src.utils.vad import VoiceActivityDetector
 
+class ASRStream:
+    """单个会话的流式识别上下文，按语音端点切分出完整的句子"""
+    def __init__(self, sample_rate: int, max_seconds: float, buffer: Optional[PCMRingBuffer] = None):
+        vad_config = AUDIO_CONFIG['vad']
+        self.vad = VoiceActivityDetector(
+            sample_rate=sample_rate,
+            frame_ms=vad_config['frame_ms'],
+            threshold_db=vad_config['threshold_db'],
+            noise_margin_db=vad_config['noise_margin_db'],
+            noise_window_seconds=vad_config['noise_window_seconds'],
+            start_ms=vad_config['start_ms'],
+            end_silence_ms=vad_config['end_silence_ms'],
+            pre_roll_ms=vad_config['pre_roll_ms'],
+            min_speech_ms=vad_config['min_speech_ms'],
+            max_utterance_seconds=max_seconds,
+            buffer=buffer
+        )
+        # 同一会话的检测和识别按顺序执行（片段是缓冲区的视图），不同会话之间并行
+        self.lock = asyncio.Lock()
+        
 class ASRManager:
     def __init__(self, api_url: str = ASR_API_URL):
         self.api_url = api_url
-        self.audio_buffer = []
         self.sample_rate = AUDIO_CONFIG['sample_rate']
+        self.http_client = PooledHTTPClient(total_timeout=HTTP_CLIENT_CONFIG['asr_timeout'])
+        
+    async def start(self):
+        await self.http_client.start()
+        
+    async def close(self):
+        await self.http_client.close()
         
-    async def process_audio_chunk(self, audio_chunk: np.ndarray) -> Optional[str]:
-        """处理音频块并返回识别文本"""
-        self.audio_buffer.append(audio_chunk)
+    def create_stream(self, buffer: Optional[PCMRingBuffer] = None) -> ASRStream:
+        """为一个会话创建识别上下文，buffer 为会话的音频缓冲区"""
+        return ASRStream(self.sample_rate, AUDIO_CONFIG['max_buffer_seconds'], buffer)
         
-        # 累积约1秒的音频
-        if len(self.audio_buffer) * len(audio_chunk) / self.sample_rate >= 1.0:
-            return await self.transcribe_audio()
-        return None
+    async def process_audio_chunk(self,
+                                  audio_chunk: Union[np.ndarray, Tuple[int, np.ndarray]],
+                                  stream: ASRStream) -> Optional[str]:
+        """将音频块送入会话的端点检测，一句话结束时返回识别文本，静音不会发送到ASR服务
+
+        audio_chunk 可以是 (采样率, 音频) 元组，采样率不同时在写入缓冲区时重采样。
+        """
+        sample_rate = None
+        if isinstance(audio_chunk, tuple):
+            sample_rate, audio_chunk = audio_chunk
+            
+        texts = []
+        async with stream.lock:
+            for audio_data in stream.vad.feed(audio_chunk, sample_rate):
+                text = await self.transcribe_audio(audio_data)
+                if text:
+                    texts.append(text)
+        return ' '.join(texts) or None
         
-    async def transcribe_audio(self) -> Optional[str]:
+    async def transcribe_audio(self, audio_data: Optional[np.ndarray]) -> Optional[str]:
         """调用ASR API"""
-        if not self.audio_buffer:
+        if audio_data is None or len(audio_data) == 0:
             return None
             
         try:
-            # 准备音频数据
-            audio_data = np.concatenate(self.audio_buffer)
-            files = {
-                'files': ('audio.wav', audio_data.tobytes(), 'audio/wav')
-            }
-            data = {
-                'keys': 'audio1',
-                'lang': 'auto'
-            }
+            def build_form():
+                form = aiohttp.FormData()
+                # 直接发送缓冲区的视图，不复制
+                form.add_field('files', memoryview(audio_data), filename='audio.wav', content_type='audio/wav')
+                form.add_field('keys', 'audio1')
+                form.add_field('lang', 'auto')
+                return form
             
-            async with aiohttp.ClientSession() as session:
-                async with session.post(self.api_url, data=data, files=files) as response:
-                    if response.status == 200:
-                        result = await response.json()
-                        return result['result'][0]['text']
-                        
+            status, content, _ = await self.http_client.post(self.api_url, data=build_form)
+            if status == 200:
+                result = json.loads(content)
+                return result['result'][0]['text']
+            print(f"ASR Error: HTTP {status}")
+                
         except Exception as e:
             print(f"ASR Error: {e}")
             return None
-        finally:
-            self.audio_buffer = []  # 清空缓存
\ No newline at end of file
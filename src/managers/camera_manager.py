@@ -1,50 +1,81 @@
 import numpy as np
 import cv2
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, List
 import time
 from src.config.settings import VIDEO_CONFIG
+from src.utils.frame_buffer import FrameRingBuffer
 
 class CameraManager:
     def __init__(self):
-        self.frame_buffer = []
         self.is_streaming = False
         self.config = VIDEO_CONFIG
-        
-    async def process_frame(self, frame_data: np.ndarray) -> Optional[Dict[str, Any]]:
-        """处理摄像头帧"""
+        self.accepted_frames = 0
+        self.dropped_frames = 0
+
+    def _signature(self, frame_data: np.ndarray) -> np.ndarray:
+        """按步长采样得到灰度缩略图，用于比较画面差异，不需要先缩放整帧"""
+        sig_h, sig_w = self.config['signature_shape']
+        step_y = max(1, frame_data.shape[0] // sig_h)
+        step_x = max(1, frame_data.shape[1] // sig_w)
+        thumb = frame_data[::step_y, ::step_x][:sig_h, :sig_w].astype(np.float32)
+        if thumb.ndim == 3:
+            thumb = thumb[..., :3].mean(axis=2)
+        signature = np.zeros((sig_h, sig_w), dtype=np.float32)
+        signature[:thumb.shape[0], :thumb.shape[1]] = thumb
+        return signature
+
+    async def process_frame(self, frame_data: np.ndarray, buffer: FrameRingBuffer) -> Optional[Dict[str, Any]]:
+        """处理摄像头帧，与上一保留帧几乎相同的帧直接丢弃"""
         if frame_data is None:
             return None
-            
+
         try:
-            # 确保图像格式正确
+            # 差异门限：先比较缩略图，重复画面不做颜色转换和缩放
+            signature = self._signature(frame_data)
+            last_signature = buffer.latest_signature()
+            if last_signature is not None and \
+                    np.mean(np.abs(signature - last_signature)) < self.config['diff_threshold']:
+                self.dropped_frames += 1
+                return None
+
+            # 调整大小并转换为RGB，结果直接写入缓冲区
+            size = (self.config['frame_width'], self.config['frame_height'])
+            slot = buffer.slot()
             if len(frame_data.shape) == 2:
-                frame_data = cv2.cvtColor(frame_data, cv2.COLOR_GRAY2RGB)
+                cv2.cvtColor(cv2.resize(frame_data, size), cv2.COLOR_GRAY2RGB, dst=slot)
             elif len(frame_data.shape) == 3 and frame_data.shape[2] == 4:
-                frame_data = cv2.cvtColor(frame_data, cv2.COLOR_RGBA2RGB)
-                
-            # 调整大小
-            frame_data = cv2.resize(
-                frame_data,
-                (self.config['frame_width'], self.config['frame_height'])
-            )
-            
-            processed_frame = {
-                'frame': frame_data,
-                'timestamp': time.time()
+                cv2.cvtColor(cv2.resize(frame_data, size), cv2.COLOR_RGBA2RGB, dst=slot)
+            else:
+                cv2.resize(frame_data, size, dst=slot)
+
+            timestamp = time.time()
+            buffer.commit(timestamp, signature)
+            self.accepted_frames += 1
+
+            # 槽位之后会被新帧覆盖，返回副本
+            return {
+                'frame': slot.copy(),
+                'timestamp': timestamp
             }
-            
-            self.frame_buffer.append(processed_frame)
-            
-            # 保持固定大小的缓冲区
-            if len(self.frame_buffer) > 30:  # 保持1秒的帧数据
-                self.frame_buffer.pop(0)
-                
-            return processed_frame
-            
+
         except Exception as e:
             print(f"Frame processing error: {e}")
             return None
-            
-    def get_recent_frames(self, num_frames: int = 5) -> list:
-        """获取最近的几帧"""
-        return self.frame_buffer[-num_frames:] if self.frame_buffer else []
\ No newline at end of file
+
+    def get_recent_frames(self, buffer: FrameRingBuffer, num_frames: Optional[int] = None) -> List[np.ndarray]:
+        """选出最近一段时间内画面差异明显的关键帧，按时间顺序返回
+
+        从最新一帧开始，只保留与已选帧差异都超过 keyframe_threshold 的帧。
+        """
+        num_frames = num_frames or self.config['max_keyframes']
+        selected = []
+        for index in buffer.recent_indices(self.config['keyframe_window'], time.time()):
+            signature = buffer.signatures[index]
+            if all(np.mean(np.abs(signature - buffer.signatures[other])) >= self.config['keyframe_threshold']
+                   for other in selected):
+                selected.append(index)
+                if len(selected) >= num_frames:
+                    break
+
+        # 复制出来，缓冲区的槽位会被后续帧覆盖
+        return [buffer.frames[index].copy() for index in reversed(selected)]
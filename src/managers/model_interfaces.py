@@ -1,12 +1,26 @@
 from abc import ABC, abstractmethod 
-from typing import Dict, Any, Optional, List
+from typing import Dict, Any, Optional, List, AsyncIterator
 import asyncio
+import copy
 import torch
 import numpy as np
-from transformers import AutoProcessor, Qwen2VLForConditionalGeneration, TextIteratorStreamer
-from threading import Thread
+from transformers import (
+    AutoProcessor,
+    DynamicCache,
+    Qwen2VLForConditionalGeneration,
+    TextIteratorStreamer,
+    StoppingCriteria,
+    StoppingCriteriaList
+)
+from threading import Thread, Event, Lock
+from collections import deque
+from queue import Empty
 from src.utils.performance import measure_performance
 from src.utils.cache import ResponseCache
+from src.utils.vision_budget import PIXELS_PER_TOKEN, fit_vision_budget
+from src.utils.vision_cache import VisionEmbeddingCache, CachedVisionEncoder, frame_hash
+from src.utils.prefix_cache import SessionPrefixCache
+from src.config.settings import SYSTEM_PROMPTS
 
 class BaseModelInterface(ABC):
     @abstractmethod
@@ -19,6 +33,25 @@ class BaseModelInterface(ABC):
     @abstractmethod
     async def process_response(self, response: Any) -> str:
         pass
+        
+    async def stream_response(self, 
+                            text: str, 
+                            images: Optional[List[np.ndarray]] = None,
+                            **kwargs) -> AsyncIterator[str]:
+        """流式生成响应，默认一次性产出完整结果"""
+        yield await self.generate_response(text=text, images=images, **kwargs)
+        
+    def release_session(self, session_id: str):
+        """会话结束时释放与其相关的资源"""
+        pass
+
+class EventStoppingCriteria(StoppingCriteria):
+    """当事件被设置时停止生成，用于取消后台生成线程"""
+    def __init__(self, stop_event: Event):
+        self.stop_event = stop_event
+        
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor, **kwargs) -> bool:
+        return self.stop_event.is_set()
 
 class OpenAIInterface(BaseModelInterface):
     def __init__(self, config: Dict[str, Any]):
@@ -40,9 +73,12 @@ class OpenAIInterface(BaseModelInterface):
     async def generate_response(self, 
                               text: str, 
                               images: Optional[List[np.ndarray]] = None,
+                              history: Optional[List[Dict[str, str]]] = None,
+                              session_id: Optional[str] = None,
                               **kwargs) -> str:
         try:
             messages = [{"role": "system", "content": "You are a helpful assistant."}]
+            messages.extend(history or [])
             content = []
             
             if text:
@@ -109,7 +145,46 @@ class QwenInterface(BaseModelInterface):
         self.processor = AutoProcessor.from_pretrained(config["checkpoint_path"])
         self.tokenizer = self.processor.tokenizer
         self.config = config
+        
+        # 视觉 token 预算，图像处理器的像素范围与之保持一致，避免再次缩放
+        self.vision_token_budget = config.get("vision_token_budget", 1024)
+        self.min_image_tokens = config.get("min_image_tokens", 64)
+        self.max_image_tokens = config.get("max_image_tokens", 384)
+        image_processor = self.processor.image_processor
+        image_processor.min_pixels = self.min_image_tokens * PIXELS_PER_TOKEN
+        image_processor.max_pixels = self.max_image_tokens * PIXELS_PER_TOKEN
+        if isinstance(getattr(image_processor, "size", None), dict):
+            image_processor.size = {
+                "shortest_edge": image_processor.min_pixels,
+                "longest_edge": image_processor.max_pixels
+            }
+        self.image_token_id = getattr(
+            self.model.config,
+            "image_token_id",
+            self.tokenizer.convert_tokens_to_ids("<|image_pad|>")
+        )
+        self.prefill_stats = deque(maxlen=1000)
         self.response_cache = ResponseCache()
+        self.system_prompt = config.get("system_prompt", SYSTEM_PROMPTS["default"].strip())
+        
+        # 按会话复用上一轮的 KV cache，所有会话共享显存预算
+        self.prefix_cache = None
+        if config.get("prefix_cache_mb", 4096) > 0:
+            self.prefix_cache = SessionPrefixCache(int(config.get("prefix_cache_mb", 4096) * 1024**2))
+        # 没有会话缓存时带上的历史条数，见 _history_window
+        self.max_prefill_history = config.get("max_prefill_history", 10)
+        # 模型在自身属性 rope_deltas 上记录 M-RoPE 偏移，并发的 generate 会互相覆盖，因此整个进程内的生成
+        # （连同取出、裁剪、复制前缀缓存）串行执行。单卡上并发 generate 本就相互争抢算力，串行只增加排队
+        # 等待，不降低总吞吐；需要多会话并行时应部署多个实例
+        self.generate_lock = Lock()
+        
+        # 视觉编码缓存：连续几轮重复发送的帧不再经过 ViT
+        self.vision_cache = None
+        if config.get("vision_cache_mb", 256) > 0:
+            self.vision_cache = VisionEmbeddingCache(int(config.get("vision_cache_mb", 256) * 1024**2))
+            # 新版 transformers 中视觉编码器在 model.model 下
+            owner = self.model.model if hasattr(self.model.model, "visual") else self.model
+            owner.visual = CachedVisionEncoder(owner.visual, self.vision_cache)
         
         # 设置模型为评估模式
         self.model.eval()
@@ -117,28 +192,91 @@ class QwenInterface(BaseModelInterface):
         # 启用梯度检查点以节省显存
         if config.get("use_gradient_checkpointing", True):
             self.model.gradient_checkpointing_enable()
+            
+        # 系统提示词的 KV cache 在加载时计算一次，所有会话共享（只读，使用时复制）
+        self.system_prefix = None
+        self.system_prefix_hits = 0
+        if config.get("share_system_prefix", True):
+            self.system_prefix = self._build_system_prefix(self.system_prompt)
+                
+    @torch.no_grad()
+    def _build_system_prefix(self, prompt: str):
+        """预先 prefill 系统提示词，返回其 token 和 KV cache"""
+        prefix_text = self.processor.apply_chat_template(
+            [{"role": "system", "content": prompt}],
+            tokenize=False,
+            add_generation_prompt=False
+        )
+        input_ids = self.tokenizer(prefix_text, return_tensors="pt").input_ids.to(self.model.device)
+        past_key_values = DynamicCache()
+        self.model(input_ids=input_ids, past_key_values=past_key_values, use_cache=True)
+        return input_ids[0].cpu(), past_key_values
+        
+    def _copy_system_prefix(self, input_ids: torch.Tensor) -> Optional[DynamicCache]:
+        """input_ids 以系统提示词开头时，返回其 KV cache 的副本"""
+        if self.system_prefix is None:
+            return None
+        prefix_ids, past_key_values = self.system_prefix
+        n = len(prefix_ids)
+        if n < len(input_ids) and torch.equal(input_ids[:n].cpu(), prefix_ids):
+            self.system_prefix_hits += 1
+            return copy.deepcopy(past_key_values)
+        return None
+
+    def _history_window(self,
+                        session_id: Optional[str],
+                        history: List[Dict[str, str]]) -> List[Dict[str, str]]:
+        """选择本轮带上的历史对话
 
-    def _prepare_inputs(self, text: str, images: Optional[List[np.ndarray]] = None):
-        """准备模型输入"""
+        会话有前缀缓存时从上一轮窗口的第一条消息（随缓存项保存）开始，与缓存的 token 一致，只需 prefill
+        新增部分；没有缓存时只带最近 max_prefill_history 条，避免一次 prefill 整段历史。
+        """
+        head = None
+        if session_id and self.prefix_cache is not None:
+            head = self.prefix_cache.metadata(session_id)
+        if head is not None:
+            for i in range(len(history) - 1, -1, -1):
+                if history[i] == head:
+                    return history[i:]
+        if self.max_prefill_history <= 0:
+            return []
+        return history[-self.max_prefill_history:]
+
+    def _prepare_inputs(self,
+                        text: str,
+                        images: Optional[List[np.ndarray]] = None,
+                        history: Optional[List[Dict[str, str]]] = None):
+        """准备模型输入：系统提示词 + 历史对话（纯文本） + 本轮输入"""
         try:
             # 处理文本模版
             if not text.strip():
                 text = "请描述这张图片。"
                 
-            chat_text = self.processor.tokenizer.apply_chat_template(
-                [{"role": "user", "content": text}],
+            # 处理视觉信息：按预算选择帧数和分辨率
+            image_inputs = None
+            if images:
+                image_inputs = fit_vision_budget(
+                    [image for image in images if image is not None],
+                    self.vision_token_budget,
+                    self.min_image_tokens,
+                    self.max_image_tokens
+                ) or None
+                
+            # 每张图像在文本中需要对应的视觉占位符
+            content = [{"type": "image"} for _ in image_inputs or []]
+            content.append({"type": "text", "text": text})
+            messages = [{"role": "system", "content": self.system_prompt}]
+            messages.extend(
+                {"role": message["role"], "content": [{"type": "text", "text": message["content"]}]}
+                for message in history or []
+            )
+            messages.append({"role": "user", "content": content})
+            chat_text = self.processor.apply_chat_template(
+                messages,
                 tokenize=False,
                 add_generation_prompt=True
             )
             
-            # 处理视觉信息
-            image_inputs = None
-            if images:
-                image_inputs = []
-                for image in images:
-                    if image is not None:
-                        image_inputs.append(image)
-            
             # 生成模型输入
             inputs = self.processor(
                 text=[chat_text],
@@ -146,9 +284,12 @@ class QwenInterface(BaseModelInterface):
                 return_tensors="pt",
                 padding=True
             )
+            self._record_prefill(inputs["input_ids"], image_inputs)
             
             # 移动到正确的设备
             inputs = {k: v.to(self.model.device) for k, v in inputs.items()}
+            if image_inputs and self.vision_cache is not None:
+                inputs["image_keys"] = [frame_hash(image) for image in image_inputs]
             
             return inputs
             
@@ -156,30 +297,86 @@ class QwenInterface(BaseModelInterface):
             print(f"Input preparation error: {e}")
             raise
 
+    def _record_prefill(self, input_ids: torch.Tensor, images: Optional[List[np.ndarray]]):
+        """记录一次请求中视觉和文本各占的 prefill token 数"""
+        vision_tokens = int((input_ids == self.image_token_id).sum())
+        stats = {
+            "vision_tokens": vision_tokens,
+            "text_tokens": int(input_ids.numel()) - vision_tokens,
+            "images": len(images) if images else 0,
+            "image_size": images[0].shape[:2] if images else None
+        }
+        self.prefill_stats.append(stats)
+        if self.config.get("report_prefill", False):
+            size = f" @ {stats['image_size'][1]}x{stats['image_size'][0]}" if images else ""
+            print(f"Prefill tokens: vision {stats['vision_tokens']} ({stats['images']} images{size}), "
+                  f"text {stats['text_tokens']}")
+            
+    def prefill_report(self) -> Dict[str, Any]:
+        """最近请求的 prefill token 统计"""
+        if not self.prefill_stats:
+            return {"requests": 0}
+        vision = [s["vision_tokens"] for s in self.prefill_stats]
+        text = [s["text_tokens"] for s in self.prefill_stats]
+        return {
+            "requests": len(self.prefill_stats),
+            "mean_vision_tokens": float(np.mean(vision)),
+            "mean_text_tokens": float(np.mean(text)),
+            "vision_ratio": sum(vision) / max(1, sum(vision) + sum(text))
+        }
+        
+    def _generation_kwargs(self) -> Dict[str, Any]:
+        """构建生成参数"""
+        return {
+            "max_new_tokens": self.config.get("max_new_tokens", 512),
+            "temperature": self.config.get("temperature", 0.7),
+            "top_p": self.config.get("top_p", 0.8),
+            "repetition_penalty": self.config.get("repetition_penalty", 1.1),
+            "do_sample": True,
+            "pad_token_id": self.tokenizer.pad_token_id,
+            "eos_token_id": self.tokenizer.eos_token_id,
+        }
+
     @measure_performance(name="qwen_generation")
     async def generate_response(self, 
                               text: str, 
                               images: Optional[List[np.ndarray]] = None,
                               **kwargs) -> str:
-        # 检查缓存
-        cached_response = self.response_cache.get(text, images)
-        if cached_response:
-            return cached_response
+        # 收集流式输出的全部文本
+        generated_text = ""
+        async for new_text in self.stream_response(text, images, **kwargs):
+            generated_text += new_text
+        return generated_text
+        
+    async def stream_response(self, 
+                            text: str, 
+                            images: Optional[List[np.ndarray]] = None,
+                            history: Optional[List[Dict[str, str]]] = None,
+                            session_id: Optional[str] = None,
+                            **kwargs) -> AsyncIterator[str]:
+        """流式生成响应，文本增量一旦产生即返回，不阻塞事件循环"""
+        # 检查缓存（有历史对话时回复依赖上下文，不使用）
+        if not history:
+            cached_response = self.response_cache.get(text, images)
+            if cached_response:
+                yield cached_response
+                return
+            
+        history = self._history_window(session_id, history or [])
             
+        stop_event = Event()
+        generated_text = ""
         try:
-            # 准备输入
-            inputs = self._prepare_inputs(text, images)
+            # 准备输入（图像预处理较慢，放到线程池中执行）
+            inputs = await asyncio.to_thread(self._prepare_inputs, text, images, history)
             
             # 设置生成参数
-            generation_kwargs = {
-                "max_new_tokens": self.config.get("max_new_tokens", 512),
-                "temperature": self.config.get("temperature", 0.7),
-                "top_p": self.config.get("top_p", 0.8),
-                "repetition_penalty": self.config.get("repetition_penalty", 1.1),
-                "do_sample": True,
-                "pad_token_id": self.tokenizer.pad_token_id,
-                "eos_token_id": self.tokenizer.eos_token_id,
-            }
+            generation_kwargs = self._generation_kwargs()
+            
+            # 前缀缓存在生成线程中取出，见 _acquire_prefix
+            if session_id and self.prefix_cache is not None:
+                generation_kwargs["session_id"] = session_id
+                generation_kwargs["history_head"] = history[0] if history else None
             
             # 设置流式输出
             streamer = TextIteratorStreamer(
@@ -189,24 +386,43 @@ class QwenInterface(BaseModelInterface):
                 skip_special_tokens=True
             )
             generation_kwargs["streamer"] = streamer
+            # 调用方停止消费时终止后台生成
+            generation_kwargs["stopping_criteria"] = StoppingCriteriaList([EventStoppingCriteria(stop_event)])
             
             # 在后台线程中运行生成
-            thread = Thread(target=self.model.generate, kwargs={**inputs, **generation_kwargs})
+            thread = Thread(
+                target=self._generate_with_streaming,
+                kwargs={**inputs, **generation_kwargs},
+                daemon=True
+            )
             thread.start()
             
-            # 收集生成的文本
-            generated_text = ""
-            for new_text in streamer:
-                generated_text += new_text
-                
+            # 在线程池中等待下一个文本片段，避免阻塞其他会话
+            text_iterator = iter(streamer)
+            while True:
+                try:
+                    new_text = await asyncio.to_thread(next, text_iterator, None)
+                except Empty:
+                    # 还在排队等待其他会话的生成结束
+                    if thread.is_alive():
+                        continue
+                    raise
+                if new_text is None:
+                    break
+                if new_text:
+                    generated_text += new_text
+                    yield new_text
+                    
             # 缓存响应
-            self.response_cache.set(text, images, generated_text)
-            
-            return generated_text
+            if not history:
+                self.response_cache.set(text, images, generated_text)
             
         except Exception as e:
             print(f"Qwen model error: {e}")
-            return "[S.SPEAK] 抱歉，处理过程中出现错误。"
+            if not generated_text:
+                yield "[S.SPEAK] 抱歉，处理过程中出现错误。"
+        finally:
+            stop_event.set()
             
     async def process_response(self, response: str) -> str:
         """处理模型响应"""
@@ -225,13 +441,115 @@ class QwenInterface(BaseModelInterface):
             return "[S.SPEAK] 抱歉，响应处理出错。"
             
     @torch.no_grad()
-    def _generate_with_streaming(self, **kwargs):
-        """使用无梯度上下文的生成函数"""
+    def _generate_with_streaming(self,
+                                 image_keys: Optional[List[str]] = None,
+                                 session_id: Optional[str] = None,
+                                 history_head: Optional[Dict[str, str]] = None,
+                                 **kwargs):
+        """使用无梯度上下文的生成函数
+
+        image_keys 用于查找视觉编码缓存；session_id 不为空时生成结束后把 KV cache 连同本轮历史窗口的
+        第一条消息 history_head 放回会话前缀缓存。
+        """
+        with self.generate_lock:
+            past_key_values = self._acquire_prefix(session_id, kwargs["input_ids"][0])
+            kwargs["past_key_values"] = past_key_values
+            if self.vision_cache is None:
+                outputs = self._generate_from_cache(**kwargs)
+            else:
+                with self.vision_cache.use_keys(image_keys):
+                    outputs = self._generate_from_cache(**kwargs)
+                    
+            if session_id and self.prefix_cache is not None:
+                self.prefix_cache.release(session_id, outputs[0], past_key_values, history_head)
+        return outputs
+        
+    def _acquire_prefix(self, session_id: Optional[str], input_ids: torch.Tensor) -> DynamicCache:
+        """复用会话上一轮的 KV cache，没有时从共享的系统提示词前缀开始，只需 prefill 新增的 token
+
+        裁剪和复制缓存涉及 GPU 同步，在生成线程中执行，不阻塞事件循环。本轮带图像时缓存之后的部分
+        在 _generate_from_cache 中 prefill。
+        """
+        past_key_values = None
+        if session_id and self.prefix_cache is not None:
+            past_key_values = self.prefix_cache.acquire(session_id, input_ids)
+        if past_key_values is None:
+            past_key_values = self._copy_system_prefix(input_ids)
+        return past_key_values or DynamicCache()
+        
+    def _generate_from_cache(self, **kwargs):
+        """从 past_key_values 之后继续生成，调用方需持有 generate_lock
+
+        复用的前缀只含文本（历史对话不带图像），M-RoPE 位置与 token 序号一致，偏移为 0。
+        generate 在缓存非空时会丢掉 pixel_values，本轮带图像时先手动 prefill 缓存之后的部分。
+        """
+        past_key_values = kwargs.get("past_key_values")
+        if past_key_values is None or past_key_values.get_seq_length() == 0:
+            return self.model.generate(**kwargs)
+            
+        owner = self.model.model if hasattr(self.model.model, "rope_deltas") else self.model
+        if "pixel_values" in kwargs:
+            owner.rope_deltas = self._prefill_images(owner, kwargs)
+        else:
+            owner.rope_deltas = torch.zeros(1, 1, dtype=torch.long, device=kwargs["input_ids"].device)
         return self.model.generate(**kwargs)
         
+    def _prefill_images(self, owner: torch.nn.Module, kwargs: Dict[str, Any]) -> torch.Tensor:
+        """prefill 缓存之后到倒数第二个 token 的部分（含本轮图像），返回本轮的 rope_deltas
+
+        M-RoPE 位置按完整输入计算后取这一段，图像相关参数从 kwargs 中移除，最后一个 token 留给 generate。
+        """
+        input_ids = kwargs["input_ids"]
+        attention_mask = kwargs.get("attention_mask")
+        past_key_values = kwargs["past_key_values"]
+        pixel_values = kwargs.pop("pixel_values")
+        rope_kwargs = {
+            key: kwargs.pop(key) for key in ("image_grid_thw", "mm_token_type_ids") if key in kwargs
+        }
+        position_ids, rope_deltas = owner.get_rope_index(
+            input_ids,
+            attention_mask=attention_mask,
+            **rope_kwargs
+        )
+        
+        start = past_key_values.get_seq_length()
+        end = input_ids.shape[1] - 1
+        self.model(
+            input_ids=input_ids[:, start:end],
+            attention_mask=attention_mask[:, :end] if attention_mask is not None else None,
+            position_ids=position_ids[..., start:end],
+            past_key_values=past_key_values,
+            cache_position=torch.arange(start, end, device=input_ids.device),
+            pixel_values=pixel_values,
+            image_grid_thw=rope_kwargs["image_grid_thw"],
+            use_cache=True
+        )
+        return rope_deltas
+        
+    def release_session(self, session_id: str):
+        """释放会话的 KV cache"""
+        if self.prefix_cache is not None:
+            self.prefix_cache.drop(session_id)
+            
+    def prefix_cache_stats(self) -> Dict[str, Any]:
+        """会话前缀 KV cache 的复用率和显存占用，以及共享系统提示词前缀的使用次数"""
+        if self.prefix_cache is None:
+            return {"enabled": False, "system_prefix_hits": self.system_prefix_hits}
+        return {"enabled": True, "system_prefix_hits": self.system_prefix_hits, **self.prefix_cache.stats()}
+        
     def clear_cache(self):
-        """清除响应缓存"""
+        """清除响应缓存、视觉编码缓存和会话前缀缓存"""
         self.response_cache = ResponseCache()
+        if self.vision_cache is not None:
+            self.vision_cache.clear()
+        if self.prefix_cache is not None:
+            self.prefix_cache.clear()
+            
+    def vision_cache_stats(self) -> Dict[str, Any]:
+        """视觉编码缓存的命中率等统计"""
+        if self.vision_cache is None:
+            return {"enabled": False}
+        return {"enabled": True, **self.vision_cache.stats()}
         
     async def preload(self):
         """预热模型"""
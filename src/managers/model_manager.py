@@ -1,4 +1,4 @@
-from typing import Dict, Optional, List, Any
+from typing import Dict, Optional, List, Any, AsyncIterator
 import asyncio
 import numpy as np
 from .model_interfaces import (
@@ -29,24 +29,63 @@ class ModelManager:
             return True
         return False
         
+    def release_session(self, session_id: str):
+        """会话结束时通知各模型接口释放资源"""
+        for interface in self.interfaces.values():
+            interface.release_session(session_id)
+            
+    def _get_interface(self, model_name: Optional[str] = None) -> BaseModelInterface:
+        """获取模型接口，未找到时回退到默认模型"""
+        return self.interfaces.get(
+            model_name or self.current_model,
+            self.interfaces[MODEL_CONFIG["default_model"]]
+        )
+        
     async def generate_response(self,
                               text: str,
                               images: Optional[List[np.ndarray]] = None,
                               model_name: Optional[str] = None,
+                              history: Optional[List[Dict[str, str]]] = None,
+                              session_id: Optional[str] = None,
                               **kwargs) -> str:
         """生成响应"""
-        model_interface = self.interfaces.get(
-            model_name or self.current_model,
-            self.interfaces[MODEL_CONFIG["default_model"]]
-        )
+        model_interface = self._get_interface(model_name)
         
         try:
             response = await model_interface.generate_response(
                 text=text,
                 images=images,
+                history=history,
+                session_id=session_id,
                 **kwargs
             )
             return response
         except Exception as e:
             print(f"Model generation error: {e}")
-            return "[S.SPEAK] 抱歉，模型处理过程中出现错误。"
\ No newline at end of file
+            return "[S.SPEAK] 抱歉，模型处理过程中出现错误。"
+            
+    async def stream_response(self,
+                            text: str,
+                            images: Optional[List[np.ndarray]] = None,
+                            model_name: Optional[str] = None,
+                            history: Optional[List[Dict[str, str]]] = None,
+                            session_id: Optional[str] = None,
+                            **kwargs) -> AsyncIterator[str]:
+        """流式生成响应，逐段产出文本增量"""
+        model_interface = self._get_interface(model_name)
+        
+        has_output = False
+        try:
+            async for delta in model_interface.stream_response(
+                text=text,
+                images=images,
+                history=history,
+                session_id=session_id,
+                **kwargs
+            ):
+                has_output = True
+                yield delta
+        except Exception as e:
+            print(f"Model generation error: {e}")
+            if not has_output:
+                yield "[S.SPEAK] 抱歉，模型处理过程中出现错误。"
\ No newline at end of file
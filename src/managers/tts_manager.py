@@ -1,69 +1,152 @@
 import asyncio
-import aiohttp
-import os
-import time
-from typing import Optional
-from src.config.settings import TTS_API_URL
+from typing import List, Optional, Tuple
+import numpy as np
+from src.config.settings import TTS_API_URL, HTTP_CLIENT_CONFIG, TTS_AUDIO_CONFIG
+from src.utils.http_client import PooledHTTPClient
+from src.utils.audio_spool import AudioSpool
+
+# (采样率, 16bit 单声道 PCM)，可直接作为 Gradio Audio 组件的值
+AudioClip = Tuple[int, np.ndarray]
+
+def concat_clips(clips: List[AudioClip]) -> Optional[AudioClip]:
+    """把多段语音拼成一段，TTS 服务返回的采样率相同"""
+    if not clips:
+        return None
+    if len(clips) == 1:
+        return clips[0]
+    return clips[0][0], np.concatenate([audio for _, audio in clips])
 
 class TTSManager:
     def __init__(self, api_url: str = TTS_API_URL):
         self.api_url = api_url
-        self.audio_queue = asyncio.Queue()
         self.is_speaking = False
         self.current_audio = None
+        self.http_client = PooledHTTPClient(
+            total_timeout=HTTP_CLIENT_CONFIG['tts_timeout'],
+            config={**HTTP_CLIENT_CONFIG, 'max_retries': HTTP_CLIENT_CONFIG['tts_max_retries']},
+            retry_timeouts=False  # 合成开销大，超时说明服务端已饱和，不再重发
+        )
+        # 可选的磁盘存档，仅用于调试
+        self.spool = None
+        # 保留后台存档任务的引用，避免未完成时被回收
+        self.spool_tasks = set()
+        if TTS_AUDIO_CONFIG['spool_enabled']:
+            self.spool = AudioSpool(
+                directory=TTS_AUDIO_CONFIG['spool_dir'],
+                max_files=TTS_AUDIO_CONFIG['spool_max_files'],
+                max_bytes=TTS_AUDIO_CONFIG['spool_max_mb'] * 1024 * 1024,
+                retention=TTS_AUDIO_CONFIG['spool_retention']
+            )
+        
+    async def start(self):
+        await self.http_client.start()
         
-    async def synthesize_speech(self, text: str, session_id: str) -> Optional[str]:
-        """调用TTS API生成语音"""
+    async def close(self):
+        await self.http_client.close()
+        
+    async def synthesize_speech(self, text: str, session_id: str) -> Optional[AudioClip]:
+        """调用TTS API生成语音，返回内存中的 (采样率, PCM)"""
         if not text:
             return None
             
+        # 以 16bit 裸 PCM 返回，省去 WAV 编解码
         data = {
             'text': text,
             'speaker': '中文女',
-            'stream': False
+            'stream': True,
+            'audio_format': 'pcm'
         }
         
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.post(self.api_url, json=data) as response:
-                    if response.status == 200:
-                        audio_content = await response.read()
-                        # 保存音频文件
-                        os.makedirs(f"temp/audio/{session_id}", exist_ok=True)
-                        audio_path = f"temp/audio/{session_id}/tts_{int(time.time())}.wav"
-                        with open(audio_path, 'wb') as f:
-                            f.write(audio_content)
-                        return audio_path
-                        
+            status, audio_content, headers = await self.http_client.post(self.api_url, json=data)
+            if status == 200:
+                sample_rate = int(headers.get('X-Sample-Rate', TTS_AUDIO_CONFIG['sample_rate']))
+                audio = np.frombuffer(audio_content, dtype=np.int16)
+                if self.spool is not None:
+                    task = asyncio.create_task(asyncio.to_thread(self.spool.save, session_id, sample_rate, audio))
+                    self.spool_tasks.add(task)
+                    task.add_done_callback(self.spool_tasks.discard)
+                return sample_rate, audio
+            print(f"TTS Error: HTTP {status}")
+                
         except Exception as e:
             print(f"TTS Error: {e}")
             return None
             
-    async def queue_audio(self, audio_path: str):
-        """将音频加入播放队列"""
-        await self.audio_queue.put(audio_path)
-        if not self.is_speaking:
-            asyncio.create_task(self._process_audio_queue())
-            
     async def stop_current_audio(self):
         """停止当前音频播放"""
         self.is_speaking = False
         self.current_audio = None
-        # 清空队列
-        while not self.audio_queue.empty():
-            await self.audio_queue.get()
-            
-    async def _process_audio_queue(self):
-        """处理音频队列"""
-        self.is_speaking = True
-        while self.is_speaking:
+
+class SpeechSegmentQueue:
+    """逐句合成语音，最多 max_inflight 句同时合成，结果严格按提交顺序交给调用方"""
+    def __init__(self, tts_manager: TTSManager, session_id: str, max_inflight: int = 2):
+        self.tts_manager = tts_manager
+        self.session_id = session_id
+        self.slots = asyncio.Semaphore(max_inflight)
+        self.pending = asyncio.Queue()
+        # 已合成、等待返回给界面的语音，None 表示全部完成
+        self.ready = asyncio.Queue()
+        self.current_task = None
+        self.consumer = asyncio.create_task(self._drain())
+        
+    def submit(self, text: str):
+        """提交一个句子，有空闲名额时立即开始合成"""
+        if not text:
+            return
+        task = asyncio.create_task(self._synthesize(text))
+        self.pending.put_nowait(task)
+        
+    async def _synthesize(self, text: str) -> Optional[AudioClip]:
+        # 信号量按等待顺序唤醒，句子按提交顺序开始合成
+        async with self.slots:
+            return await self.tts_manager.synthesize_speech(text, self.session_id)
+        
+    def take_ready(self) -> List[AudioClip]:
+        """取出当前已合成的语音，不等待"""
+        clips = []
+        while not self.ready.empty():
+            audio = self.ready.get_nowait()
+            if audio is None:
+                # 保留结束标记给 close()
+                self.ready.put_nowait(None)
+                break
+            clips.append(audio)
+        return clips
+        
+    async def close(self):
+        """不再提交新句子，按顺序逐段返回剩余的语音"""
+        self.pending.put_nowait(None)
+        while True:
+            audio = await self.ready.get()
+            if audio is None:
+                break
+            yield audio
+        
+    def cancel(self):
+        """取消尚未完成的合成"""
+        self.consumer.cancel()
+        if self.current_task is not None:
+            self.current_task.cancel()
+        while not self.pending.empty():
+            task = self.pending.get_nowait()
+            if task is not None:
+                task.cancel()
+        self.ready.put_nowait(None)
+                
+    async def _drain(self):
+        """按顺序等待合成结果并交给 ready 队列"""
+        while True:
+            task = await self.pending.get()
+            if task is None:
+                self.ready.put_nowait(None)
+                break
+            self.current_task = task
             try:
-                audio_path = await self.audio_queue.get()
-                self.current_audio = audio_path
-                # 这里将返回音频路径给Gradio的Audio组件
-                yield audio_path
-                await asyncio.sleep(0.1)
+                audio = await task
+                if audio is not None:
+                    self.ready.put_nowait(audio)
             except asyncio.CancelledError:
-                break
+                raise
             except Exception as e:
-                print(f"Audio processing error: {e}")
\ No newline at end of file
+                print(f"TTS segment error: {e}")
\ No newline at end of file
@@ -0,0 +1,165 @@
+import asyncio
+import sys
+import os
+import argparse
+import time
+from typing import Dict, List
+from unittest.mock import patch
+import numpy as np
+from aiohttp import web
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(__file__))))
+
+from src.core.worker import Worker
+from src.config.settings import AUDIO_CONFIG
+
+# 每路麦克风的语音用恒定幅值 (序号+1) * SPEAKER_AMPLITUDE 表示，静音为 0
+SPEAKER_AMPLITUDE = 1000
+
+class MockASRServer:
+    """本地模拟 ASR 服务：根据音频中的非零样本值返回说话人标识，不同会话的音频混在一起时返回 MIXED"""
+    def __init__(self, port: int, delay: float):
+        self.port = port
+        self.delay = delay
+        self.runner = None
+        self.requests = 0
+
+    async def handle(self, request: web.Request) -> web.Response:
+        self.requests += 1
+        form = await request.post()
+        audio = np.frombuffer(form['files'].file.read(), dtype=np.int16)
+        values = np.unique(audio[audio != 0])
+        text = f"speaker-{values[0] // SPEAKER_AMPLITUDE}" if len(values) == 1 else "MIXED"
+        # 模拟识别耗时
+        await asyncio.sleep(self.delay)
+        return web.json_response({'result': [{'key': form['keys'], 'text': text}]})
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_post('/api/v1/asr', self.handle)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        await web.TCPSite(self.runner, '127.0.0.1', self.port).start()
+
+    async def stop(self):
+        if self.runner:
+            await self.runner.cleanup()
+
+class EchoModelManager:
+    """只压测语音识别链路时代替 ModelManager，不加载模型，直接回显识别文本"""
+    async def stream_response(self, text, images=None, **kwargs):
+        yield f"[S.LISTEN] {text}"
+
+    def release_session(self, session_id: str):
+        pass
+
+class ASRLoadTester:
+    def __init__(self, args):
+        self.args = args
+        if args.use_model:
+            self.worker = Worker()
+        else:
+            # 在构造 Worker 之前替换，避免加载模型
+            with patch('src.core.worker.ModelManager', EchoModelManager):
+                self.worker = Worker()
+        self.mock_server = None
+        self.latencies: List[float] = []
+        self.transcripts: Dict[int, List[str]] = {}
+
+    async def initialize(self):
+        if not self.args.real_asr:
+            self.mock_server = MockASRServer(self.args.port, self.args.asr_delay)
+            await self.mock_server.start()
+            self.worker.asr_manager.api_url = f"http://127.0.0.1:{self.args.port}/api/v1/asr"
+            print(f"Mock ASR server: {self.worker.asr_manager.api_url}")
+        await self.worker.start()
+
+    async def simulate_stream(self, index: int, session_id: str):
+        """模拟一路麦克风输入：按实时速率交替发送语音和静音音频块"""
+        sample_rate = AUDIO_CONFIG['sample_rate']
+        chunk_samples = int(sample_rate * self.args.chunk_ms / 1000)
+        num_chunks = int(self.args.seconds * 1000 / self.args.chunk_ms)
+        speech_chunks = int(self.args.utterance_ms / self.args.chunk_ms)
+        silence_chunks = int(self.args.pause_ms / self.args.chunk_ms)
+        speech = np.full(chunk_samples, (index + 1) * SPEAKER_AMPLITUDE, dtype=np.int16)
+        silence = np.zeros(chunk_samples, dtype=np.int16)
+        self.transcripts[index] = []
+
+        # 最后补一段静音，让最后一句结束
+        for i in range(num_chunks + silence_chunks):
+            in_speech = i < num_chunks and i % (speech_chunks + silence_chunks) < speech_chunks
+            chunk = speech if in_speech else silence
+            start = time.perf_counter()
+            result = await self.worker.process_input(
+                session_id=session_id,
+                audio_chunk=chunk
+            )
+            elapsed = time.perf_counter() - start
+            self.latencies.append(elapsed)
+            if result:
+                self.transcripts[index].append(result['text'])
+            await asyncio.sleep(max(0.0, self.args.chunk_ms / 1000 - elapsed))
+
+    async def run_tests(self):
+        await self.initialize()
+        try:
+            sessions = [self.worker.session_manager.create_session() for _ in range(self.args.streams)]
+            print(f"\nStreaming {self.args.streams} microphones for {self.args.seconds}s "
+                  f"({self.args.chunk_ms}ms chunks)...")
+
+            start = time.perf_counter()
+            await asyncio.gather(*[
+                self.simulate_stream(i, session_id) for i, session_id in enumerate(sessions)
+            ])
+            wall_time = time.perf_counter() - start
+
+            self.report(wall_time)
+        finally:
+            await self.worker.stop()
+            if self.mock_server:
+                await self.mock_server.stop()
+
+    def report(self, wall_time: float):
+        print(f"\n{'='*50}")
+        print(f"Wall time: {wall_time:.2f}s, chunks: {len(self.latencies)}")
+        latencies = np.array(self.latencies) * 1000
+        print(f"process_input latency (ms): mean {latencies.mean():.1f}, "
+              f"p50 {np.percentile(latencies, 50):.1f}, p95 {np.percentile(latencies, 95):.1f}, "
+              f"max {latencies.max():.1f}")
+
+        if self.args.real_asr:
+            for index, texts in self.transcripts.items():
+                print(f"Stream {index}: {len(texts)} transcripts")
+            return
+
+        passed = 0
+        for index, texts in self.transcripts.items():
+            expected = f"speaker-{index + 1}"
+            wrong = [text for text in texts if text != expected]
+            if texts and not wrong:
+                passed += 1
+                print(f"✓ Stream {index}: {len(texts)} transcripts, all {expected}")
+            else:
+                print(f"✗ Stream {index}: {len(texts)} transcripts, {len(wrong)} wrong, e.g. {wrong[:3]}")
+        print(f"\nIsolation: {passed}/{len(self.transcripts)} streams clean, "
+              f"{self.mock_server.requests} ASR requests for {len(self.latencies)} chunks")
+
+def get_args():
+    parser = argparse.ArgumentParser(description='ASR load test with N simultaneous microphone streams')
+    parser.add_argument('--streams', type=int, default=8, help='number of simultaneous sessions')
+    parser.add_argument('--seconds', type=float, default=5, help='audio length of each stream')
+    parser.add_argument('--chunk_ms', type=int, default=100, help='microphone chunk size')
+    parser.add_argument('--utterance_ms', type=int, default=1500, help='speech length between pauses')
+    parser.add_argument('--pause_ms', type=int, default=800, help='silence between utterances')
+    parser.add_argument('--port', type=int, default=18765, help='mock ASR server port')
+    parser.add_argument('--asr_delay', type=float, default=0.05, help='mock ASR latency in seconds')
+    parser.add_argument('--real_asr', action='store_true', help='use the configured ASR service')
+    parser.add_argument('--use_model', action='store_true', help='run the real model on the transcripts')
+    return parser.parse_args()
+
+async def main():
+    tester = ASRLoadTester(get_args())
+    await tester.run_tests()
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,86 @@
+import sys
+import os
+from typing import List, Tuple
+import numpy as np
+
+# 添加项目根目录到Python路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(__file__))))
+
+from src.utils.vad import VoiceActivityDetector
+
+SAMPLE_RATE = 16000
+CHUNK_MS = 100
+
+def tone(seconds: float, amplitude: float, frequency: float = 220.0) -> np.ndarray:
+    """固定幅值的正弦波，模拟语音"""
+    t = np.arange(int(SAMPLE_RATE * seconds)) / SAMPLE_RATE
+    return (amplitude * np.sin(2 * np.pi * frequency * t)).astype(np.int16)
+
+def noise(seconds: float, amplitude: float, seed: int = 0) -> np.ndarray:
+    """平稳的高斯白噪声，模拟风扇、空调等背景噪声"""
+    rng = np.random.default_rng(seed)
+    samples = rng.normal(0, amplitude, int(SAMPLE_RATE * seconds))
+    return np.clip(samples, -32768, 32767).astype(np.int16)
+
+class VADTester:
+    def feed(self, audio: np.ndarray) -> List[np.ndarray]:
+        """按麦克风的块大小把音频送入新的检测器，返回切出的所有片段"""
+        vad = VoiceActivityDetector(sample_rate=SAMPLE_RATE)
+        chunk = SAMPLE_RATE * CHUNK_MS // 1000
+        segments = []
+        for start in range(0, len(audio), chunk):
+            segments.extend(segment.copy() for segment in vad.feed(audio[start:start + chunk]))
+        return segments
+
+    def check(self, description: str, segments: List[np.ndarray], expected: int) -> Tuple[int, int]:
+        lengths = ", ".join(f"{len(segment) / SAMPLE_RATE:.2f}s" for segment in segments)
+        if len(segments) == expected:
+            print(f"✓ {description}: {len(segments)} segments [{lengths}]")
+            return 1, 1
+        print(f"✗ {description}: expected {expected} segments, got {len(segments)} [{lengths}]")
+        return 0, 1
+
+    def test_constant_noise(self) -> Tuple[int, int]:
+        """高于绝对阈值的持续噪声不能被当作语音送去识别"""
+        print("\n=== Testing constant noise above the threshold ===")
+        success, total = 0, 0
+        # 约 -30 dBFS 和 -15 dBFS，都高于 -45 dBFS 的绝对阈值
+        for amplitude in [1000, 6000]:
+            s, t = self.check(f"noise amplitude {amplitude}", self.feed(noise(30, amplitude)), 0)
+            success += s
+            total += t
+        return success, total
+
+    def test_speech_in_silence(self) -> Tuple[int, int]:
+        """静音中的每句话各切出一个片段"""
+        print("\n=== Testing utterances separated by silence ===")
+        silence = np.zeros(SAMPLE_RATE, dtype=np.int16)
+        audio = np.concatenate([silence, tone(1.5, 3000), silence, tone(2.0, 3000), silence])
+        return self.check("two utterances", self.feed(audio), 2)
+
+    def test_speech_over_noise(self) -> Tuple[int, int]:
+        """噪声底跟上背景噪声之后，高出噪声的语音仍能被检测到"""
+        print("\n=== Testing utterances over background noise ===")
+        background = noise(20, 1000, seed=1)
+        start = 10 * SAMPLE_RATE
+        for offset in [0, 3 * SAMPLE_RATE, 6 * SAMPLE_RATE]:
+            speech = tone(1.5, 8000)
+            background[start + offset:start + offset + len(speech)] = np.clip(
+                background[start + offset:start + offset + len(speech)].astype(np.int32) + speech,
+                -32768, 32767
+            )
+        return self.check("three utterances", self.feed(background), 3)
+
+def run_tests():
+    tester = VADTester()
+    success, total = 0, 0
+    for test in [tester.test_constant_noise, tester.test_speech_in_silence, tester.test_speech_over_noise]:
+        s, t = test()
+        success += s
+        total += t
+
+    print("\n=== Test Results ===")
+    print(f"VAD: {success}/{total} tests passed ({success / total * 100:.1f}%)")
+
+if __name__ == "__main__":
+    run_tests()
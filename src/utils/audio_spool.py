@@ -0,0 +1,61 @@
+import os
+import time
+import uuid
+import wave
+import threading
+import numpy as np
+
+class AudioSpool:
+    """有界的磁盘音频存档，仅用于调试回放，不在回复路径上
+
+    超过保留时间、文件数或总大小上限时删除最旧的文件。
+    """
+    def __init__(self,
+                 directory: str = "temp/audio",
+                 max_files: int = 200,
+                 max_bytes: int = 200 * 1024 * 1024,
+                 retention: float = 3600):
+        self.directory = directory
+        self.max_files = max_files
+        self.max_bytes = max_bytes
+        self.retention = retention
+        self.lock = threading.Lock()
+
+    def save(self, session_id: str, sample_rate: int, audio: np.ndarray) -> str:
+        """将 16bit PCM 写为 WAV 文件并执行淘汰，返回文件路径"""
+        session_dir = os.path.join(self.directory, session_id)
+        os.makedirs(session_dir, exist_ok=True)
+        # 毫秒时间戳 + 随机后缀，同一秒内的多条回复不会互相覆盖
+        audio_path = os.path.join(session_dir, f"tts_{int(time.time() * 1000)}_{uuid.uuid4().hex[:8]}.wav")
+        with wave.open(audio_path, 'wb') as f:
+            f.setnchannels(1)
+            f.setsampwidth(2)
+            f.setframerate(sample_rate)
+            f.writeframes(audio.astype(np.int16).tobytes())
+        self.evict()
+        return audio_path
+
+    def evict(self):
+        """按保留时间、文件数和总大小淘汰最旧的文件"""
+        with self.lock:
+            files = []
+            for root, _, names in os.walk(self.directory):
+                for name in names:
+                    path = os.path.join(root, name)
+                    try:
+                        stat = os.stat(path)
+                    except FileNotFoundError:
+                        continue
+                    files.append((stat.st_mtime, stat.st_size, path))
+            files.sort()
+            now = time.time()
+            total_bytes = sum(size for _, size, _ in files)
+            for i, (mtime, size, path) in enumerate(files):
+                remaining = len(files) - i
+                if now - mtime <= self.retention and remaining <= self.max_files and total_bytes <= self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total_bytes -= size
@@ -2,6 +2,7 @@ from typing import Dict, Any, Optional
 import time
 import hashlib
 import json
+import numpy as np
 
 class ResponseCache:
     def __init__(self, max_size: int = 1000, ttl: int = 3600):
@@ -13,7 +14,9 @@ class ResponseCache:
         """生成缓存键"""
         key_data = {
             "text": text,
-            "images": images if images else None
+            # 图像数组不能直接序列化，使用内容摘要
+            "images": [hashlib.md5(np.ascontiguousarray(image).tobytes()).hexdigest()
+                       for image in images] if images else None
         }
         key_str = json.dumps(key_data, sort_keys=True)
         return hashlib.md5(key_str.encode()).hexdigest()
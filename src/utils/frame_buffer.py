@@ -0,0 +1,51 @@
+from typing import List, Optional, Tuple
+import numpy as np
+
+class FrameRingBuffer:
+    """预分配的视频帧环形缓冲区
+
+    帧直接写入预分配数组的槽位（slot 取出可写视图，处理完后 commit），同时保存每帧的时间戳
+    和用于比较画面差异的灰度缩略图（签名）。
+    """
+    def __init__(self,
+                 capacity: int,
+                 height: int,
+                 width: int,
+                 channels: int = 3,
+                 signature_shape: Tuple[int, int] = (24, 32)):
+        self.capacity = capacity
+        self.frames = np.zeros((capacity, height, width, channels), dtype=np.uint8)
+        self.timestamps = np.zeros(capacity, dtype=np.float64)
+        self.signatures = np.zeros((capacity,) + tuple(signature_shape), dtype=np.float32)
+        self.next_index = 0
+        self.count = 0
+
+    def __len__(self) -> int:
+        return self.count
+
+    def slot(self) -> np.ndarray:
+        """下一个写入位置的视图，commit 之前不计入缓冲区"""
+        return self.frames[self.next_index]
+
+    def commit(self, timestamp: float, signature: np.ndarray):
+        """确认写入 slot 中的帧，覆盖最早的一帧"""
+        self.timestamps[self.next_index] = timestamp
+        self.signatures[self.next_index] = signature
+        self.next_index = (self.next_index + 1) % self.capacity
+        self.count = min(self.count + 1, self.capacity)
+
+    def latest_signature(self) -> Optional[np.ndarray]:
+        if self.count == 0:
+            return None
+        return self.signatures[(self.next_index - 1) % self.capacity]
+
+    def recent_indices(self, max_age: Optional[float] = None, now: Optional[float] = None) -> List[int]:
+        """从新到旧返回帧的槽位索引，max_age 秒之前的帧不返回"""
+        indices = [(self.next_index - 1 - i) % self.capacity for i in range(self.count)]
+        if max_age is not None and now is not None:
+            indices = [i for i in indices if now - self.timestamps[i] <= max_age]
+        return indices
+
+    def clear(self):
+        self.next_index = 0
+        self.count = 0
@@ -0,0 +1,99 @@
+import asyncio
+import random
+from typing import Any, Callable, Mapping, Optional, Tuple, Union
+import aiohttp
+from src.config.settings import HTTP_CLIENT_CONFIG
+
+# 这些状态码视为服务端暂时不可用，可以重试
+RETRY_STATUS = (429, 502, 503, 504)
+
+class PooledHTTPClient:
+    """长连接复用的 HTTP 客户端，带连接数限制、超时和指数退避重试
+
+    total_timeout 是一次 post 包括所有重试在内的总时限。retry_timeouts 为 False 时超时不重试，
+    用于 TTS 这类开销大的请求，超时通常说明服务端已饱和，重发只会加重负载。
+    """
+    def __init__(self,
+                 total_timeout: float = HTTP_CLIENT_CONFIG['total_timeout'],
+                 config: dict = HTTP_CLIENT_CONFIG,
+                 retry_timeouts: bool = True):
+        self.config = config
+        self.total_timeout = total_timeout
+        self.retry_timeouts = retry_timeouts
+        self.session: Optional[aiohttp.ClientSession] = None
+
+    async def start(self):
+        """创建会话和连接池，未显式调用时在第一次请求时创建"""
+        if self.session is not None and not self.session.closed:
+            return
+        connector = aiohttp.TCPConnector(
+            limit=self.config['limit'],
+            limit_per_host=self.config['limit_per_host'],
+            keepalive_timeout=self.config['keepalive_timeout'],
+            ttl_dns_cache=self.config['dns_cache_ttl']
+        )
+        timeout = aiohttp.ClientTimeout(
+            total=self.total_timeout,
+            connect=self.config['connect_timeout']
+        )
+        self.session = aiohttp.ClientSession(connector=connector, timeout=timeout)
+
+    async def close(self):
+        """关闭会话并释放连接池"""
+        if self.session is not None and not self.session.closed:
+            await self.session.close()
+        self.session = None
+
+    async def post(self,
+                   url: str,
+                   json: Any = None,
+                   data: Union[None, Any, Callable[[], Any]] = None) -> Tuple[int, bytes, Mapping[str, str]]:
+        """发送 POST 请求并返回状态码、响应体和响应头
+
+        data 为可调用对象时每次尝试都会重新构造（FormData 只能发送一次）。
+        连接错误、超时和 RETRY_STATUS 会按指数退避重试，重试用尽或总时限内来不及再试一次时
+        返回最后的状态或抛出异常。
+        """
+        await self.start()
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.total_timeout
+        max_retries = self.config['max_retries']
+        last_response = None
+        for attempt in range(max_retries + 1):
+            delay = self.config['backoff_base'] * (2 ** attempt) * (1 + random.random() * 0.5)
+            # 每次尝试只能用剩余的时间；aiohttp 中 total=0 表示不限时，时间用完时不再发送
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                if last_response is not None:
+                    return last_response
+                raise asyncio.TimeoutError()
+            timeout = aiohttp.ClientTimeout(
+                total=remaining,
+                connect=self.config['connect_timeout']
+            )
+            try:
+                body = data() if callable(data) else data
+                async with self.session.post(url, json=json, data=body, timeout=timeout) as response:
+                    content = await response.read()
+                    if response.status not in RETRY_STATUS or attempt == max_retries:
+                        return response.status, content, response.headers
+                    # 服务端给出的 Retry-After 优先
+                    retry_after = response.headers.get('Retry-After')
+                    if retry_after is not None and retry_after.isdigit():
+                        delay = max(delay, float(retry_after))
+                    last_response = (response.status, content, response.headers)
+            except asyncio.TimeoutError:
+                if attempt == max_retries or not self.retry_timeouts:
+                    raise
+                last_response = None
+            except aiohttp.ClientConnectionError:
+                if attempt == max_retries:
+                    raise
+                last_response = None
+            delay = min(delay, self.config['backoff_max'])
+            if loop.time() + delay >= deadline:
+                # 总时限内来不及再试
+                if last_response is not None:
+                    return last_response
+                raise asyncio.TimeoutError()
+            await asyncio.sleep(delay)
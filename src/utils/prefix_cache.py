@@ -0,0 +1,100 @@
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+import torch
+
+def cache_bytes(past_key_values: Any) -> int:
+    """KV cache 占用的显存字节数，兼容新旧版本 transformers 的 DynamicCache"""
+    if hasattr(past_key_values, "layers"):
+        tensors = [t for layer in past_key_values.layers for t in (layer.keys, layer.values) if t is not None]
+    else:
+        tensors = list(past_key_values.key_cache) + list(past_key_values.value_cache)
+    return sum(t.numel() * t.element_size() for t in tensors)
+
+class SessionPrefixCache:
+    """按会话保存上一轮结束时的 KV cache，下一轮只需 prefill 新增的部分
+
+    新一轮的 input_ids 与缓存的 token 取最长公共前缀，KV cache 裁剪到该长度后交给 generate。
+    生成期间缓存项由该请求独占，结束后连同生成的 token 一起放回。所有会话共享 max_bytes
+    的显存预算，超出时淘汰最久未用的会话。每项可附带调用方的元数据，随缓存项一起淘汰。
+    """
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.entries: "OrderedDict[str, Tuple[torch.Tensor, Any, int, Any]]" = OrderedDict()
+        self.bytes = 0
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.hits = 0
+        self.reused_tokens = 0
+        self.prompt_tokens = 0
+        self.evictions = 0
+
+    def metadata(self, session_id: str) -> Optional[Any]:
+        """会话缓存项附带的元数据，没有缓存时返回 None"""
+        with self.lock:
+            entry = self.entries.get(session_id)
+            return entry[3] if entry is not None else None
+
+    def acquire(self, session_id: str, input_ids: torch.Tensor) -> Optional[Any]:
+        """取出会话的 KV cache 并裁剪到与 input_ids 的公共前缀，无可复用部分时返回 None"""
+        with self.lock:
+            entry = self.entries.pop(session_id, None)
+            if entry is not None:
+                self.bytes -= entry[2]
+            self.requests += 1
+            self.prompt_tokens += len(input_ids)
+        if entry is None:
+            return None
+
+        token_ids, past_key_values, _, _ = entry
+        # 至少留一个 token 给本轮 prefill
+        n = min(len(token_ids), len(input_ids) - 1)
+        mismatch = (token_ids[:n] != input_ids[:n].cpu()).nonzero()
+        prefix_len = int(mismatch[0]) if len(mismatch) else n
+        if prefix_len == 0:
+            return None
+        past_key_values.crop(prefix_len)
+        with self.lock:
+            self.hits += 1
+            self.reused_tokens += prefix_len
+        return past_key_values
+
+    def release(self, session_id: str, token_ids: torch.Tensor, past_key_values: Any, metadata: Any = None):
+        """生成结束后放回 KV cache，token_ids 为 prompt 加生成的 token"""
+        token_ids = token_ids[:past_key_values.get_seq_length()].cpu()
+        size = cache_bytes(past_key_values)
+        if size > self.max_bytes:
+            return
+        with self.lock:
+            old = self.entries.pop(session_id, None)
+            if old is not None:
+                self.bytes -= old[2]
+            self.entries[session_id] = (token_ids, past_key_values, size, metadata)
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                _, (_, _, evicted_size, _) = self.entries.popitem(last=False)
+                self.bytes -= evicted_size
+                self.evictions += 1
+
+    def drop(self, session_id: str):
+        """会话结束时释放其 KV cache"""
+        with self.lock:
+            entry = self.entries.pop(session_id, None)
+            if entry is not None:
+                self.bytes -= entry[2]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        with self.lock:
+            return {
+                "sessions": len(self.entries),
+                "mb": self.bytes / 1024**2,
+                "requests": self.requests,
+                "hit_rate": self.hits / self.requests if self.requests else 0.0,
+                "reused_token_ratio": self.reused_tokens / self.prompt_tokens if self.prompt_tokens else 0.0,
+                "evictions": self.evictions
+            }
@@ -0,0 +1,110 @@
+from typing import Optional
+import numpy as np
+
+class PCMRingBuffer:
+    """定长、预分配的 PCM 环形缓冲区
+
+    数据在底层数组中镜像写两份（位置 p 和 p + capacity），因此任意不超过容量的连续区间都能以
+    零拷贝视图取出，不需要 np.concatenate。写入时统一转换为缓冲区的采样格式和采样率。
+
+    溢出策略：
+        drop_oldest: 丢弃最早的样本腾出空间
+        drop_newest: 丢弃放不下的新样本
+        error: 抛出 BufferError
+    """
+    OVERFLOW_POLICIES = ('drop_oldest', 'drop_newest', 'error')
+
+    def __init__(self,
+                 capacity: int,
+                 dtype=np.int16,
+                 sample_rate: int = 16000,
+                 overflow: str = 'drop_oldest'):
+        if overflow not in self.OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy: {overflow}")
+        self.capacity = capacity
+        self.dtype = np.dtype(dtype)
+        self.sample_rate = sample_rate
+        self.overflow = overflow
+        self.data = np.zeros(2 * capacity, dtype=self.dtype)
+        self.start = 0
+        self.size = 0
+        self.dropped = 0
+
+    def __len__(self) -> int:
+        return self.size
+
+    @property
+    def free(self) -> int:
+        return self.capacity - self.size
+
+    def convert(self, samples: np.ndarray, sample_rate: Optional[int] = None) -> np.ndarray:
+        """转换为单声道、缓冲区的采样格式和采样率"""
+        samples = np.asarray(samples)
+        if samples.ndim > 1:
+            # (样本数, 声道数) 取平均得到单声道
+            samples = samples.mean(axis=1).astype(samples.dtype)
+
+        if sample_rate is not None and sample_rate != self.sample_rate and len(samples) > 0:
+            # 线性插值重采样，语音识别对此不敏感
+            x = self._to_float(samples)
+            num_out = int(round(len(x) * self.sample_rate / sample_rate))
+            positions = np.arange(num_out) * (sample_rate / self.sample_rate)
+            samples = np.interp(positions, np.arange(len(x)), x).astype(np.float32)
+
+        if samples.dtype == self.dtype:
+            return samples
+        if np.issubdtype(self.dtype, np.integer):
+            scale = np.iinfo(self.dtype).max
+            return (np.clip(self._to_float(samples), -1.0, 1.0) * scale).astype(self.dtype)
+        return self._to_float(samples).astype(self.dtype)
+
+    @staticmethod
+    def _to_float(samples: np.ndarray) -> np.ndarray:
+        if np.issubdtype(samples.dtype, np.integer):
+            return samples.astype(np.float32) / np.iinfo(samples.dtype).max
+        return samples.astype(np.float32, copy=False)
+
+    def write(self, samples: np.ndarray, sample_rate: Optional[int] = None) -> int:
+        """写入样本，返回实际写入的样本数"""
+        samples = self.convert(samples, sample_rate)
+        n = len(samples)
+        if n > self.free:
+            if self.overflow == 'error':
+                raise BufferError(f"PCM ring buffer overflow: {n} samples, {self.free} free")
+            if self.overflow == 'drop_newest':
+                self.dropped += n - self.free
+                samples = samples[:self.free]
+            else:
+                samples = samples[-self.capacity:]
+                self.dropped += n - self.free
+                self.consume(len(samples) - self.free)
+            n = len(samples)
+
+        end = (self.start + self.size) % self.capacity
+        first = min(n, self.capacity - end)
+        for offset in (0, self.capacity):
+            self.data[offset + end:offset + end + first] = samples[:first]
+            self.data[offset:offset + n - first] = samples[first:]
+        self.size += n
+        return n
+
+    def view(self, n: Optional[int] = None, offset: int = 0) -> np.ndarray:
+        """从最早的样本起第 offset 个开始，取 n 个样本的零拷贝视图
+
+        视图与缓冲区共享内存，被 consume 的区域会在之后的写入中被覆盖。
+        """
+        if n is None:
+            n = self.size - offset
+        n = max(0, min(n, self.size - offset))
+        begin = self.start + offset
+        return self.data[begin:begin + n]
+
+    def consume(self, n: int):
+        """丢弃最早的 n 个样本"""
+        n = min(n, self.size)
+        self.start = (self.start + n) % self.capacity
+        self.size -= n
+
+    def clear(self):
+        self.start = 0
+        self.size = 0
@@ -0,0 +1,58 @@
+from typing import List, Optional
+from qwen_voice.cosyvoice.utils.frontend_utils import (
+    ZH_SENTENCE_PUNCTUATION,
+    COMMA_PUNCTUATION,
+    CLOSING_QUOTES
+)
+
+class StreamingSentenceSplitter:
+    """将流式输出的文本按句切分，规则与 CosyVoice 的 split_paragraph 保持一致"""
+    def __init__(self, min_len: int = 5, max_len: int = 80):
+        self.min_len = min_len
+        self.max_len = max_len
+        self.buffer = ""
+
+    def _find_boundary(self) -> int:
+        """返回第一个可切分位置（句末标点之后），没有则返回 -1"""
+        text = self.buffer
+        # 最后一个字符之后的内容未知，暂不切分（可能是引号或小数）
+        for i in range(len(text) - 1):
+            c = text[i]
+            if c not in ZH_SENTENCE_PUNCTUATION:
+                continue
+            # 跳过小数点，例如 3.14
+            if c == '.' and i > 0 and text[i - 1].isdigit() and text[i + 1].isdigit():
+                continue
+            end = i + 1
+            # 标点后紧跟引号时一并切出
+            if text[end] in CLOSING_QUOTES:
+                end += 1
+            if len(text[:end].strip()) >= self.min_len:
+                return end
+        # 句子过长时在逗号处强制切分
+        if len(text) > self.max_len:
+            for i in range(len(text) - 2, -1, -1):
+                if text[i] in COMMA_PUNCTUATION:
+                    return i + 1
+            return self.max_len
+        return -1
+
+    def feed(self, text: str) -> List[str]:
+        """追加文本，返回已完整的句子"""
+        self.buffer += text
+        sentences = []
+        while True:
+            end = self._find_boundary()
+            if end < 0:
+                break
+            sentence = self.buffer[:end].strip()
+            self.buffer = self.buffer[end:]
+            if sentence:
+                sentences.append(sentence)
+        return sentences
+
+    def flush(self) -> Optional[str]:
+        """返回缓冲区剩余的文本"""
+        sentence = self.buffer.strip()
+        self.buffer = ""
+        return sentence or None
@@ -0,0 +1,151 @@
+from collections import deque
+from typing import List, Optional
+import numpy as np
+from src.utils.ring_buffer import PCMRingBuffer
+
+class VoiceActivityDetector:
+    """基于短时能量的流式语音端点检测
+
+    音频按固定帧长切分，帧能量高于 max(绝对阈值, 噪声底 + 裕量) 视为语音。噪声底取最近
+    noise_window_seconds 内帧能量的最小值（最小值统计），语音帧也参与统计，持续的背景噪声在一个窗口
+    之后就成为噪声底。连续 start_ms 的语音触发一句的开始（带上 pre_roll_ms 的前导音频），静音持续
+    end_silence_ms 或长度达到 max_utterance_seconds 时结束一句；短于 min_speech_ms，或峰值能量
+    没有高出结束时噪声底的片段视为噪声丢弃。
+    """
+    NOISE_BLOCKS = 10
+
+    def __init__(self,
+                 sample_rate: int = 16000,
+                 frame_ms: int = 30,
+                 threshold_db: float = -45.0,
+                 noise_margin_db: float = 10.0,
+                 noise_window_seconds: float = 5.0,
+                 start_ms: int = 90,
+                 end_silence_ms: int = 500,
+                 pre_roll_ms: int = 300,
+                 min_speech_ms: int = 250,
+                 max_utterance_seconds: float = 10.0,
+                 buffer: Optional[PCMRingBuffer] = None):
+        self.frame_size = sample_rate * frame_ms // 1000
+        self.threshold_db = threshold_db
+        self.noise_margin_db = noise_margin_db
+        self.noise_db = threshold_db - noise_margin_db
+        # 窗口分成若干块，每块只保留最小值；初始时用默认噪声底填满
+        self.noise_block_frames = max(1, int(noise_window_seconds * 1000 / frame_ms) // self.NOISE_BLOCKS)
+        self.noise_blocks = deque([self.noise_db] * self.NOISE_BLOCKS, maxlen=self.NOISE_BLOCKS)
+        self.block_min = np.inf
+        self.block_count = 0
+        self.start_frames = max(1, start_ms // frame_ms)
+        self.end_frames = max(1, end_silence_ms // frame_ms)
+        self.pad_frames = pre_roll_ms // frame_ms
+        self.pre_roll_frames = max(self.pad_frames, self.start_frames)
+        self.min_speech_frames = max(1, min_speech_ms // frame_ms)
+
+        # 待检测的音频、句首前导音频和当前这句都保存在同一个环形缓冲区里
+        if buffer is None:
+            capacity = int(sample_rate * max_utterance_seconds) + (self.pre_roll_frames + 2) * self.frame_size
+            buffer = PCMRingBuffer(capacity, sample_rate=sample_rate)
+        self.buffer = buffer
+        # 缓冲区里至少留出一帧的空间，保证写入不会覆盖尚未结束的句子
+        self.max_frames = min(int(max_utterance_seconds * 1000 / frame_ms),
+                              buffer.capacity // self.frame_size - 2)
+
+        self.position = 0  # 缓冲区中已检测过的样本数
+        self.triggered = False
+        self.voiced_run = 0
+        self.silence_run = 0
+        self.speech_frames = 0
+        self.peak_db = -np.inf  # 当前这句语音帧的最大能量
+
+    def _energy_db(self, frames: np.ndarray) -> np.ndarray:
+        """每帧的 RMS 能量 (dBFS)"""
+        x = frames.astype(np.float32)
+        if np.issubdtype(frames.dtype, np.integer):
+            x /= np.iinfo(frames.dtype).max
+        return 10 * np.log10(np.mean(x * x, axis=1) + 1e-10)
+
+    def feed(self, audio_chunk: np.ndarray, sample_rate: Optional[int] = None) -> List[np.ndarray]:
+        """输入一段音频，返回其中已经结束的语音片段（可能为空）
+
+        返回的片段是缓冲区的零拷贝视图，在下一次 feed 之前有效。
+        """
+        samples = self.buffer.convert(audio_chunk, sample_rate)
+        segments = []
+        offset = 0
+        while offset < len(samples):
+            if segments:
+                # 继续写入可能覆盖已返回的片段，少见的情况下复制一份
+                segments = [segment.copy() for segment in segments]
+            n = min(len(samples) - offset, self.buffer.free)
+            self.buffer.write(samples[offset:offset + n])
+            offset += n
+            self._detect(segments)
+        return segments
+
+    def _detect(self, segments: List[np.ndarray]):
+        """逐帧检测缓冲区中新写入的音频"""
+        num_frames = (len(self.buffer) - self.position) // self.frame_size
+        if num_frames == 0:
+            return
+        frames = self.buffer.view(num_frames * self.frame_size, self.position).reshape(num_frames, self.frame_size)
+
+        for energy in self._energy_db(frames):
+            is_speech = energy > self._speech_threshold()
+            self._update_noise(energy)
+            self.position += self.frame_size
+            if is_speech:
+                self.peak_db = max(self.peak_db, energy)
+
+            if not self.triggered:
+                self.voiced_run = self.voiced_run + 1 if is_speech else 0
+                if not is_speech:
+                    self.peak_db = -np.inf
+                if self.voiced_run >= self.start_frames:
+                    self.triggered = True
+                    self.speech_frames = self.voiced_run
+                    self.silence_run = 0
+                else:
+                    # 只保留句首前导音频
+                    excess = self.position - self.pre_roll_frames * self.frame_size
+                    if excess > 0:
+                        self.buffer.consume(excess)
+                        self.position -= excess
+                continue
+
+            if is_speech:
+                self.speech_frames += 1
+                self.silence_run = 0
+            else:
+                self.silence_run += 1
+            if self.silence_run >= self.end_frames or self.position >= self.max_frames * self.frame_size:
+                segment = self._end_utterance()
+                if segment is not None:
+                    segments.append(segment)
+
+    def _speech_threshold(self) -> float:
+        return max(self.threshold_db, self.noise_db + self.noise_margin_db)
+
+    def _update_noise(self, energy: float):
+        """噪声底 = 窗口内帧能量的最小值"""
+        self.block_min = min(self.block_min, energy)
+        self.block_count += 1
+        if self.block_count == self.noise_block_frames:
+            self.noise_blocks.append(self.block_min)
+            self.block_min = np.inf
+            self.block_count = 0
+        self.noise_db = min(min(self.noise_blocks), self.block_min)
+
+    def _end_utterance(self) -> Optional[np.ndarray]:
+        """结束当前这句，去掉多余的尾部静音"""
+        keep = self.position - max(0, self.silence_run - self.pad_frames) * self.frame_size
+        # 噪声底追上来之后整句都不再高于它，说明是持续的背景噪声
+        enough_speech = self.speech_frames >= self.min_speech_frames and self.peak_db > self._speech_threshold()
+        segment = self.buffer.view(keep) if enough_speech else None
+        self.buffer.consume(self.position)
+        self.position = 0
+        self.triggered = False
+        self.voiced_run = 0
+        self.silence_run = 0
+        self.speech_frames = 0
+        self.peak_db = -np.inf
+        return segment
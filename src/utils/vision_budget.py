@@ -0,0 +1,54 @@
+import math
+from typing import List, Tuple
+import numpy as np
+import cv2
+
+# Qwen2-VL 的 patch 为 14 像素，2x2 合并后每个视觉 token 对应 28x28 像素
+IMAGE_FACTOR = 28
+PIXELS_PER_TOKEN = IMAGE_FACTOR * IMAGE_FACTOR
+
+def smart_resize(height: int,
+                 width: int,
+                 factor: int = IMAGE_FACTOR,
+                 min_pixels: int = 4 * PIXELS_PER_TOKEN,
+                 max_pixels: int = 16384 * PIXELS_PER_TOKEN) -> Tuple[int, int]:
+    """与 Qwen2-VL 图像处理器相同的尺寸规则：边长取 factor 的倍数，面积限制在 [min_pixels, max_pixels]"""
+    h_bar = max(factor, round(height / factor) * factor)
+    w_bar = max(factor, round(width / factor) * factor)
+    if h_bar * w_bar > max_pixels:
+        beta = math.sqrt((height * width) / max_pixels)
+        h_bar = max(factor, math.floor(height / beta / factor) * factor)
+        w_bar = max(factor, math.floor(width / beta / factor) * factor)
+    elif h_bar * w_bar < min_pixels:
+        beta = math.sqrt(min_pixels / (height * width))
+        h_bar = math.ceil(height * beta / factor) * factor
+        w_bar = math.ceil(width * beta / factor) * factor
+    return h_bar, w_bar
+
+def fit_vision_budget(images: List[np.ndarray],
+                      token_budget: int,
+                      min_tokens: int,
+                      max_tokens: int) -> List[np.ndarray]:
+    """按每轮视觉 token 预算选择帧数和分辨率
+
+    预算不够每帧 min_tokens 时只保留最新的几帧（images 按时间顺序），
+    剩下的帧平分预算，每帧不超过 max_tokens，再按 Qwen2-VL 的尺寸规则缩放。
+    """
+    if not images:
+        return []
+    num_frames = max(1, min(len(images), token_budget // min_tokens))
+    images = images[-num_frames:]
+    frame_tokens = max(min_tokens, min(max_tokens, token_budget // num_frames))
+
+    resized = []
+    for image in images:
+        height, width = image.shape[:2]
+        new_height, new_width = smart_resize(
+            height, width,
+            min_pixels=min_tokens * PIXELS_PER_TOKEN,
+            max_pixels=frame_tokens * PIXELS_PER_TOKEN
+        )
+        if (new_height, new_width) != (height, width):
+            image = cv2.resize(image, (new_width, new_height), interpolation=cv2.INTER_AREA)
+        resized.append(image)
+    return resized
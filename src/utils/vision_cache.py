@@ -0,0 +1,121 @@
+import hashlib
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional
+import numpy as np
+import torch
+
+def frame_hash(image: np.ndarray) -> str:
+    """图像内容摘要，作为视觉编码缓存的键"""
+    digest = hashlib.blake2b(np.ascontiguousarray(image).data, digest_size=16)
+    digest.update(str(image.shape).encode())
+    return digest.hexdigest()
+
+class VisionEmbeddingCache:
+    """按帧摘要缓存视觉编码器输出的 LRU 缓存，按占用显存的字节数淘汰"""
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.entries: "OrderedDict[str, torch.Tensor]" = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+        # 当前线程正在生成的请求中各图像的键
+        self.local = threading.local()
+
+    @contextmanager
+    def use_keys(self, keys: Optional[List[str]]):
+        """在生成线程中设置本次请求图像的键，视觉编码器据此查缓存"""
+        self.local.keys = keys
+        try:
+            yield
+        finally:
+            self.local.keys = None
+
+    def current_keys(self) -> Optional[List[str]]:
+        return getattr(self.local, "keys", None)
+
+    def get(self, key: str) -> Optional[torch.Tensor]:
+        with self.lock:
+            embeds = self.entries.get(key)
+            if embeds is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return embeds
+
+    def put(self, key: str, embeds: torch.Tensor):
+        size = embeds.numel() * embeds.element_size()
+        if size > self.max_bytes:
+            return
+        with self.lock:
+            if key in self.entries:
+                old = self.entries.pop(key)
+                self.bytes -= old.numel() * old.element_size()
+            self.entries[key] = embeds
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.bytes -= evicted.numel() * evicted.element_size()
+                self.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self.entries),
+                "mb": self.bytes / 1024**2,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions
+            }
+
+class CachedVisionEncoder(torch.nn.Module):
+    """包装 Qwen2-VL 的视觉编码器，缓存命中的图像不再经过 ViT
+
+    pixel_values 按 grid_thw 拆成每张图像的 patch，只把未命中的图像送入编码器，
+    输出按图像顺序拼接，与原编码器的输出一致。没有设置键时直接调用原编码器。
+    """
+    def __init__(self, encoder: torch.nn.Module, cache: VisionEmbeddingCache):
+        super().__init__()
+        self.encoder = encoder
+        self.cache = cache
+        self.merge_unit = getattr(encoder, "spatial_merge_size", 2) ** 2
+
+    def __getattr__(self, name: str):
+        # get_dtype()/dtype 等属性转给原编码器
+        try:
+            return super().__getattr__(name)
+        except AttributeError:
+            return getattr(self.encoder, name)
+
+    def forward(self, hidden_states: torch.Tensor, grid_thw: torch.Tensor, **kwargs) -> torch.Tensor:
+        keys = self.cache.current_keys()
+        if keys is None or len(keys) != grid_thw.shape[0]:
+            return self.encoder(hidden_states, grid_thw=grid_thw, **kwargs)
+
+        patch_counts = grid_thw.prod(dim=1).tolist()
+        patches = hidden_states.split(patch_counts)
+        embeds = [self.cache.get(key) for key in keys]
+        missing = [i for i, embed in enumerate(embeds) if embed is None]
+        if missing:
+            outputs = self.encoder(
+                torch.cat([patches[i] for i in missing]),
+                grid_thw=grid_thw[missing],
+                **kwargs
+            )
+            outputs = outputs.split([patch_counts[i] // self.merge_unit for i in missing])
+            for i, output in zip(missing, outputs):
+                # 多张图像一起编码时复制一份，避免缓存项引用整块输出
+                embeds[i] = output if len(missing) == 1 else output.clone()
+                self.cache.put(keys[i], embeds[i])
+        return torch.cat(embeds)